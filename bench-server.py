@@ -0,0 +1,689 @@
+#!/usr/bin/env python3
+"""
+Viewpoints 伺服器壓力測試與效能量測 (start-server-fastapi.py)
+
+以 TestClient 直接呼叫 FastAPI app，資料寫入暫存目錄，不影響專案內的檔案。
+
+使用方式：
+    python3 bench-server.py stress [--requests 600] [--threads 32]
+    python3 bench-server.py users [--users 100000] [--storage sqlite]
+    python3 bench-server.py login-storm [--seconds 5] [--storm-threads 64]
+    python3 bench-server.py json [--cameras 10 50 100 250 500]
+    python3 bench-server.py workers [--workers 1 2 4] [--clients 8] [--min-scaling 0.7]
+    python3 bench-server.py proxy [--walls 50] [--delay 0.3]
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.resolve()
+
+
+def load_server(data_dir: str, storage: str = None):
+    # start-server-fastapi.py 檔名含連字號，需以檔案路徑載入
+    os.environ["VIEWPOINTS_DATA_DIR"] = data_dir
+    if storage:
+        os.environ["VIEWPOINTS_STORAGE"] = storage
+    spec = importlib.util.spec_from_file_location(
+        "viewpoints_server", BASE_DIR / "start-server-fastapi.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def login(client, username: str, password: str = "bench-password") -> dict:
+    client.post("/api/auth/register", json={"username": username, "password": password})
+    response = client.post(
+        "/api/auth/login", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def make_config(camera_count: int, title: str = "壓力測試") -> dict:
+    return {
+        "title": title,
+        "autoRefresh": True,
+        "refreshInterval": 60,
+        "layout": {"columns": 3, "rows": 2},
+        "cameras": [
+            {
+                "id": f"cam-{i}",
+                "name": f"監視器 {i}",
+                "type": "image",
+                "imageUrl": f"https://example.com/cam-{i}.jpg",
+                "location": "測試",
+                "category": "測試",
+            }
+            for i in range(camera_count)
+        ],
+    }
+
+
+def cmd_stress(args):
+    """並行 save / restore / get，確認讀取端永遠拿到完整的 JSON"""
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = load_server(data_dir)
+        failures = []
+        counts = {"save": 0, "restore": 0, "get": 0}
+        counts_lock = threading.Lock()
+
+        with TestClient(server.app) as client:
+            headers = login(client, "stress")
+            client.post("/api/config", json=make_config(5), headers=headers)
+
+            def run(i: int):
+                op = random.choices(["save", "restore", "get"], weights=[3, 1, 6])[0]
+                try:
+                    if op == "save":
+                        config = make_config(random.randint(0, 200), title=f"save-{i}")
+                        response = client.post("/api/config", json=config, headers=headers)
+                        if response.status_code != 200:
+                            failures.append(f"save {response.status_code}: {response.text}")
+                    elif op == "restore":
+                        backups = client.get("/api/config/backups", headers=headers).json()
+                        if backups.get("backups"):
+                            filename = random.choice(backups["backups"])["filename"]
+                            response = client.post(
+                                f"/api/config/backups/{filename}/restore", headers=headers
+                            )
+                            # 備份可能已被保留策略刪除，404 屬正常結果
+                            if response.status_code not in (200, 404):
+                                failures.append(
+                                    f"restore {response.status_code}: {response.text}"
+                                )
+                    else:
+                        response = client.get("/api/config", headers=headers)
+                        data = json.loads(response.content)
+                        if response.status_code != 200 or not server.validate_config(data):
+                            failures.append(f"get {response.status_code}: {response.text[:200]}")
+                except Exception as e:
+                    failures.append(f"{op}: {e!r}")
+                with counts_lock:
+                    counts[op] += 1
+
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(run, range(args.requests)))
+
+        # 最終檔案必須可解析，且不應殘留暫存檔
+        try:
+            json.loads(server.storage.read_config_bytes("stress"))
+        except Exception as e:
+            failures.append(f"final file: {e!r}")
+        leftovers = [f for f in os.listdir(data_dir) if f.endswith(".tmp")]
+        if leftovers:
+            failures.append(f"leftover temp files: {leftovers}")
+
+    print(f"requests: {counts}")
+    if failures:
+        print(f"❌ {len(failures)} failures")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        return 1
+    print("✅ 所有讀取皆為完整 JSON")
+    return 0
+
+
+def seed_users(server, count: int):
+    # 直接寫入儲存層，略過逐一雜湊密碼
+    password = server.get_password_hash("bench-password")
+    created_at = "2026-01-01T00:00:00"
+    if server.storage.name == "sqlite":
+        conn = sqlite3.connect(server.SQLITE_DB)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password, created_at) VALUES (?, ?, ?)",
+                ((f"seed{i}", password, created_at) for i in range(count)),
+            )
+        conn.close()
+    else:
+        server.save_users(
+            {f"seed{i}": {"password": password, "created_at": created_at} for i in range(count)}
+        )
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def cmd_users(args):
+    """在大量使用者下量測註冊、登入與配置讀寫延遲"""
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = load_server(data_dir, args.storage)
+        start = time.perf_counter()
+        seed_users(server, args.users)
+        print(f"storage: {server.storage.name}, seeded {args.users} users "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        results = {"register": [], "login": [], "save": [], "get": []}
+        with TestClient(server.app) as client:
+            for i in range(args.rounds):
+                username = f"bench{i}"
+                payload = {"username": username, "password": "bench-password"}
+                results["register"].append(
+                    timed(lambda: client.post("/api/auth/register", json=payload).raise_for_status())
+                )
+                token = {}
+
+                def do_login():
+                    response = client.post("/api/auth/login", data=payload)
+                    response.raise_for_status()
+                    token["value"] = response.json()["access_token"]
+
+                results["login"].append(timed(do_login))
+                headers = {"Authorization": f"Bearer {token['value']}"}
+                config = make_config(20)
+                results["save"].append(
+                    timed(lambda: client.post("/api/config", json=config, headers=headers).raise_for_status())
+                )
+                results["get"].append(
+                    timed(lambda: client.get("/api/config", headers=headers).raise_for_status())
+                )
+
+    for name, samples in results.items():
+        print(f"  {name:<9} avg {statistics.mean(samples):8.2f} ms   "
+              f"max {max(samples):8.2f} ms")
+    return 0
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def poll_config(client, headers: dict, seconds: float, threads: int) -> list:
+    # 模擬多面監視牆持續輪詢 /api/config
+    deadline = time.perf_counter() + seconds
+    samples = []
+    samples_lock = threading.Lock()
+
+    def run():
+        while time.perf_counter() < deadline:
+            elapsed = timed(lambda: client.get("/api/config", headers=headers).raise_for_status())
+            with samples_lock:
+                samples.append(elapsed)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(threads):
+            pool.submit(run)
+    return samples
+
+
+def cmd_login_storm(args):
+    """登入尖峰期間量測 /api/config 的 p50/p99 延遲"""
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = load_server(data_dir, args.storage)
+        with TestClient(server.app) as client:
+            headers = login(client, "wall")
+            client.post("/api/config", json=make_config(50), headers=headers)
+
+            baseline = poll_config(client, headers, args.seconds, args.pollers)
+
+            stop = threading.Event()
+            statuses = Counter()
+            payload = {"username": "wall", "password": "bench-password"}
+
+            def storm():
+                while not stop.is_set():
+                    statuses[client.post("/api/auth/login", data=payload).status_code] += 1
+
+            storm_threads = [threading.Thread(target=storm) for _ in range(args.storm_threads)]
+            for thread in storm_threads:
+                thread.start()
+            try:
+                during = poll_config(client, headers, args.seconds, args.pollers)
+            finally:
+                stop.set()
+                for thread in storm_threads:
+                    thread.join()
+
+            hasher = server.password_hasher.stats()
+
+    print(f"/api/config latency ({args.pollers} pollers, {args.seconds}s each)")
+    for name, samples in (("baseline", baseline), ("login storm", during)):
+        print(f"  {name:<12} n={len(samples):<6} p50 {percentile(samples, 50):7.2f} ms   "
+              f"p99 {percentile(samples, 99):7.2f} ms")
+    print(f"login responses: {dict(statuses)}")
+    print(f"password hasher: {hasher}")
+    return 0
+
+
+def throughput(fn, seconds: float) -> float:
+    # 在指定時間內重複執行，回傳每秒次數
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(10):
+            fn()
+        count += 10
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def cmd_json(args):
+    """比較標準庫 json 與伺服器編碼器 (有安裝 orjson 時使用) 的吞吐量"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = load_server(data_dir)
+        print(f"orjson: {'yes' if server.orjson is not None else 'no (標準庫)'}")
+        columns = ("json indent=2", "json compact", "server encode", "json.loads", "server decode")
+        print(f"{'cameras':>7} {'bytes':>8} " + "".join(f"{name:>16}" for name in columns))
+        for count in args.cameras:
+            config = make_config(count)
+            body = server.encode_json(config)
+            pretty = json.dumps(config, ensure_ascii=False, indent=2).encode("utf-8")
+            results = [
+                throughput(lambda: json.dumps(config, ensure_ascii=False, indent=2).encode("utf-8"),
+                           args.seconds),
+                throughput(lambda: json.dumps(config, ensure_ascii=False,
+                                              separators=(",", ":")).encode("utf-8"),
+                           args.seconds),
+                throughput(lambda: server.encode_json(config), args.seconds),
+                throughput(lambda: json.loads(pretty), args.seconds),
+                throughput(lambda: server.decode_json(body), args.seconds),
+            ]
+            print(f"{count:>7} {len(body):>8} " + "".join(f"{value:>14.0f}/s" for value in results))
+    return 0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def http_request(port: int, method: str, path: str, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def http_login(port: int, username: str, password: str = "bench-password") -> dict:
+    http_request(
+        port, "POST", "/api/auth/register",
+        json.dumps({"username": username, "password": password}),
+        {"Content-Type": "application/json"},
+    )
+    status, body = http_request(
+        port, "POST", "/api/auth/login",
+        urllib.parse.urlencode({"username": username, "password": password}),
+        {"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    if status != 200:
+        raise RuntimeError(f"login {username}: {status} {body[:200]!r}")
+    return {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+
+def wait_for_server(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            if http_request(port, "GET", "/")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def read_config_loop(port: int, headers: dict, seconds: float) -> int:
+    # 在獨立行程中以 keep-alive 連線持續讀取 /api/config，回傳完成的請求數
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        conn.request("GET", "/api/config", headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"GET /api/config: {response.status}")
+        count += 1
+    conn.close()
+    return count
+
+
+def cmd_workers(args):
+    """以真正的 uvicorn worker 行程量測 /api/config 讀取吞吐量，並檢查跨 worker 一致性"""
+    failures = []
+    rates = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        for workers in args.workers:
+            port = free_port()
+            env = {
+                **os.environ,
+                "VIEWPOINTS_DATA_DIR": data_dir,
+                "VIEWPOINTS_PORT": str(port),
+                "VIEWPOINTS_STORAGE": args.storage,
+            }
+            process = subprocess.Popen(
+                [sys.executable, str(BASE_DIR / "start-server-fastapi.py"), "--workers", str(workers)],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                wait_for_server(port, process)
+                headers = http_login(port, "wall")
+                http_request(
+                    port, "POST", "/api/config", json.dumps(make_config(args.cameras)),
+                    {**headers, "Content-Type": "application/json"},
+                )
+
+                with multiprocessing.Pool(args.clients) as pool:
+                    # 先暖機，等所有 worker 都啟動完成
+                    pool.starmap(read_config_loop, [(port, headers, args.warmup)] * args.clients)
+                    counts = pool.starmap(
+                        read_config_loop, [(port, headers, args.seconds)] * args.clients
+                    )
+                rates[workers] = sum(counts) / args.seconds
+
+                # 在不同 worker 上註冊與儲存，再確認每個 worker 都看得到結果
+                prefix = f"w{workers}u"
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    user_headers = list(pool.map(
+                        lambda i: http_login(port, f"{prefix}{i}"), range(args.users)
+                    ))
+                    list(pool.map(
+                        lambda item: http_request(
+                            port, "POST", "/api/config",
+                            json.dumps(make_config(item[0] % 7, title=f"{prefix}{item[0]}")),
+                            {**item[1], "Content-Type": "application/json"},
+                        ),
+                        enumerate(user_headers),
+                    ))
+                for i, user in enumerate(user_headers):
+                    for _ in range(workers * 2):
+                        status, body = http_request(port, "GET", "/api/config", headers=user)
+                        if status != 200 or json.loads(body)["title"] != f"{prefix}{i}":
+                            failures.append(f"{workers} workers, {prefix}{i}: {status} {body[:80]!r}")
+                            break
+            except Exception as e:
+                failures.append(f"{workers} workers: {e!r}")
+            finally:
+                process.terminate()
+                process.wait()
+
+    baseline_workers = min(rates) if rates else None
+    cpus = os.cpu_count() or 1
+    print(f"/api/config reads ({args.clients} client processes, {args.seconds}s, "
+          f"{args.cameras} cameras, storage {args.storage}, {cpus} CPUs)")
+    for workers, rate in rates.items():
+        scaling = rate / rates[baseline_workers]
+        print(f"  {workers:>2} workers  {rate:9.0f} req/s   x{scaling:.2f}")
+        if workers == baseline_workers:
+            continue
+        # 理想情況下吞吐量與 worker 數成正比；CPU 不足時 worker 互相搶 CPU，結果不代表擴充性
+        if cpus < workers:
+            print(f"     ⚠️ 只有 {cpus} 個 CPU，少於 {workers} 個 worker，略過擴充性判定")
+        elif scaling < workers / baseline_workers * args.min_scaling:
+            failures.append(
+                f"{workers} workers: x{scaling:.2f} of {baseline_workers} worker(s) "
+                f"(expected at least x{workers / baseline_workers * args.min_scaling:.2f})"
+            )
+    if failures:
+        print(f"❌ {len(failures)} failures")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        return 1
+    print("✅ 所有 worker 的註冊與配置讀寫結果一致")
+    return 0
+
+
+def start_stub_origin(delay: float):
+    """監視器來源的替身：一張 JPEG 與一個 HLS 直播清單，記錄每個路徑被請求的次數"""
+    hits = Counter()
+    hits_lock = threading.Lock()
+    image = b"\xff\xd8" + os.urandom(20000) + b"\xff\xd9"
+    playlist = (
+        "#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:0\n"
+        + "".join(f"#EXTINF:2.0,\nseg{i}.ts\n" for i in range(3))
+    ).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with hits_lock:
+                hits[self.path] += 1
+            # 回應前稍等，讓同時到達的請求互相重疊
+            time.sleep(delay)
+            if self.path == "/camera.jpg":
+                body, content_type = image, "image/jpeg"
+            elif self.path == "/live/index.m3u8":
+                body, content_type = playlist, "application/vnd.apple.mpegurl"
+            elif self.path.startswith("/live/seg"):
+                body, content_type = self.path.encode("ascii") * 10000, "video/mp2t"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    origin = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    return origin, hits
+
+
+def concurrent_get(client, walls: int, url: str, headers: dict = None) -> list:
+    # walls 個執行緒同時送出同一個請求
+    barrier = threading.Barrier(walls)
+
+    def wall(_):
+        barrier.wait()
+        return client.get(url, headers=headers)
+
+    with ThreadPoolExecutor(max_workers=walls) as pool:
+        return list(pool.map(wall, range(walls)))
+
+
+def cmd_proxy(args):
+    """以本機假來源驗證影像/HLS 代理：同時請求只抓一次上游、304 條件請求、拒絕竄改的簽章網址"""
+    from fastapi.testclient import TestClient
+
+    # 模組載入時讀取；假來源在 127.0.0.1，排程器關閉以便由監控牆的請求觸發抓取
+    os.environ["VIEWPOINTS_SNAPSHOT_ALLOW_PRIVATE"] = "1"
+    os.environ["VIEWPOINTS_SNAPSHOT_SCHEDULER"] = "0"
+    os.environ["VIEWPOINTS_CAMERA_PROBER"] = "0"
+    origin, hits = start_stub_origin(args.delay)
+    base = f"http://127.0.0.1:{origin.server_port}"
+    failures = []
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = load_server(data_dir)
+        with TestClient(server.app) as client:
+            headers = login(client, "wall")
+            token = headers["Authorization"].split()[1]
+            config = {
+                "title": "代理測試",
+                "refreshInterval": 60,
+                "cameras": [
+                    {"id": "image", "name": "影像", "type": "image", "imageUrl": f"{base}/camera.jpg"},
+                    {"id": "live", "name": "直播", "type": "hls", "hlsUrl": f"{base}/live/index.m3u8"},
+                ],
+            }
+            client.post("/api/config", json=config, headers=headers).raise_for_status()
+
+            # 影像：同時讀取同一部監視器只向上游抓取一次
+            start = time.perf_counter()
+            responses = concurrent_get(client, args.walls, "/api/snapshot/image", headers)
+            cold = (time.perf_counter() - start) * 1000
+            statuses = Counter(response.status_code for response in responses)
+            etags = {response.headers.get("etag") for response in responses}
+            if statuses != Counter({200: args.walls}):
+                failures.append(f"snapshot statuses: {dict(statuses)}")
+            if len(etags) != 1:
+                failures.append(f"snapshot ETags differ: {etags}")
+            if hits["/camera.jpg"] != 1:
+                failures.append(f"{args.walls} walls caused {hits['/camera.jpg']} upstream fetches (expected 1)")
+
+            # 條件請求：影像未更新時只回 304，不向上游抓取
+            etag = responses[0].headers["etag"]
+            last_modified = responses[0].headers["last-modified"]
+            checks = (
+                ("If-None-Match", etag, 304),
+                ("If-Modified-Since", last_modified, 304),
+                ("If-None-Match", '"stale"', 200),
+            )
+            for name, value, expected in checks:
+                response = client.get("/api/snapshot/image", headers={**headers, name: value})
+                if response.status_code != expected:
+                    failures.append(f"{name}: {value} -> {response.status_code} (expected {expected})")
+                elif expected == 304 and response.content:
+                    failures.append(f"{name}: 304 with a body")
+            revalidate = [
+                timed(lambda: client.get("/api/snapshot/image", headers={**headers, "If-None-Match": etag}))
+                for _ in range(args.requests)
+            ]
+            if hits["/camera.jpg"] != 1:
+                failures.append(f"conditional requests reached upstream ({hits['/camera.jpg']} fetches)")
+
+            # HLS：同一片段只下載一次
+            response = client.get("/api/hls/live/index.m3u8", params={"token": token})
+            if response.status_code != 200:
+                failures.append(f"index.m3u8: {response.status_code} {response.text[:200]}")
+                segments = []
+            else:
+                segments = [line for line in response.text.splitlines() if line and not line.startswith("#")]
+            if segments:
+                responses = concurrent_get(client, args.walls, segments[0])
+                statuses = Counter(response.status_code for response in responses)
+                if statuses != Counter({200: args.walls}):
+                    failures.append(f"segment statuses: {dict(statuses)}")
+                if hits["/live/seg0.ts"] != 1:
+                    failures.append(f"{args.walls} walls caused {hits['/live/seg0.ts']} segment fetches (expected 1)")
+
+                # 竄改過的簽章網址一律 404，且不會向任何上游發出請求
+                path, _, query = segments[0].partition("?")
+                params = dict(urllib.parse.parse_qsl(query))
+                internal = urllib.parse.quote(
+                    server.base64.urlsafe_b64encode(b"http://127.0.0.1:1/admin").decode("ascii").rstrip("=")
+                )
+                tampered = {
+                    "signature": f"{path[:-1]}{'A' if path[-1] != 'A' else 'B'}?{query}",
+                    "url": f"{path}?{query.replace('u=' + urllib.parse.quote(params['u']), 'u=' + internal)}",
+                    "camera": f"{path.replace('/live/', '/image/')}?{query}",
+                    "user": f"{path}?{query.replace('user=wall', 'user=other')}",
+                    "kind": f"{path.replace('/segment/', '/playlist/')}?{query}",
+                    "expired": server.hls_proxy_url(
+                        "live", "wall", int(time.time()) - 1, "segment", f"{base}/live/seg0.ts"
+                    ),
+                    "unsigned": f"/api/hls/live/segment/unsigned?{query}",
+                }
+                before = sum(hits.values())
+                for name, url in tampered.items():
+                    status = client.get(url).status_code
+                    if status != 404:
+                        failures.append(f"tampered HLS URL ({name}) -> {status} (expected 404)")
+                if sum(hits.values()) != before:
+                    failures.append("tampered HLS URLs reached upstream")
+            else:
+                failures.append("index.m3u8 contains no segments")
+
+            snapshot_stats = server.snapshot_cache.stats()
+            hls_stats = server.hls_cache.stats()
+
+    origin.shutdown()
+    print(f"snapshot: {args.walls} concurrent walls in {cold:.0f} ms (upstream delay {args.delay * 1000:.0f} ms), "
+          f"304 revalidation p50 {percentile(revalidate, 50):.2f} ms  p99 {percentile(revalidate, 99):.2f} ms")
+    print(f"snapshot cache: {snapshot_stats}")
+    print(f"hls cache: {hls_stats}")
+    print(f"upstream requests: {dict(hits)}")
+    if failures:
+        print(f"❌ {len(failures)} failures")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        return 1
+    print("✅ 同時請求合併為一次上游抓取，條件請求回覆 304，竄改的 HLS 網址皆被拒絕")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Viewpoints 伺服器壓力測試與效能量測")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stress = subparsers.add_parser("stress", help="並行 save/restore/get 一致性測試")
+    stress.add_argument("--requests", type=int, default=600)
+    stress.add_argument("--threads", type=int, default=32)
+    stress.set_defaults(func=cmd_stress)
+
+    users = subparsers.add_parser("users", help="大量使用者下的註冊/登入/配置延遲")
+    users.add_argument("--users", type=int, default=100000)
+    users.add_argument("--rounds", type=int, default=20)
+    users.add_argument("--storage", choices=["file", "sqlite"], default="sqlite")
+    users.set_defaults(func=cmd_users)
+
+    storm = subparsers.add_parser("login-storm", help="登入尖峰時的 /api/config 延遲")
+    storm.add_argument("--seconds", type=float, default=5)
+    storm.add_argument("--pollers", type=int, default=8)
+    storm.add_argument("--storm-threads", type=int, default=64)
+    storm.add_argument("--storage", choices=["file", "sqlite"], default="file")
+    storm.set_defaults(func=cmd_login_storm)
+
+    json_bench = subparsers.add_parser("json", help="配置 JSON 編碼/解碼吞吐量")
+    json_bench.add_argument("--cameras", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    json_bench.add_argument("--seconds", type=float, default=0.5)
+    json_bench.set_defaults(func=cmd_json)
+
+    workers = subparsers.add_parser("workers", help="多 worker 讀取吞吐量與一致性")
+    workers.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers.add_argument("--clients", type=int, default=8)
+    workers.add_argument("--seconds", type=float, default=5)
+    workers.add_argument("--warmup", type=float, default=2)
+    workers.add_argument("--cameras", type=int, default=50)
+    workers.add_argument("--users", type=int, default=20)
+    workers.add_argument("--storage", choices=["file", "sqlite"], default="file")
+    workers.add_argument("--min-scaling", type=float, default=0.7,
+                         help="相對於線性擴充的最低比例 (CPU 數不少於 worker 數時才判定)")
+    workers.set_defaults(func=cmd_workers)
+
+    proxy = subparsers.add_parser("proxy", help="影像/HLS 代理的請求合併、304 與簽章驗證")
+    proxy.add_argument("--walls", type=int, default=50)
+    proxy.add_argument("--delay", type=float, default=0.3)
+    proxy.add_argument("--requests", type=int, default=200)
+    proxy.set_defaults(func=cmd_proxy)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
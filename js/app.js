@@ -1,15 +1,22 @@
 /**
  * 主程式邏輯
  */
-import { fetchConfig } from './config.js';
+import { fetchConfig, watchConfig } from './config.js';
 import { setupUI, setupFullscreen, updateRefreshStatus } from './ui.js';
-import { loadAllImages, loadImage } from './image-loader.js';
-import { initHlsPlayers } from './player.js';
+import {
+    loadAllImages, loadImage, loadFullImage, refreshDueImages, releaseImages, setRefreshInterval, useMosaic
+} from './image-loader.js';
+import { hlsSource, initHlsPlayers, disposeHlsPlayers } from './player.js';
+import { refreshHealth, watchHealth } from './health.js';
+
+const REFRESH_CHECK_INTERVAL = 1000;
 
 let config = null;
 let autoRefreshInterval = null;
 let autoRefreshEnabled = false;
 let showFullscreen = null;
+// 目前畫面上的監視器：{ key: 配置內容, element }
+let cameraItems = [];
 
 async function init() {
     config = await fetchConfig();
@@ -17,6 +24,7 @@ async function init() {
 
     // 1. 初始化介面
     setupUI(config);
+    setRefreshInterval(config.refreshInterval);
     showFullscreen = setupFullscreen();
 
     // 2. 渲染監視器
@@ -29,93 +37,157 @@ async function init() {
     if (config.autoRefresh) {
         toggleAutoRefresh();
     }
+
+    // 5. 配置變更時只更新有變動的監視器，不必重新整理頁面
+    watchConfig(applyConfig);
+
+    // 6. 標示伺服器檢查為離線的監視器
+    watchHealth();
+}
+
+function applyConfig(newConfig) {
+    const previous = config;
+    config = newConfig;
+
+    setupUI(config);
+    setRefreshInterval(config.refreshInterval);
+    renderCameras();
+    refreshHealth();
+
+    if (autoRefreshEnabled && previous.refreshInterval !== config.refreshInterval) {
+        updateRefreshStatus(autoRefreshEnabled, config.refreshInterval || 60);
+    }
 }
 
 function renderCameras() {
     const grid = document.getElementById('cameraGrid');
-    grid.innerHTML = '';
-    
-    config.cameras.forEach((camera, index) => {
-        const cameraItem = document.createElement('div');
-        cameraItem.className = 'camera-item';
-        
-        const isYoutube = camera.type === 'youtube';
-        const isHls = camera.type === 'hls';
-        
-        if (isYoutube) {
-            cameraItem.innerHTML = `
-                <div class="camera-header">
-                    <div class="camera-name">${camera.name}</div>
-                    <div class="camera-info">
-                        <span class="camera-location">${camera.location || ''}</span>
-                        <span class="camera-category">${camera.category || ''}</span>
-                    </div>
-                </div>
-                <div class="camera-image-container">
-                    <div class="youtube-badge">LIVE</div>
-                    <iframe class="camera-iframe"
-                        src="https://www.youtube-nocookie.com/embed/${camera.youtubeId}?mute=1&autoplay=1&playsinline=1&rel=0&modestbranding=1&controls=1"
-                        title="${camera.name}"
-                        frameborder="0"
-                        allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture"
-                        allowfullscreen
-                        loading="lazy">
-                    </iframe>
-                </div>
-            `;
-        } else if (isHls) {
-            cameraItem.innerHTML = `
-                <div class="camera-header">
-                    <div class="camera-name">${camera.name}</div>
-                    <div class="camera-info">
-                        <span class="camera-location">${camera.location || ''}</span>
-                        <span class="camera-category">${camera.category || ''}</span>
-                    </div>
-                </div>
-                <div class="camera-image-container">
-                    <div class="hls-badge">HLS LIVE</div>
-                    <video-js id="hls-player-${index}" 
-                              class="video-js vjs-default-skin vjs-big-play-centered"
-                              controls
-                              autoplay
-                              muted
-                              playsinline
-                              preload="auto">
-                        <source src="${camera.hlsUrl}" type="application/x-mpegURL">
-                    </video-js>
-                </div>
-            `;
-        } else {
-            cameraItem.innerHTML = `
-                <div class="camera-header">
-                    <div class="camera-name">${camera.name}</div>
-                    <div class="camera-info">
-                        <span class="camera-location">${camera.location || ''}</span>
-                        <span class="camera-category">${camera.category || ''}</span>
-                    </div>
-                </div>
-                <div class="camera-image-container">
-                    <div class="loading">載入中...</div>
-                    <img class="camera-image" 
-                         data-camera-id="${camera.id}"
-                         data-src="${camera.imageUrl}"
-                         alt="${camera.name}"
-                         style="display: none;">
-                    <div class="last-update" id="lastUpdate${index}"></div>
-                </div>
-            `;
+
+    // 內容相同的監視器沿用原本的元素 (圖片、播放中的串流不中斷)
+    const reusable = new Map();
+    cameraItems.forEach(item => {
+        if (!reusable.has(item.key)) reusable.set(item.key, []);
+        reusable.get(item.key).push(item.element);
+    });
+
+    const nextItems = config.cameras.map(camera => {
+        const key = JSON.stringify(camera);
+        const element = reusable.get(key)?.shift();
+        return element ? { key, element, isNew: false } : { key, element: createCameraItem(camera), isNew: true };
+    });
+
+    reusable.forEach(elements => elements.forEach(element => {
+        disposeHlsPlayers(element);
+        releaseImages(element);
+        element.remove();
+    }));
+    // 移除初次渲染前的佔位內容
+    const kept = new Set(nextItems.map(item => item.element));
+    Array.from(grid.children).forEach(child => {
+        if (!kept.has(child)) child.remove();
+    });
+
+    // 依序放置；位置沒變的元素不移動，避免 iframe 重新載入
+    nextItems.forEach((item, index) => {
+        if (grid.children[index] !== item.element) {
+            grid.insertBefore(item.element, grid.children[index] || null);
         }
-        
-        grid.appendChild(cameraItem);
     });
-    
-    initHlsPlayers(config);
-    loadAllImages();
 
-    // 點擊全螢幕事件
-    document.querySelectorAll('.camera-image').forEach(img => {
-        img.onclick = () => showFullscreen(img.src, img.alt);
+    const newItems = nextItems.filter(item => item.isNew);
+    newItems.forEach(({ element }) => {
+        initHlsPlayers(element);
+        element.querySelectorAll('.camera-image').forEach(img => {
+            // 點擊全螢幕事件：先顯示格子中的縮圖，原圖下載完成後替換 (期間已關閉則不再開啟)
+            img.onclick = async () => {
+                showFullscreen(img.src, img.alt);
+                const fullUrl = await loadFullImage(img);
+                const overlay = document.getElementById('fullscreenOverlay');
+                if (fullUrl && overlay.classList.contains('active')) showFullscreen(fullUrl, img.alt);
+            };
+            if (!useMosaic()) loadImage(img);
+        });
     });
+    // 拼接模式：新增的監視器一起由一張拼接影像載入
+    if (useMosaic() && newItems.length > 0) loadAllImages();
+
+    cameraItems = nextItems.map(({ key, element }) => ({ key, element }));
+}
+
+function createCameraItem(camera) {
+    const cameraItem = document.createElement('div');
+    cameraItem.className = 'camera-item';
+    if (camera.id) cameraItem.dataset.cameraId = camera.id;
+
+    const isYoutube = camera.type === 'youtube';
+    const isHls = camera.type === 'hls';
+
+    if (isYoutube) {
+        cameraItem.innerHTML = `
+            <div class="camera-header">
+                <div class="camera-name">${camera.name}</div>
+                <div class="camera-info">
+                    <span class="camera-location">${camera.location || ''}</span>
+                    <span class="camera-category">${camera.category || ''}</span>
+                </div>
+            </div>
+            <div class="camera-image-container">
+                <div class="youtube-badge">LIVE</div>
+                <iframe class="camera-iframe"
+                    src="https://www.youtube-nocookie.com/embed/${camera.youtubeId}?mute=1&autoplay=1&playsinline=1&rel=0&modestbranding=1&controls=1"
+                    title="${camera.name}"
+                    frameborder="0"
+                    allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture"
+                    allowfullscreen
+                    loading="lazy">
+                </iframe>
+            </div>
+        `;
+    } else if (isHls) {
+        const source = hlsSource(camera);
+        const directSrc = source !== camera.hlsUrl ? `data-direct-src="${camera.hlsUrl}"` : '';
+        cameraItem.innerHTML = `
+            <div class="camera-header">
+                <div class="camera-name">${camera.name}</div>
+                <div class="camera-info">
+                    <span class="camera-location">${camera.location || ''}</span>
+                    <span class="camera-category">${camera.category || ''}</span>
+                </div>
+            </div>
+            <div class="camera-image-container">
+                <div class="hls-badge">HLS LIVE</div>
+                <video-js class="video-js vjs-default-skin vjs-big-play-centered"
+                          controls
+                          autoplay
+                          muted
+                          playsinline
+                          preload="auto"
+                          ${directSrc}>
+                    <source src="${source}" type="application/x-mpegURL">
+                </video-js>
+            </div>
+        `;
+    } else {
+        cameraItem.innerHTML = `
+            <div class="camera-header">
+                <div class="camera-name">${camera.name}</div>
+                <div class="camera-info">
+                    <span class="camera-location">${camera.location || ''}</span>
+                    <span class="camera-category">${camera.category || ''}</span>
+                </div>
+            </div>
+            <div class="camera-image-container">
+                <div class="loading">載入中...</div>
+                <img class="camera-image" 
+                     data-camera-id="${camera.id}"
+                     data-src="${camera.imageUrl}"
+                     alt="${camera.name}"
+                     style="display: none;">
+                <div class="last-update"></div>
+            </div>
+        `;
+    }
+
+    return cameraItem;
 }
 
 function setupEventListeners() {
@@ -125,10 +197,10 @@ function setupEventListeners() {
 
 function toggleAutoRefresh() {
     autoRefreshEnabled = !autoRefreshEnabled;
-    const interval = (config?.refreshInterval || 60) * 1000;
     
     if (autoRefreshEnabled) {
-        autoRefreshInterval = setInterval(loadAllImages, interval);
+        // 每秒檢查一次，各影像依自己的下一次時間重新載入
+        autoRefreshInterval = setInterval(refreshDueImages, REFRESH_CHECK_INTERVAL);
     } else {
         if (autoRefreshInterval) {
             clearInterval(autoRefreshInterval);
@@ -4,6 +4,7 @@
 
 const TOKEN_KEY = 'viewpoints_token';
 const USERNAME_KEY = 'viewpoints_username';
+export const CONFIG_CACHE_KEY = 'viewpoints_config_cache';
 
 export function saveToken(token, username) {
     localStorage.setItem(TOKEN_KEY, token);
@@ -21,6 +22,7 @@ export function getUsername() {
 export function logout() {
     localStorage.removeItem(TOKEN_KEY);
     localStorage.removeItem(USERNAME_KEY);
+    localStorage.removeItem(CONFIG_CACHE_KEY);
     window.location.href = 'login.html';
 }
 
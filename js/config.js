@@ -1,4 +1,4 @@
-import { fetchWithAuth, checkAuth } from './auth.js';
+import { fetchWithAuth, checkAuth, getToken, getUsername, CONFIG_CACHE_KEY } from './auth.js';
 
 /**
  * 配置管理模組
@@ -8,6 +8,16 @@ import { fetchWithAuth, checkAuth } from './auth.js';
  * 3. 本地檔案 ./viewpoints.json (fallback)
  */
 const CONFIG_API = '/api/config';
+const CONFIG_EVENTS_API = '/api/config/events';
+
+// 目前的配置是否來自 API；只有這時伺服器才知道各監視器的設定 (例如影像代理)
+let configFromApi = false;
+// 此頁面目前套用的配置 ETag；localStorage 的快取由所有分頁共用，不能用來判斷本頁是否已套用
+let appliedEtag = null;
+
+export function isConfigFromApi() {
+    return configFromApi;
+}
 
 export async function fetchConfig() {
     const urlParams = new URLSearchParams(window.location.search);
@@ -15,6 +25,7 @@ export async function fetchConfig() {
 
     if (externalConfigUrl) {
         console.log('[Config] 使用外部 URL 載入配置:', externalConfigUrl);
+        configFromApi = false;
         return await fetchExternalConfig(externalConfigUrl);
     }
 
@@ -22,20 +33,87 @@ export async function fetchConfig() {
         // 檢查認證狀態（除了載入外部配置外）
         checkAuth();
 
-        const apiResponse = await fetchWithAuth(CONFIG_API);
+        // 帶上 If-None-Match，配置未變更時伺服器只回 304
+        const cached = loadCachedConfig();
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+        const apiResponse = await fetchWithAuth(CONFIG_API, { headers });
+        if (apiResponse.status === 304 && cached) {
+            console.log('[Config] 配置未變更，使用快取');
+            configFromApi = true;
+            appliedEtag = cached.etag;
+            return cached.config;
+        }
         if (apiResponse.ok) {
             console.log('[Config] 使用 API 端點載入配置');
-            return await apiResponse.json();
+            const config = await apiResponse.json();
+            appliedEtag = apiResponse.headers.get('ETag');
+            saveCachedConfig(appliedEtag, config);
+            configFromApi = true;
+            return config;
         }
     } catch (apiError) {
         if (apiError.message === 'Unauthorized') return null;
         console.log('[Config] API 不可用，嘗試本地檔案');
     }
 
+    configFromApi = false;
     console.log('[Config] 使用本地檔案載入配置');
     return await fetchLocalConfig();
 }
 
+/**
+ * 訂閱配置變更 (Server-Sent Events)，配置儲存或復原後呼叫 onChange(config)
+ * 使用外部 URL 或未登入時不訂閱。EventSource 斷線會自動重新連線。
+ */
+export function watchConfig(onChange) {
+    const urlParams = new URLSearchParams(window.location.search);
+    const token = getToken();
+    if (urlParams.get('configUrl') || !token || typeof EventSource === 'undefined') return null;
+
+    const source = new EventSource(`${CONFIG_EVENTS_API}?token=${encodeURIComponent(token)}`);
+    source.addEventListener('config', (event) => {
+        // 連線時伺服器會先送出目前的配置，與本頁已套用的相同就略過
+        if (appliedEtag === event.lastEventId) return;
+
+        const config = JSON.parse(event.data);
+        appliedEtag = event.lastEventId;
+        saveCachedConfig(event.lastEventId, config);
+        console.log('[Config] 收到配置變更');
+        onChange(config);
+    });
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('[Config] 配置變更通知已中斷');
+        }
+    };
+    return source;
+}
+
+function loadCachedConfig() {
+    try {
+        const cached = JSON.parse(localStorage.getItem(CONFIG_CACHE_KEY));
+        if (cached && cached.etag && cached.username === getUsername()) {
+            return cached;
+        }
+    } catch (error) {
+        localStorage.removeItem(CONFIG_CACHE_KEY);
+    }
+    return null;
+}
+
+function saveCachedConfig(etag, config) {
+    if (!etag) return;
+    try {
+        localStorage.setItem(CONFIG_CACHE_KEY, JSON.stringify({
+            username: getUsername(),
+            etag,
+            config
+        }));
+    } catch (error) {
+        console.warn('[Config] 無法快取配置:', error);
+    }
+}
+
 async function fetchExternalConfig(url) {
     try {
         const response = await fetch(url);
@@ -0,0 +1,56 @@
+import { fetchWithAuth } from './auth.js';
+import { isConfigFromApi } from './config.js';
+import { setHlsPlayersPaused } from './player.js';
+
+/**
+ * 監視器健康狀態模組
+ * 伺服器在背景定期檢查各監視器的來源，監控牆由 /api/wall/health 取得結果。
+ * 離線的監視器加上標示，影像停止自動重新整理、HLS 暫停播放，恢復後繼續。
+ */
+const WALL_HEALTH_API = '/api/wall/health';
+const HEALTH_REFRESH_INTERVAL = 60 * 1000;
+
+let healthTimer = null;
+
+export function watchHealth() {
+    if (!isConfigFromApi() || healthTimer) return;
+    refreshHealth();
+    healthTimer = setInterval(refreshHealth, HEALTH_REFRESH_INTERVAL);
+}
+
+export async function refreshHealth() {
+    if (!isConfigFromApi()) return;
+    try {
+        const response = await fetchWithAuth(WALL_HEALTH_API, { cache: 'no-cache' });
+        if (!response.ok) return;
+        const { cameras } = await response.json();
+        document.querySelectorAll('.camera-item[data-camera-id]').forEach(item => {
+            applyHealth(item, cameras[item.dataset.cameraId]);
+        });
+    } catch (error) {
+        console.warn('無法取得監視器健康狀態:', error.message);
+    }
+}
+
+function applyHealth(item, health) {
+    const offline = health?.status === 'down';
+    const wasOffline = item.classList.contains('camera-offline');
+    item.classList.toggle('camera-offline', offline);
+
+    let badge = item.querySelector('.offline-badge');
+    if (!offline) {
+        if (badge) badge.remove();
+    } else {
+        if (!badge) {
+            badge = document.createElement('div');
+            badge.className = 'offline-badge';
+            badge.textContent = '離線';
+            item.querySelector('.camera-image-container').appendChild(badge);
+        }
+        badge.title = health.lastSuccess
+            ? `最後正常：${new Date(health.lastSuccess).toLocaleString()}`
+            : '尚未成功連線';
+    }
+
+    if (offline !== wasOffline) setHlsPlayersPaused(item, offline);
+}
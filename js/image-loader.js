@@ -1,16 +1,150 @@
+import { fetchWithAuth, getToken } from './auth.js';
+import { isConfigFromApi } from './config.js';
+
 /**
  * 圖片載入模組 (具備完整性檢查與自動重試)
+ * 配置來自 API 時經由伺服器的影像代理 /api/snapshot/{id} 取得，多個畫面共用同一份上游影像；
+ * 代理不可用時改為直接向監視器網址取圖。
+ * 格狀畫面只下載符合格子寬度的縮圖，全螢幕時才取得原圖。
+ * 網址加上 ?mosaic=1 時整面監控牆每次刷新只下載一張拼接影像 (低階顯示裝置)。
+ * 網址加上 ?stream=1 時改用 MJPEG 串流，影像更新時由伺服器推送，不再輪詢。
+ * 自動重新整理時每張影像依伺服器建議的時間 (X-Next-Refresh) 各自重新載入，
+ * 伺服器依各監視器實際的更新週期計算，沒變化的影像很少重複下載。
+ * 經由代理載入的影像改以 /api/wall/status 一次查詢所有版本，只重新載入有變化的。
  */
-export function loadImage(img, index, retryCount = 0) {
+const SNAPSHOT_API = '/api/snapshot';
+const MOSAIC_API = '/api/wall/mosaic';
+const WALL_STATUS_API = '/api/wall/status';
+
+// 目前的拼接影像 object URL 與 ETag
+let mosaicUrl = null;
+let mosaicEtag = null;
+
+// 全螢幕顯示中的原圖 object URL
+let fullImageUrl = null;
+
+// 配置的刷新間隔 (毫秒)；伺服器沒有建議時間時使用
+let refreshIntervalMs = 60 * 1000;
+let mosaicNextRefresh = 0;
+// 伺服器無法拼接影像 (501，未安裝 pillow) 時改回逐格載入與各自的刷新時間
+let mosaicAvailable = true;
+
+let wallStatusAvailable = true;
+let wallStatusPending = false;
+let wallStatusNextRefresh = 0;
+
+// HTTP/1.1 下瀏覽器對同一主機最多 6 條連線，需保留連線給 API 與配置通知，
+// 超過的監視器繼續輪詢；HTTP/2 以上沒有此限制
+const MAX_HTTP1_STREAMS = 4;
+let activeStreams = 0;
+
+function snapshotUrl(img) {
+    return `${SNAPSHOT_API}/${encodeURIComponent(img.dataset.cameraId)}`;
+}
+
+// 格子實際顯示的像素寬度，伺服器會取最接近的固定縮圖尺寸
+function tileWidth(img) {
+    const container = img.closest('.camera-image-container');
+    return Math.ceil(container.clientWidth * (window.devicePixelRatio || 1));
+}
+
+function canStream() {
+    if (!new URLSearchParams(window.location.search).has('stream')) return false;
+    const protocol = performance.getEntriesByType?.('navigation')[0]?.nextHopProtocol || '';
+    return /^h[23]/.test(protocol) || activeStreams < MAX_HTTP1_STREAMS;
+}
+
+function startStream(img) {
     const container = img.closest('.camera-image-container');
     const loading = container.querySelector('.loading');
-    const lastUpdateEl = document.getElementById(`lastUpdate${index}`);
-    
+    const width = tileWidth(img);
+
+    activeStreams++;
+    img.dataset.stream = 'true';
+    img.onload = () => {
+        img.style.display = 'block';
+        if (loading) loading.style.display = 'none';
+        updateTimestamp(img);
+    };
+    // 串流中斷時改回輪詢，不重複嘗試連線
+    img.onerror = () => {
+        stopStream(img);
+        img.dataset.streamFailed = 'true';
+        console.warn(`影像串流中斷，改為輪詢: ${img.dataset.cameraId}`);
+        loadImage(img);
+    };
+    // <img> 無法帶 Authorization header，以 ?token= 驗證
+    img.src = `${snapshotUrl(img)}/stream?${width > 0 ? `w=${width}&` : ''}token=${encodeURIComponent(getToken())}`;
+}
+
+function stopStream(img) {
+    if (!img.dataset.stream) return;
+    delete img.dataset.stream;
+    activeStreams--;
+    img.onload = null;
+    img.onerror = null;
+    img.removeAttribute('src');
+}
+
+export async function loadImage(img, retryCount = 0) {
+    // 串流中的影像由伺服器推送更新
+    if (img.dataset.stream) return;
+    // 先排定下一次；經由代理載入時改用伺服器建議的時間
+    img.dataset.nextRefresh = Date.now() + refreshIntervalMs;
+    if (isConfigFromApi() && img.dataset.cameraId && !img.dataset.streamFailed && getToken() && canStream()) {
+        startStream(img);
+        return;
+    }
+
+    if (isConfigFromApi() && img.dataset.cameraId) {
+        try {
+            if (await loadSnapshot(img, retryCount)) return;
+        } catch (error) {
+            if (error.message === 'Unauthorized') return;
+        }
+        console.warn(`影像代理不可用，改為直接載入: ${img.dataset.src}`);
+    }
+
     // 加入時間戳記以避免快取
     const timestamp = new Date().getTime();
     const baseUrl = img.dataset.src;
     const imageUrl = baseUrl + (baseUrl.includes('?') ? '&' : '?') + 't=' + timestamp;
-    
+    showImage(img, imageUrl, retryCount);
+}
+
+async function loadSnapshot(img, retryCount) {
+    // no-cache：瀏覽器以 If-None-Match 重新驗證，影像未更新時伺服器只回 304
+    const width = tileWidth(img);
+    const query = width > 0 ? `?w=${width}` : '';
+    const response = await fetchWithAuth(snapshotUrl(img) + query, {
+        cache: 'no-cache'
+    });
+    if (!response.ok) return false;
+
+    const nextRefresh = Number(response.headers.get('X-Next-Refresh'));
+    if (nextRefresh > 0) img.dataset.nextRefresh = Date.now() + nextRefresh * 1000;
+    const version = response.headers.get('X-Frame-Version');
+    if (version) img.dataset.version = version;
+
+    const etag = response.headers.get('ETag');
+    if (etag && etag === img.dataset.etag) {
+        updateTimestamp(img);
+        return true;
+    }
+
+    const objectUrl = URL.createObjectURL(await response.blob());
+    img.dataset.etag = etag || '';
+    showImage(img, objectUrl, retryCount, () => {
+        if (img.dataset.objectUrl) URL.revokeObjectURL(img.dataset.objectUrl);
+        img.dataset.objectUrl = objectUrl;
+    }, () => URL.revokeObjectURL(objectUrl));
+    return true;
+}
+
+function showImage(img, imageUrl, retryCount, onShown, onFailed) {
+    const container = img.closest('.camera-image-container');
+    const loading = container.querySelector('.loading');
+
     const tempImg = new Image();
     
     tempImg.onload = () => {
@@ -19,29 +153,37 @@ export function loadImage(img, index, retryCount = 0) {
             img.src = tempImg.src;
             img.style.display = 'block';
             if (loading) loading.style.display = 'none';
-            
-            // 更新時間戳記
-            if (lastUpdateEl) {
-                const now = new Date();
-                lastUpdateEl.textContent = `${now.getHours().toString().padStart(2, '0')}:${now.getMinutes().toString().padStart(2, '0')}:${now.getSeconds().toString().padStart(2, '0')}`;
-            }
+            if (onShown) onShown();
+            updateTimestamp(img);
         } else {
-            handleImageError(img, index, retryCount, "圖片損毀");
+            if (onFailed) onFailed();
+            handleImageError(img, retryCount, "圖片損毀");
         }
     };
 
     tempImg.onerror = () => {
-        handleImageError(img, index, retryCount, "載入失敗");
+        if (onFailed) onFailed();
+        handleImageError(img, retryCount, "載入失敗");
     };
 
     tempImg.src = imageUrl;
 }
 
-function handleImageError(img, index, retryCount, reason) {
+function updateTimestamp(img) {
+    const lastUpdateEl = img.closest('.camera-image-container').querySelector('.last-update');
+    if (lastUpdateEl) {
+        const now = new Date();
+        lastUpdateEl.textContent = `${now.getHours().toString().padStart(2, '0')}:${now.getMinutes().toString().padStart(2, '0')}:${now.getSeconds().toString().padStart(2, '0')}`;
+    }
+}
+
+function handleImageError(img, retryCount, reason) {
+    // 代理的影像損毀時清除 ETag，重試時才會重新下載
+    delete img.dataset.etag;
     if (retryCount < 3) {
         console.warn(`圖片載入異常 (${reason})，正在進行第 ${retryCount + 1} 次重試...`);
         setTimeout(() => {
-            loadImage(img, index, retryCount + 1);
+            loadImage(img, retryCount + 1);
         }, 500);
     } else {
         const container = img.closest('.camera-image-container');
@@ -49,14 +191,158 @@ function handleImageError(img, index, retryCount, reason) {
         if (loading) {
             loading.innerHTML = `<div class="error">載入失敗<br>點擊重新整理重試</div>`;
             loading.style.cursor = 'pointer';
-            loading.onclick = () => loadImage(img, index, 0);
+            loading.onclick = () => loadImage(img, 0);
         }
     }
 }
 
-export function loadAllImages() {
+/**
+ * 取得全螢幕用的原圖，回傳 object URL；未經由代理載入時回傳 null
+ */
+export async function loadFullImage(img) {
+    if (!img.dataset.objectUrl && !img.dataset.stream) return null;
+    try {
+        const response = await fetchWithAuth(snapshotUrl(img), { cache: 'no-cache' });
+        if (!response.ok) return null;
+        if (fullImageUrl) URL.revokeObjectURL(fullImageUrl);
+        fullImageUrl = URL.createObjectURL(await response.blob());
+        return fullImageUrl;
+    } catch (error) {
+        return null;
+    }
+}
+
+/**
+ * 釋放 root 內影像佔用的 object URL 與串流連線 (移除監視器時呼叫)
+ */
+export function releaseImages(root = document) {
+    root.querySelectorAll('.camera-image').forEach(img => {
+        stopStream(img);
+        if (img.dataset.objectUrl) URL.revokeObjectURL(img.dataset.objectUrl);
+        delete img.dataset.objectUrl;
+    });
+}
+
+export function useMosaic() {
+    return mosaicAvailable && isConfigFromApi() && new URLSearchParams(window.location.search).has('mosaic');
+}
+
+async function loadMosaic() {
+    const width = Math.ceil(window.innerWidth * (window.devicePixelRatio || 1));
+    const [layoutResponse, imageResponse] = await Promise.all([
+        fetchWithAuth(`${MOSAIC_API}.json?w=${width}`, { cache: 'no-cache' }),
+        fetchWithAuth(`${MOSAIC_API}.jpg?w=${width}`, { cache: 'no-cache' })
+    ]);
+    if (!layoutResponse.ok || !imageResponse.ok) {
+        if (layoutResponse.status === 501 || imageResponse.status === 501) mosaicAvailable = false;
+        return false;
+    }
+    mosaicNextRefresh = Date.now() + refreshIntervalMs;
+
+    const layout = await layoutResponse.json();
+    const etag = imageResponse.headers.get('ETag');
+    if (!etag || etag !== mosaicEtag) {
+        const objectUrl = URL.createObjectURL(await imageResponse.blob());
+        if (mosaicUrl) URL.revokeObjectURL(mosaicUrl);
+        mosaicUrl = objectUrl;
+        mosaicEtag = etag;
+    }
+
+    // 每格以拼接影像為背景，縮放到填滿格子 (cover) 並對準該監視器的位置
+    layout.tiles.forEach(tile => {
+        const img = document.querySelector(`.camera-image[data-camera-id="${CSS.escape(tile.id)}"]`);
+        if (!img || !tile.available) return;
+        const container = img.closest('.camera-image-container');
+        const scale = Math.max(container.clientWidth / tile.width, container.clientHeight / tile.height);
+        const offsetX = (container.clientWidth - tile.width * scale) / 2 - tile.x * scale;
+        const offsetY = (container.clientHeight - tile.height * scale) / 2 - tile.y * scale;
+        container.style.backgroundImage = `url(${mosaicUrl})`;
+        container.style.backgroundRepeat = 'no-repeat';
+        container.style.backgroundSize = `${layout.width * scale}px ${layout.height * scale}px`;
+        container.style.backgroundPosition = `${offsetX}px ${offsetY}px`;
+
+        img.style.display = 'none';
+        const loading = container.querySelector('.loading');
+        if (loading) loading.style.display = 'none';
+        updateTimestamp(img);
+    });
+    return true;
+}
+
+export function setRefreshInterval(seconds) {
+    refreshIntervalMs = (seconds || 60) * 1000;
+}
+
+/**
+ * 自動重新整理：只重新載入已到建議時間的影像 (定期呼叫)
+ */
+export function refreshDueImages() {
+    const now = Date.now();
+    if (useMosaic()) {
+        if (now >= mosaicNextRefresh) loadAllImages();
+        return;
+    }
+    // 伺服器檢查為離線的監視器暫停重新載入 (見 health.js)
+    let images = Array.from(document.querySelectorAll('.camera-image'))
+        .filter(img => !img.closest('.camera-offline'));
+    if (isConfigFromApi() && wallStatusAvailable) {
+        // 已知版本的影像由狀態查詢決定是否重新載入，不各自輪詢
+        const tracked = images.filter(img => img.dataset.version);
+        images = images.filter(img => !img.dataset.version);
+        if (tracked.length > 0 && !wallStatusPending && now >= wallStatusNextRefresh) {
+            refreshWallStatus(tracked);
+        }
+    }
+    images.forEach(img => {
+        if (now >= Number(img.dataset.nextRefresh || 0)) loadImage(img);
+    });
+}
+
+async function refreshWallStatus(images) {
+    wallStatusPending = true;
+    try {
+        const response = await fetchWithAuth(WALL_STATUS_API, { cache: 'no-cache' });
+        if (!response.ok) {
+            // 伺服器不支援時改回各自輪詢；其他錯誤 (例如部署期間的 502/503) 等一個刷新週期再查詢
+            if (response.status === 404 || response.status === 501) {
+                wallStatusAvailable = false;
+            } else {
+                wallStatusNextRefresh = Date.now() + refreshIntervalMs;
+            }
+            return;
+        }
+        const nextRefresh = Number(response.headers.get('X-Next-Refresh'));
+        wallStatusNextRefresh = Date.now() + (nextRefresh > 0 ? nextRefresh * 1000 : refreshIntervalMs);
+
+        const { cameras } = await response.json();
+        images.forEach(img => {
+            const status = cameras[img.dataset.cameraId];
+            if (status?.version && status.version !== img.dataset.version) {
+                img.dataset.version = status.version;
+                loadImage(img);
+            }
+        });
+    } catch (error) {
+        if (error.message !== 'Unauthorized') wallStatusNextRefresh = Date.now() + refreshIntervalMs;
+    } finally {
+        wallStatusPending = false;
+    }
+}
+
+export async function loadAllImages() {
+    if (useMosaic()) {
+        try {
+            if (await loadMosaic()) return;
+        } catch (error) {
+            if (error.message === 'Unauthorized') return;
+        }
+        // 暫時失敗時逐一載入一次，下一個刷新週期再試拼接影像，避免每秒重新載入整面監控牆
+        mosaicNextRefresh = Date.now() + refreshIntervalMs;
+        console.warn('拼接影像不可用，改為逐一載入');
+    }
+
     const images = document.querySelectorAll('.camera-image');
-    images.forEach((img, index) => {
-        loadImage(img, index);
+    images.forEach(img => {
+        loadImage(img);
     });
 }
@@ -1,36 +1,92 @@
+import { getToken } from './auth.js';
+import { isConfigFromApi } from './config.js';
+
 /**
  * 播放器管理模組 (HLS/Video.js)
+ * 配置來自 API 時經由伺服器的 HLS 代理 /api/hls/{id}/index.m3u8 播放，
+ * 多個監控牆共用同一份上游片段；代理無法播放時改為直接向來源播放。
  */
-export function initHlsPlayers(config) {
+const HLS_API = '/api/hls';
+// 代理播放清單中的簽章網址會過期 (伺服器 VIEWPOINTS_HLS_URL_TTL)；播放超過此時間後出錯先重新載入代理
+const HLS_RELOAD_AFTER_MS = 10 * 60 * 1000;
+
+export function hlsSource(camera) {
+    if (!isConfigFromApi() || !camera.id || !getToken()) return camera.hlsUrl;
+    // video.js 無法帶 Authorization header，以 ?token= 驗證；清單內的網址由伺服器簽章，不需 token
+    return `${HLS_API}/${encodeURIComponent(camera.id)}/index.m3u8?token=${encodeURIComponent(getToken())}`;
+}
+
+export function initHlsPlayers(root = document) {
     if (typeof videojs === 'undefined') return;
 
-    config.cameras.forEach((camera, index) => {
-        if (camera.type === 'hls') {
-            const playerId = `hls-player-${index}`;
-            const playerElement = document.getElementById(playerId);
-            
-            if (playerElement) {
-                const player = videojs(playerId, {
-                    autoplay: true,
-                    muted: true,
-                    preload: 'auto',
-                    fluid: true,
-                    liveui: true,
-                    html5: {
-                        hls: {
-                            enableLowInitialPlaylist: true,
-                            smoothQualityChange: true,
-                            overrideNative: true
-                        }
-                    }
-                });
+    root.querySelectorAll('video-js').forEach(playerElement => {
+        const directSrc = playerElement.dataset.directSrc;
+        const player = videojs(playerElement, {
+            autoplay: true,
+            muted: true,
+            preload: 'auto',
+            fluid: true,
+            liveui: true,
+            html5: {
+                hls: {
+                    enableLowInitialPlaylist: true,
+                    smoothQualityChange: true,
+                    overrideNative: true
+                }
+            }
+        });
+
+        player.ready(function() {
+            this.play().catch(err => {
+                console.log('自動播放被攔截:', err);
+            });
+        });
 
-                player.ready(function() {
-                    this.play().catch(err => {
-                        console.log('自動播放被攔截:', err);
-                    });
+        if (directSrc) {
+            let loadedAt = Date.now();
+            player.on('error', () => {
+                const src = player.currentSrc();
+                if (src === directSrc) return;
+                player.error(null);
+                if (Date.now() - loadedAt > HLS_RELOAD_AFTER_MS) {
+                    // 播放很久之後才出錯多半是簽章網址過期，重新向代理取得播放清單
+                    loadedAt = Date.now();
+                    player.src({ src, type: 'application/x-mpegURL' });
+                } else {
+                    console.warn(`HLS 代理無法播放，改為直接載入: ${directSrc}`);
+                    player.src({ src: directSrc, type: 'application/x-mpegURL' });
+                }
+                player.play().catch(err => {
+                    console.log('自動播放被攔截:', err);
                 });
-            }
+            });
+        }
+    });
+}
+
+export function disposeHlsPlayers(root) {
+    if (typeof videojs === 'undefined') return;
+
+    // 移除監視器前釋放播放器，停止串流下載
+    root.querySelectorAll('.video-js').forEach(playerElement => {
+        const player = videojs.getPlayer(playerElement);
+        if (player) player.dispose();
+    });
+}
+
+export function setHlsPlayersPaused(root, paused) {
+    if (typeof videojs === 'undefined') return;
+
+    // 來源離線時暫停，恢復後繼續播放
+    root.querySelectorAll('.video-js').forEach(playerElement => {
+        const player = videojs.getPlayer(playerElement);
+        if (!player) return;
+        if (paused) {
+            player.pause();
+        } else {
+            player.play().catch(err => {
+                console.log('自動播放被攔截:', err);
+            });
         }
     });
 }
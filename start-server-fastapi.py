@@ -10,234 +10,3656 @@ Viewpoints 統一伺服器 (FastAPI 版本)
     python3 start-server-fastapi.py
 """
 
+import asyncio
+import base64
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import ipaddress
 import json
+import math
+import mimetypes
+import mmap
+import multiprocessing
+import multiprocessing.connection
 import os
+import posixpath
+import re
 import shutil
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
 import uuid
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from email.utils import formatdate, parsedate
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import passlib.hash
+import requests
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from PIL import Image as PILImage, ImageOps as PILImageOps, features as pil_features
+except ImportError:
+    PILImage = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows：沒有 flock，只支援單一 worker
+    fcntl = None
+
+# 預先壓縮的副檔 (依偏好順序)：index.html → index.html.br / index.html.gz
+STATIC_SIDECARS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_SUFFIXES = (".html", ".css", ".js", ".json", ".svg", ".txt")
+# 常用的小檔案直接放在記憶體中
+STATIC_HOT_SUFFIXES = (".html", ".css", ".js")
+STATIC_HOT_MAX_SIZE = 256 * 1024
+STATIC_WATCH_INTERVAL = float(os.environ.get("VIEWPOINTS_STATIC_WATCH_INTERVAL", 2))
+STATIC_EXCLUDE_DIRS = ("__pycache__", "node_modules", "venv")
+STATIC_EXCLUDE_SUFFIXES = (
+    ".py", ".pyc", ".gz", ".br", ".tmp",
+    ".db", ".db-wal", ".db-shm", ".journal",
+    ".lock", ".toml",
+)
+USER_CONFIG_PATTERN = re.compile(r"viewpoints_.+\.json")
+# 依內容雜湊加上版本號的資源：css/style.css → css/style.<hash>.css
+STATIC_FINGERPRINT_PATTERN = re.compile(r"/(?:css|js)/[^/]+\.(?:css|js)")
+STATIC_FINGERPRINT_LENGTH = 10
+STATIC_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# HTML 與 ES module 中以引號包住的相對路徑，例如 "css/style.css"、'./auth.js'
+STATIC_REFERENCE_PATTERN = re.compile(r"""(["'])([\w./-]+\.(?:css|js))\1""")
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class StaticVariant:
+    # 單一編碼版本的檔案，標頭預先算好；小檔案直接保存在記憶體
+    __slots__ = ("path", "stat", "headers", "etag", "last_modified", "body")
+
+    def __init__(
+        self,
+        path: str,
+        st: os.stat_result,
+        headers: dict,
+        body: Optional[bytes] = None,
+        etag: Optional[str] = None,
+    ):
+        self.path = path
+        self.stat = st
+        if etag is None:
+            # 與 starlette FileResponse 相同的 ETag 算法
+            etag_base = f"{st.st_mtime}-{st.st_size}"
+            etag = f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+        self.etag = etag
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.headers = {
+            **headers,
+            "content-length": str(st.st_size if body is None else len(body)),
+            "last-modified": self.last_modified,
+            "etag": self.etag,
+        }
+        self.body = body
+
+    @classmethod
+    def from_file(
+        cls, path: str, st: os.stat_result, headers: dict, keep_in_memory: bool
+    ) -> "StaticVariant":
+        body = None
+        if keep_in_memory:
+            with open(path, "rb") as f:
+                body = f.read()
+        return cls(path, st, headers, body)
+
+    def refreshed(self, st: os.stat_result) -> "StaticVariant":
+        headers = {
+            key: value
+            for key, value in self.headers.items()
+            if key in ("content-type", "content-encoding", "vary")
+        }
+        return StaticVariant.from_file(self.path, st, headers, keep_in_memory=False)
+
+
+class StaticRoute:
+    __slots__ = ("signature", "variants")
+
+    def __init__(self, signature: tuple, variants: dict):
+        self.signature = signature
+        self.variants = variants
+
+    def select(self, accept_encoding: str) -> StaticVariant:
+        if len(self.variants) > 1 and accept_encoding:
+            accepted = accepted_encodings(accept_encoding)
+            for encoding, _ in STATIC_SIDECARS:
+                if encoding in accepted and encoding in self.variants:
+                    return self.variants[encoding]
+        return self.variants[None]
 
 
 class SPAStaticFiles(StaticFiles):
+    """
+    單頁應用的靜態檔案服務
+
+    啟動時建立「URL → 檔案」路由表 (由 watch() 定期更新)，
+    找不到的路徑直接以字典查詢退回 index.html，不必再跑一次 StaticFiles。
+    css/js 另以內容雜湊版本號的網址提供，可長期快取。
+    """
+
+    def __init__(self, *, directory, html: bool = True, **kwargs):
+        super().__init__(directory=directory, html=html, **kwargs)
+        self.root = Path(directory).resolve()
+        self.files: dict = {}
+        self.routes: dict = {}
+        self.refresh()
+
+    def refresh(self) -> bool:
+        # 重新掃描目錄；未變動的檔案沿用原本的路由 (含記憶體中的內容)
+        files = {}
+        changed = False
+        for url_path, full_path in self._scan():
+            signature = self._signature(full_path)
+            if signature is None:
+                continue
+            route = self.files.get(url_path)
+            if route is None or route.signature != signature:
+                route = self._build_route(full_path, signature)
+                changed = True
+            files[url_path] = route
+        if not changed and files.keys() == self.files.keys():
+            return False
+
+        routes = {**files, **self._fingerprint(files)}
+        index = routes.get("/index.html")
+        if index is not None:
+            routes["/"] = index
+        self.files = files
+        self.routes = routes
+        return True
+
+    def _fingerprint(self, files: dict) -> dict:
+        """
+        為 css/js 加上內容雜湊版本號，並改寫 HTML 與模組 import 中的引用
+
+        雜湊以改寫後的內容計算，被引用的模組變動時引用它的模組版本號也跟著改變。
+        加上版本號的網址內容永不改變，可以 immutable 長期快取；
+        HTML 與原本的網址則要求每次重新驗證。
+        """
+        assets = {url for url in files if STATIC_FINGERPRINT_PATTERN.fullmatch(url)}
+        rewritten = {}
+        fingerprinted = {}
+        resolving = set()
+
+        def rewrite(url: str) -> bytes:
+            if url not in rewritten:
+                resolving.add(url)
+                base = posixpath.dirname(url)
+
+                def replace(match) -> str:
+                    quote, reference = match.groups()
+                    target = posixpath.normpath(posixpath.join(base, reference))
+                    # 循環引用時保留原網址
+                    if target not in assets or target in resolving:
+                        return match.group(0)
+                    name = posixpath.basename(fingerprint(target))
+                    return f"{quote}{posixpath.join(posixpath.dirname(reference), name)}{quote}"
+
+                text = self._read_source(files[url]).decode("utf-8", "surrogateescape")
+                text = STATIC_REFERENCE_PATTERN.sub(replace, text)
+                rewritten[url] = text.encode("utf-8", "surrogateescape")
+                resolving.discard(url)
+            return rewritten[url]
+
+        def fingerprint(url: str) -> str:
+            if url not in fingerprinted:
+                digest = hashlib.sha256(rewrite(url)).hexdigest()[:STATIC_FINGERPRINT_LENGTH]
+                stem, suffix = posixpath.splitext(url)
+                fingerprinted[url] = f"{stem}.{digest}{suffix}"
+            return fingerprinted[url]
+
+        routes = {}
+        for url in sorted(assets):
+            body = rewrite(url)
+            variants = self._compress_variants(body)
+            routes[url] = self._memory_route(files[url], variants, "no-cache")
+            routes[fingerprint(url)] = self._memory_route(
+                files[url], variants, STATIC_IMMUTABLE_CACHE
+            )
+        for url, route in files.items():
+            if url.endswith(".html"):
+                body = rewrite(url)
+                if body != self._read_source(route):
+                    routes[url] = self._memory_route(
+                        route, self._compress_variants(body), "no-cache"
+                    )
+        return routes
+
+    @staticmethod
+    def _read_source(route: StaticRoute) -> bytes:
+        identity = route.variants[None]
+        if identity.body is not None:
+            return identity.body
+        with open(identity.path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _compress_variants(body: bytes) -> dict:
+        # 改寫後的內容與磁碟上的預先壓縮檔不同，在記憶體中壓縮
+        variants = {None: body}
+        if len(body) >= STATIC_COMPRESS_MIN_SIZE:
+            encodings = {suffix: encoding for encoding, suffix in STATIC_SIDECARS}
+            for suffix, compress in sidecar_compressors():
+                compressed = compress(body)
+                if len(compressed) < len(body):
+                    variants[encodings[suffix]] = compressed
+        return variants
+
+    @staticmethod
+    def _memory_route(source: StaticRoute, variants: dict, cache_control: str) -> StaticRoute:
+        identity = source.variants[None]
+        headers = {
+            key: value
+            for key, value in identity.headers.items()
+            if key in ("content-type", "vary")
+        }
+        headers["cache-control"] = cache_control
+        return StaticRoute(
+            source.signature,
+            {
+                encoding: StaticVariant(
+                    identity.path,
+                    identity.stat,
+                    {**headers, "content-encoding": encoding} if encoding else headers,
+                    body,
+                    make_etag(body),
+                )
+                for encoding, body in variants.items()
+            },
+        )
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception as e:
+                print(f"⚠️ 靜態檔案路由表更新失敗: {e}")
+
     async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405, headers={"Allow": "GET, HEAD"})
+
+        path = scope["path"]
+        route = self.routes.get(path)
+        if route is None:
+            if path.startswith("/api/") or "/" not in self.routes:
+                raise HTTPException(status_code=404)
+            # SPA fallback
+            route = self.routes["/"]
+
+        request_headers = Headers(scope=scope)
+        variant = route.select(request_headers.get("accept-encoding", ""))
+        if variant.body is None:
+            # 大檔案由磁碟送出，以當下的檔案狀態為準，避免路由表更新前長度不符
+            st = os.stat(variant.path)
+            if file_signature(st) != file_signature(variant.stat):
+                variant = variant.refreshed(st)
+        if self._not_modified(variant, request_headers):
+            response = Response(
+                status_code=304,
+                headers={
+                    key: value
+                    for key, value in variant.headers.items()
+                    if key in ("etag", "last-modified", "vary", "cache-control")
+                },
+            )
+        elif variant.body is not None:
+            body = b"" if scope["method"] == "HEAD" else variant.body
+            response = Response(content=body, headers=variant.headers)
+        else:
+            response = FileResponse(
+                variant.path,
+                stat_result=variant.stat,
+                headers=variant.headers,
+                media_type=variant.headers["content-type"],
+            )
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _not_modified(variant: StaticVariant, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match:
+            return etag_matches(if_none_match, variant.etag)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            since = parsedate(if_modified_since)
+            last_modified = parsedate(variant.last_modified)
+            return since is not None and last_modified is not None and since >= last_modified
+        return False
+
+    def _scan(self):
+        data_dir = DATA_DIR if DATA_DIR != self.root else None
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # 不進入隱藏目錄、快取與使用者資料目錄
+            dirnames[:] = [
+                d
+                for d in dirnames
+                if not d.startswith(".")
+                and d not in STATIC_EXCLUDE_DIRS
+                and Path(dirpath, d) != data_dir
+            ]
+            for filename in filenames:
+                if is_static_asset(filename):
+                    full_path = os.path.join(dirpath, filename)
+                    relative = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                    yield "/" + relative, full_path
+
+    @staticmethod
+    def _signature(full_path: str) -> Optional[tuple]:
+        signature = []
+        for suffix in ("",) + tuple(suffix for _, suffix in STATIC_SIDECARS):
+            try:
+                signature.append(file_signature(os.stat(full_path + suffix)))
+            except FileNotFoundError:
+                if not suffix:
+                    return None
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _build_route(full_path: str, signature: tuple) -> StaticRoute:
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        if media_type.startswith("text/") or media_type.endswith(("javascript", "json")):
+            media_type += "; charset=utf-8"
+        compressible = full_path.endswith(COMPRESSIBLE_SUFFIXES)
+        keep_in_memory = full_path.endswith(STATIC_HOT_SUFFIXES)
+        headers = {"content-type": media_type}
+        if compressible:
+            headers["vary"] = "Accept-Encoding"
+
+        source_stat = os.stat(full_path)
+        variants = {
+            None: StaticVariant.from_file(
+                full_path,
+                source_stat,
+                headers,
+                keep_in_memory and source_stat.st_size <= STATIC_HOT_MAX_SIZE,
+            )
+        }
+        if compressible:
+            for encoding, suffix in STATIC_SIDECARS:
+                try:
+                    sidecar_stat = os.stat(full_path + suffix)
+                except FileNotFoundError:
+                    continue
+                # 副檔比原檔舊表示原檔已修改，不使用
+                if sidecar_stat.st_mtime_ns < source_stat.st_mtime_ns:
+                    continue
+                variants[encoding] = StaticVariant.from_file(
+                    full_path + suffix,
+                    sidecar_stat,
+                    {**headers, "content-encoding": encoding},
+                    keep_in_memory and sidecar_stat.st_size <= STATIC_HOT_MAX_SIZE,
+                )
+        return StaticRoute(signature, variants)
+
+
+def is_static_asset(filename: str) -> bool:
+    # 隱藏檔 (.env)、原始碼與使用者資料不對外提供
+    if filename.startswith(".") or filename.endswith(STATIC_EXCLUDE_SUFFIXES):
+        return False
+    if filename == USERS_FILE.name or USER_CONFIG_PATTERN.fullmatch(filename):
+        return False
+    return True
+
+
+def load_env_file():
+    env_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+    if os.path.exists(env_file):
+        with open(env_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "=" in line:
+                    key, value = line.split("=", 1)
+                    os.environ.setdefault(key.strip(), value.strip())
+
+
+load_env_file()
+
+PORT = int(os.environ.get("VIEWPOINTS_PORT", 8844))
+BASE_DIR = Path(__file__).parent.resolve()
+# 使用者資料 (users.json、個人配置、備份) 的存放位置，預設與程式同目錄
+DATA_DIR = Path(os.environ.get("VIEWPOINTS_DATA_DIR", BASE_DIR)).resolve()
+CONFIG_FILE = BASE_DIR / "viewpoints.json"
+CATALOG_FILE = BASE_DIR / "cameras_database.json"
+USERS_FILE = DATA_DIR / "users.json"
+# 註冊時只附加到 journal，累積一定筆數後再合併回 users.json
+USERS_JOURNAL = DATA_DIR / "users.journal"
+USERS_COMPACT_EVERY = int(os.environ.get("VIEWPOINTS_USERS_COMPACT_EVERY", 1000))
+BACKUP_DIR = DATA_DIR / ".backups"
+# 多個 worker 行程共用的檔案鎖與世代計數器
+LOCK_DIR = DATA_DIR / ".locks"
+GENERATION_FILE = DATA_DIR / ".generation"
+# 監視器健康索引 (由其中一個 worker 寫入，見 CameraProber)
+HEALTH_FILE = DATA_DIR / ".camera_health.json"
+MAX_BACKUPS = 10
+# 備份以內容雜湊命名並 gzip 壓縮；舊版備份為「時間戳記_隨機碼.json」
+BACKUP_NAME_PATTERN = r"(?:[0-9a-f]{16}\.json\.gz|\d{8}_\d{6}_[0-9a-f]{8}\.json)"
+CONFIG_CACHE_SIZE = int(os.environ.get("VIEWPOINTS_CONFIG_CACHE_SIZE", 256))
+# 共用世代未變動時，快取項目在此秒數內不重新驗證 (手動修改檔案最多延遲這麼久生效)
+CONFIG_REVALIDATE_SECONDS = float(os.environ.get("VIEWPOINTS_CONFIG_REVALIDATE_SECONDS", 1))
+# 儲存後端：file (JSON 檔案，預設) 或 sqlite
+STORAGE_BACKEND = os.environ.get("VIEWPOINTS_STORAGE", "file")
+SQLITE_DB = Path(os.environ.get("VIEWPOINTS_DB", DATA_DIR / "viewpoints.db"))
+
+# JWT Settings
+SECRET_KEY = os.environ.get("SECRET_KEY", "viewpoints-secret-key-3000")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+TOKEN_CACHE_SIZE = int(os.environ.get("VIEWPOINTS_TOKEN_CACHE_SIZE", 4096))
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# 密碼雜湊專用行程池，避免登入尖峰佔滿 FastAPI 的執行緒池
+HASH_WORKERS = int(os.environ.get("VIEWPOINTS_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.environ.get("VIEWPOINTS_HASH_QUEUE_SIZE", 64))
+HASH_RETRY_AFTER = 1  # 秒
+# 不自動回 401：get_current_user 另外接受 ?token= (EventSource 無法自訂標頭)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+
+class Camera(BaseModel):
+    id: str
+    name: str
+    type: str
+    imageUrl: Optional[str] = None
+    youtubeId: Optional[str] = None
+    hlsUrl: Optional[str] = None
+    location: Optional[str] = None
+    category: Optional[str] = None
+
+
+class Config(BaseModel):
+    title: str = "監控牆"
+    autoRefresh: bool = True
+    refreshInterval: int = 60
+    layout: Optional[dict] = None
+    cameras: List[Camera]
+
+
+def validate_config(data: dict) -> bool:
+    if not isinstance(data, dict):
+        return False
+    if "cameras" not in data:
+        return False
+    if not isinstance(data["cameras"], list):
+        return False
+    # 允許空相機列表
+    return True
+
+
+def get_user_config_file(username: str) -> Path:
+    return DATA_DIR / f"viewpoints_{username}.json"
+
+
+def atomic_write_json(path: Path, data: dict):
+    atomic_write_bytes(path, encode_json(data))
+
+
+def atomic_write_bytes(path: Path, content: bytes):
+    # 先寫入暫存檔並 fsync，再以 rename 取代，讀取端永遠不會看到寫到一半的檔案
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    fsync_dir(path.parent)
+
+
+def fsync_dir(directory: Path):
+    # 確保 rename 本身也寫入磁碟 (Windows 不支援開啟目錄)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# 每位使用者一把寫入鎖：序列化 save/restore/backup，讀取不需取鎖
+_config_write_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def config_write_lock(username: str) -> asyncio.Lock:
+    lock = _config_write_locks.get(username)
+    if lock is None:
+        lock = asyncio.Lock()
+        _config_write_locks[username] = lock
+    return lock
+
+
+_fallback_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = (
+    weakref.WeakValueDictionary()
+)
+_fallback_locks_guard = threading.Lock()
+
+
+@contextmanager
+def interprocess_lock(name: str):
+    """
+    跨行程的互斥鎖 (flock DATA_DIR/.locks/<name>.lock)
+
+    每次取鎖都重新開檔，同一行程內的不同執行緒之間也互斥。
+    會阻塞，需在 threadpool 中呼叫。
+    """
+    if fcntl is None:
+        with _fallback_locks_guard:
+            lock = _fallback_locks.get(name)
+            if lock is None:
+                lock = threading.Lock()
+                _fallback_locks[name] = lock
+        with lock:
+            yield
+        return
+
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(LOCK_DIR / f"{name}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # 關閉檔案即釋放鎖
+        os.close(fd)
+
+
+class SharedGeneration:
+    """
+    多個 worker 共用的世代計數器 (mmap DATA_DIR/.generation)
+
+    寫入資料後 bump()；讀取端只需比對記憶體中的數值，
+    未變動就表示沒有任何 worker 寫入過，各自的快取不必重新驗證。
+    """
+
+    SLOTS = ("configs",)
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = 8 * len(self.SLOTS)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def value(self, slot: str) -> int:
+        return struct.unpack_from("<Q", self._map, 8 * self.SLOTS.index(slot))[0]
+
+    def bump(self, slot: str) -> int:
+        offset = 8 * self.SLOTS.index(slot)
+        with interprocess_lock("generation"):
+            value = struct.unpack_from("<Q", self._map, offset)[0] + 1
+            struct.pack_into("<Q", self._map, offset, value)
+        return value
+
+
+generations = SharedGeneration(GENERATION_FILE)
+
+
+def file_signature(st: os.stat_result) -> tuple:
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def make_etag(body: bytes) -> str:
+    # 強 ETag：以內容雜湊產生
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match 採弱比對
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def conditional_response(
+    body: bytes,
+    etag: str,
+    if_none_match: Optional[str],
+    headers: Optional[dict] = None,
+) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", **(headers or {})}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def encode_json(data, pretty: bool = False) -> bytes:
+    # 有安裝 orjson 時使用，輸出與標準庫相同 (UTF-8、不跳脫非 ASCII 字元)
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except TypeError:
+            # 超出 orjson 支援範圍 (例如超過 64 位元的整數)，改用標準庫
+            pass
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(
+        data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+decode_json = orjson.loads if orjson is not None else json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    # API 預設的回應類別：緊湊編碼，有 orjson 時使用 orjson
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+class CachedConfig:
+    __slots__ = ("signature", "data", "body", "etag", "generation", "validated_at")
+
+    def __init__(self, signature: tuple, data: dict, body: bytes, generation: Optional[int] = None):
+        self.signature = signature
+        self.data = data
+        self.body = body
+        self.etag = make_etag(body)
+        # 最後一次驗證時的共用世代與時間 (見 ConfigCache.fresh)
+        self.generation = generation
+        self.validated_at = time.monotonic()
+
+
+class ConfigCache:
+    """
+    配置檔 LRU 快取
+
+    以 (st_mtime_ns, st_size, st_ino) 驗證檔案是否變動，
+    同時保存解析後的配置與預先序列化的回應內容。
+    其他儲存後端可透過 lookup/store 以自訂的版本簽章使用。
+    呼叫端傳入共用世代時，世代未變動的項目連簽章都不必再檢查。
+    """
+
+    def __init__(self, max_entries: int = CONFIG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[object, CachedConfig]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: Path, generation: Optional[int] = None) -> Optional[CachedConfig]:
+        if generation is not None:
+            entry = self.fresh(path, generation)
+            if entry is not None:
+                return entry
+
+        try:
+            signature = file_signature(os.stat(path))
+        except FileNotFoundError:
+            self.discard(path)
+            return None
+
+        entry = self.lookup(path, signature, generation)
+        if entry is not None:
+            return entry
+
         try:
-            response = await super().__call__(scope, receive, send)
+            with open(path, "rb") as f:
+                signature = file_signature(os.fstat(f.fileno()))
+                data = decode_json(f.read())
+        except FileNotFoundError:
+            self.discard(path)
+            return None
+        return self.store(path, signature, data, generation=generation)
+
+    def update(self, path: Path, data: dict, body: Optional[bytes] = None) -> CachedConfig:
+        # 寫入後直接更新快取，下次讀取不必重新解析
+        return self.store(path, file_signature(os.stat(path)), data, body)
+
+    def fresh(self, key, generation: int) -> Optional[CachedConfig]:
+        # 讀取世代後才驗證簽章，因此驗證之後的寫入必定會讓世代不同
+        with self._lock:
+            entry = self._entries.get(key)
             if (
-                response is not None
-                and hasattr(response, "status_code")
-                and response.status_code == 404
+                entry is not None
+                and entry.generation == generation
+                and time.monotonic() - entry.validated_at < CONFIG_REVALIDATE_SECONDS
             ):
-                path = scope.get("path")
-                if not path.startswith("/api/"):
-                    scope["path"] = "/"
-                    response = await super().__call__(scope, receive, send)
-            return response
-        except Exception:
-            path = scope.get("path")
-            if not path.startswith("/api/"):
-                scope["path"] = "/"
-                response = await super().__call__(scope, receive, send)
-                return response
-            raise
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            return None
+
+    def lookup(
+        self, key, signature: tuple, generation: Optional[int] = None
+    ) -> Optional[CachedConfig]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(key)
+                if generation is not None:
+                    entry.generation = generation
+                    entry.validated_at = time.monotonic()
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        key,
+        signature: tuple,
+        data: dict,
+        body: Optional[bytes] = None,
+        generation: Optional[int] = None,
+    ) -> CachedConfig:
+        entry = CachedConfig(
+            signature, data, body if body is not None else encode_json(data), generation
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+config_cache = ConfigCache()
+
+DEFAULT_CONFIG = {"title": "我的監視器牆", "cameras": [], "autoRefresh": True, "refreshInterval": 60}
+DEFAULT_CONFIG_BODY = encode_json(DEFAULT_CONFIG)
+DEFAULT_CONFIG_ENTRY = CachedConfig((), DEFAULT_CONFIG, DEFAULT_CONFIG_BODY)
+
+
+def load_users() -> dict:
+    users = read_users_file()
+    replay_users_journal(users, 0)
+    return users
+
+
+def read_users_file() -> dict:
+    if USERS_FILE.exists():
+        try:
+            with open(USERS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return {}
+    return {}
+
+
+def replay_users_journal(users: dict, offset: int) -> tuple:
+    """
+    重播 journal 中 offset 之後尚未合併的註冊紀錄，回傳 (新的 offset, 筆數)
+
+    只處理完整的行；另一個行程正在寫入的最後一行留待下次。
+    """
+    count = 0
+    try:
+        with open(USERS_JOURNAL, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                users[entry.pop("username")] = entry
+                count += 1
+    except FileNotFoundError:
+        pass
+    return offset, count
+
+
+def save_users(users: dict):
+    atomic_write_json(USERS_FILE, users)
+
+
+class UserDirectory:
+    """
+    記憶體中的使用者索引
+
+    啟動時載入一次，users.json 變動 (其他行程合併) 時才重新載入；
+    只有 journal 變長 (其他行程註冊) 時只重播新增的部分，登入不必重新解析全部使用者。
+    get/usernames 在簽章相符時不取鎖，因此更新時先建好新的 dict 再替換，最後才更新簽章。
+    註冊只附加一行到 journal，每 USERS_COMPACT_EVERY 筆合併回 users.json。
+    附加與合併都持有跨行程的 users 鎖，多個 worker 不會互相覆蓋。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: dict = {}
+        self._signature = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        with self._lock:
+            self._reload()
+
+    def get(self, username: str) -> Optional[dict]:
+        if self._current_signature() != self._signature:
+            with self._lock:
+                self._refresh()
+        return self._users.get(username)
+
+    def usernames(self) -> list:
+        if self._current_signature() != self._signature:
+            with self._lock:
+                self._refresh()
+        return list(self._users)
+
+    def add(self, username: str, record: dict) -> bool:
+        with self._lock, interprocess_lock("users"):
+            self._refresh()
+            if username in self._users:
+                return False
+
+            line = json.dumps({"username": username, **record}, ensure_ascii=False)
+            with open(USERS_JOURNAL, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self._journal_offset = f.tell()
+            users = dict(self._users)
+            users[username] = record
+            self._users = users
+            self._journal_entries += 1
+
+            if self._journal_entries >= USERS_COMPACT_EVERY:
+                self._compact()
+            self._signature = self._current_signature()
+        return True
+
+    def _refresh(self):
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+        users_signature, journal_signature = signature
+        previous_users, previous_journal = self._signature
+        if (
+            users_signature == previous_users
+            and journal_signature is not None
+            and (previous_journal is None or journal_signature[2] == previous_journal[2])
+            and journal_signature[1] >= self._journal_offset
+        ):
+            # 同一個 journal 只是變長：接著上次的位置重播
+            users = dict(self._users)
+            self._journal_offset, count = replay_users_journal(users, self._journal_offset)
+            self._users = users
+            self._journal_entries += count
+            self._signature = signature
+        else:
+            self._reload()
+
+    def _reload(self):
+        # 先取簽章：讀取期間的變動會讓下次比對不符而再更新
+        signature = self._current_signature()
+        users = read_users_file()
+        self._journal_offset, self._journal_entries = replay_users_journal(users, 0)
+        self._users = users
+        self._signature = signature
+
+    def _compact(self):
+        save_users(self._users)
+        USERS_JOURNAL.unlink(missing_ok=True)
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    @staticmethod
+    def _current_signature() -> tuple:
+        signature = []
+        for path in (USERS_FILE, USERS_JOURNAL):
+            try:
+                signature.append(file_signature(os.stat(path)))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def hash_process_context():
+    # 不從多執行緒的 uvicorn worker 直接 fork (可能死結，Python 3.12+ 會警告)；
+    # forkserver 由乾淨的單執行緒行程 fork，Windows/macOS 等不支援時用 spawn
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class PasswordHasher:
+    """
+    在獨立行程池中執行 pbkdf2 雜湊/驗證
+
+    同時進行中的工作 (執行 + 排隊) 超過 max_pending 時直接拒絕，
+    由呼叫端回覆 503，而不是讓請求無限排隊。
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    async def hash(self, password: str) -> str:
+        # CryptContext 產生的 handler 無法 pickle，改用 passlib.hash 中的同名 handler
+        handler = getattr(passlib.hash, pwd_context.default_scheme())
+        return await self._submit(handler.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        scheme = pwd_context.identify(hashed_password)
+        if scheme is None:
+            return False
+        return await self._submit(getattr(passlib.hash, scheme).verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.pending += 1
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=hash_process_context()
+                )
+            executor = self._executor
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+password_hasher = PasswordHasher()
+
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+class TokenCache:
+    """
+    已驗證 JWT 的 LRU 快取 (token → username)
+
+    命中時略過 HMAC 驗證與 JSON 解碼；含 exp 的 token 到期後自動失效，
+    SECRET_KEY 變更時整個快取清空。
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._secret_key = None
+        self._lock = threading.Lock()
+
+    def get(self, token: str, secret_key: str) -> Optional[str]:
+        with self._lock:
+            self._check_secret(secret_key)
+            entry = self._entries.get(token)
+            if entry is not None:
+                username, expires_at = entry
+                if expires_at is None or time.time() < expires_at:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return username
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, secret_key: str, username: str, payload: dict):
+        expires_at = payload.get("exp")
+        if expires_at is not None and not isinstance(expires_at, (int, float)):
+            return
+        with self._lock:
+            self._check_secret(secret_key)
+            self._entries[token] = (username, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _check_secret(self, secret_key: str):
+        if secret_key != self._secret_key:
+            self._entries.clear()
+            self._secret_key = secret_key
+
+
+token_cache = TokenCache()
+
+
+async def get_current_user(
+    token_header: Optional[str] = Depends(oauth2_scheme),
+    token: Optional[str] = None
+):
+    # 如果 header 沒有 token，嘗試從 query params 獲取
+    actual_token = token_header
+    if not actual_token and token:
+        actual_token = token
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if not actual_token:
+        raise credentials_exception
+
+    username = token_cache.get(actual_token, SECRET_KEY)
+    if username is not None:
+        return username
+
+    try:
+        payload = jwt.decode(actual_token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+        token_cache.put(actual_token, SECRET_KEY, username, payload)
+        return username
+    except JWTError:
+        raise credentials_exception
+
+
+class UserAuth(BaseModel):
+    username: str
+    password: str
+
+
+def backup_prefix(username: Optional[str]) -> str:
+    return f"viewpoints_{username}_" if username else "viewpoints_"
+
+
+def get_backup_index_file(username: Optional[str]) -> Path:
+    return BACKUP_DIR / (f"index_{username}.json" if username else "index.json")
+
+
+def rebuild_backup_index(username: Optional[str]) -> list:
+    # 索引遺失或損毀時，從備份目錄重建 (只 stat 屬於該使用者的檔案)
+    if not BACKUP_DIR.exists():
+        return []
+
+    prefix = backup_prefix(username)
+    pattern = re.compile(re.escape(prefix) + BACKUP_NAME_PATTERN)
+    found = []
+    with os.scandir(BACKUP_DIR) as it:
+        for entry in it:
+            if pattern.fullmatch(entry.name):
+                stat = entry.stat()
+                found.append((stat.st_mtime_ns, entry.name, stat))
+
+    found.sort(key=lambda x: x[:2])
+    backups = []
+    for _, name, stat in found:
+        filename = name.removesuffix(".gz")
+        backups.append(
+            {
+                "filename": filename,
+                "hash": filename[len(prefix):-5] if name.endswith(".gz") else None,
+                "size": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            }
+        )
+    return backups
+
+
+def load_backup_index(username: Optional[str]) -> list:
+    # 依建立順序排列 (舊 → 新)
+    try:
+        with open(get_backup_index_file(username), "r", encoding="utf-8") as f:
+            return json.load(f)["backups"]
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return rebuild_backup_index(username)
+
+
+def save_backup_index(username: Optional[str], backups: list):
+    atomic_write_json(get_backup_index_file(username), {"backups": backups})
+
+
+def create_backup(username: Optional[str] = None):
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    
+    target_file = get_user_config_file(username) if username else CONFIG_FILE
+    
+    try:
+        content = target_file.read_bytes()
+    except FileNotFoundError:
+        return
+
+    backups = load_backup_index(username)
+    digest = hashlib.sha256(content).hexdigest()[:16]
+
+    # 內容與最新備份相同，不需再備份
+    if backups and backups[-1].get("hash") == digest:
+        return
+
+    # 相同內容只存一份，重複出現時移到最新位置
+    backup_filename = f"{backup_prefix(username)}{digest}.json"
+    backup_path = BACKUP_DIR / f"{backup_filename}.gz"
+    backups = [b for b in backups if b["filename"] != backup_filename]
+
+    if backup_path.exists():
+        os.utime(backup_path)
+    else:
+        atomic_write_bytes(backup_path, gzip.compress(content, mtime=0))
+
+    stat = backup_path.stat()
+    backups.append(
+        {
+            "filename": backup_filename,
+            "hash": digest,
+            "size": stat.st_size,
+            "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        }
+    )
+
+    # 每位使用者各自保留 MAX_BACKUPS 份
+    while len(backups) > MAX_BACKUPS:
+        oldest = backups.pop(0)
+        (BACKUP_DIR / f"{oldest['filename']}.gz").unlink(missing_ok=True)
+        (BACKUP_DIR / oldest["filename"]).unlink(missing_ok=True)
+
+    save_backup_index(username, backups)
+
+
+def check_backup_filename(filename: str, username: str) -> str:
+    if not filename.endswith(".json"):
+        filename += ".json"
+
+    # 安全性檢查：確保檔名屬於該使用者
+    if not filename.startswith(f"viewpoints_{username}_"):
+        raise HTTPException(status_code=403, detail="無權存取此備份檔")
+    return filename
+
+
+def read_backup_bytes(filename: str) -> Optional[bytes]:
+    # 優先讀取壓縮備份，找不到時退回舊版未壓縮檔案
+    try:
+        with gzip.open(BACKUP_DIR / f"{filename}.gz", "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    try:
+        return (BACKUP_DIR / filename).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+class FileStorage:
+    """
+    JSON 檔案儲存 (預設)
+
+    users.json (+ users.journal)、viewpoints_<username>.json 與 .backups/ 目錄。
+    """
+
+    name = "file"
+
+    def __init__(self):
+        self.users = UserDirectory()
+
+    def get_user(self, username: str) -> Optional[dict]:
+        return self.users.get(username)
+
+    def create_user(self, username: str, record: dict) -> bool:
+        return self.users.add(username, record)
+
+    def load_config(self, username: str) -> Optional[CachedConfig]:
+        return config_cache.load(get_user_config_file(username), generations.value("configs"))
+
+    def read_config_bytes(self, username: str) -> Optional[bytes]:
+        try:
+            return get_user_config_file(username).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def iter_config_bytes(self):
+        for username in self.users.usernames():
+            content = self.read_config_bytes(username)
+            if content is not None:
+                yield username, content
+
+    def save_config(self, username: str, data: dict):
+        # 需在持有 config_write_lock(username) 時呼叫；檔案鎖再與其他 worker 互斥
+        with interprocess_lock(f"config_{username}"):
+            create_backup(username)
+
+            # 檔案與 API 回應使用相同的緊湊編碼，快取直接沿用寫入的內容
+            content = encode_json(data)
+            user_config = get_user_config_file(username)
+            atomic_write_bytes(user_config, content)
+            config_cache.update(user_config, data, content)
+        # 寫入完成後才推進世代；自己的快取項目不帶世代，下次讀取會驗證一次
+        generations.bump("configs")
+
+    def list_backups(self, username: str) -> list:
+        return load_backup_index(username)[::-1]
+
+    def read_backup(self, username: str, filename: str) -> Optional[bytes]:
+        return read_backup_bytes(filename)
+
+
+class SQLiteStorage:
+    """
+    SQLite 儲存 (WAL 模式)
+
+    使用者、配置與備份皆以主鍵/索引查詢，
+    儲存配置與建立備份在同一個交易內完成。
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS configs (
+            username TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            content BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE (username, hash)
+        );
+
+        CREATE INDEX IF NOT EXISTS backups_username_id ON backups (username, id);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 連線不可跨執行緒共用，每個執行緒各開一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_user(self, username: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT password, created_at FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"password": row[0], "created_at": row[1]}
+
+    def create_user(self, username: str, record: dict) -> bool:
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO users (username, password, created_at) VALUES (?, ?, ?)",
+            (username, record["password"], record["created_at"]),
+        )
+        return cursor.rowcount == 1
+
+    def load_config(self, username: str) -> Optional[CachedConfig]:
+        key = (self.name, username)
+        generation = generations.value("configs")
+        entry = config_cache.fresh(key, generation)
+        if entry is not None:
+            return entry
+
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT version FROM configs WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        entry = config_cache.lookup(key, (row[0],), generation)
+        if entry is not None:
+            return entry
+
+        row = conn.execute(
+            "SELECT data, version FROM configs WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return config_cache.store(key, (row[1],), decode_json(row[0]), generation=generation)
+
+    def read_config_bytes(self, username: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            "SELECT data FROM configs WHERE username = ?", (username,)
+        ).fetchone()
+        return row[0].encode("utf-8") if row else None
+
+    def iter_config_bytes(self):
+        for username, data in self._connection().execute("SELECT username, data FROM configs"):
+            yield username, data.encode("utf-8")
+
+    def save_config(self, username: str, data: dict):
+        # 與檔案後端相同的格式，備份雜湊可跨後端比對
+        content = encode_json(data)
+        with self._transaction() as conn:
+            version = self._write_config(conn, username, content.decode("utf-8"))
+        config_cache.store((self.name, username), (version,), data, content)
+        generations.bump("configs")
+
+    def list_backups(self, username: str) -> list:
+        rows = self._connection().execute(
+            "SELECT hash, size, created_at FROM backups WHERE username = ? ORDER BY id DESC",
+            (username,),
+        ).fetchall()
+        return [
+            {
+                "filename": f"{backup_prefix(username)}{digest}.json",
+                "hash": digest,
+                "size": size,
+                "modified": created_at,
+            }
+            for digest, size, created_at in rows
+        ]
+
+    def read_backup(self, username: str, filename: str) -> Optional[bytes]:
+        digest = filename.removeprefix(backup_prefix(username)).removesuffix(".json")
+        row = self._connection().execute(
+            "SELECT content FROM backups WHERE username = ? AND hash = ?",
+            (username, digest),
+        ).fetchone()
+        return gzip.decompress(row[0]) if row else None
+
+    def import_user(self, username: str, record: dict, config: Optional[bytes], backups: list):
+        # 供 migrate 指令使用：backups 為 (內容, 時間) 依舊到新排列
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (username, password, created_at) VALUES (?, ?, ?)",
+                (username, record["password"], record.get("created_at", "")),
+            )
+            for content, created_at in backups:
+                self._add_backup(conn, username, content, created_at)
+            if config is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO configs (username, data, version, updated_at) "
+                    "VALUES (?, ?, COALESCE((SELECT version FROM configs WHERE username = ?), 0) + 1, ?)",
+                    (username, config.decode("utf-8"), username, datetime.now().isoformat()),
+                )
+
+    def _write_config(self, conn: sqlite3.Connection, username: str, content: str) -> int:
+        row = conn.execute(
+            "SELECT data, version FROM configs WHERE username = ?", (username,)
+        ).fetchone()
+        version = 1
+        if row is not None:
+            self._add_backup(conn, username, row[0].encode("utf-8"))
+            version = row[1] + 1
+
+        conn.execute(
+            "INSERT INTO configs (username, data, version, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET "
+            "data = excluded.data, version = excluded.version, updated_at = excluded.updated_at",
+            (username, content, version, datetime.now().isoformat()),
+        )
+        return version
+
+    def _add_backup(
+        self,
+        conn: sqlite3.Connection,
+        username: str,
+        content: bytes,
+        created_at: Optional[str] = None,
+    ):
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        latest = conn.execute(
+            "SELECT hash FROM backups WHERE username = ? ORDER BY id DESC LIMIT 1",
+            (username,),
+        ).fetchone()
+        # 內容與最新備份相同，不需再備份
+        if latest is not None and latest[0] == digest:
+            return
+
+        compressed = gzip.compress(content, mtime=0)
+        conn.execute(
+            "DELETE FROM backups WHERE username = ? AND hash = ?", (username, digest)
+        )
+        conn.execute(
+            "INSERT INTO backups (username, hash, content, size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (username, digest, compressed, len(compressed), created_at or datetime.now().isoformat()),
+        )
+        # 每位使用者各自保留 MAX_BACKUPS 份
+        conn.execute(
+            "DELETE FROM backups WHERE username = ? AND id NOT IN "
+            "(SELECT id FROM backups WHERE username = ? ORDER BY id DESC LIMIT ?)",
+            (username, username, MAX_BACKUPS),
+        )
+
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_DB)
+    if STORAGE_BACKEND != "file":
+        raise ValueError(f"未知的儲存後端: {STORAGE_BACKEND}")
+    return FileStorage()
+
+
+def migrate_to_sqlite(target: SQLiteStorage):
+    # 將 users.json、個人配置與備份匯入 SQLite (可重複執行)
+    users = load_users()
+    for count, (username, record) in enumerate(users.items(), 1):
+        backups = []
+        for entry in load_backup_index(username):
+            content = read_backup_bytes(entry["filename"])
+            if content is not None:
+                backups.append((content, entry["modified"]))
+
+        config_file = get_user_config_file(username)
+        config = config_file.read_bytes() if config_file.exists() else None
+        target.import_user(username, record, config, backups)
+
+        if count % 1000 == 0:
+            print(f"  已匯入 {count}/{len(users)} 位使用者")
+
+    print(f"✅ 已匯入 {len(users)} 位使用者至 {target.path}")
+
+
+storage = create_storage()
+
+
+# --- 靜態資源預先壓縮 ---
+
+# HTML / css / js 會改寫引用並在記憶體中壓縮 (見 SPAStaticFiles._fingerprint)
+STATIC_COMPRESS_PATTERNS = (
+    "viewpoints.json",
+    "cameras_database.json",
+)
+STATIC_COMPRESS_MIN_SIZE = 1024
+API_GZIP_MIN_SIZE = int(os.environ.get("VIEWPOINTS_API_GZIP_MIN_SIZE", 1024))
+# 串流不壓縮 (事件會卡在壓縮緩衝區中)；影像本身已壓縮過
+# HLS 片段本身已壓縮，播放清單通常小於下限
+API_GZIP_EXCLUDED_PREFIXES = ("/api/config/events", "/api/snapshot/", "/api/wall/mosaic.jpg", "/api/hls/")
+
+
+def sidecar_compressors() -> list:
+    compressors = [(".gz", lambda content: gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        compressors.insert(0, (".br", lambda content: brotli.compress(content, quality=11)))
+    return compressors
+
+
+def precompress_static_assets() -> int:
+    # 為靜態資源產生 .gz / .br 副檔，已是最新的副檔會略過
+    # 多個 worker 同時啟動時依序執行，後面的 worker 會發現副檔已是最新
+    with interprocess_lock("compress"):
+        return _precompress_static_assets()
+
+
+def _precompress_static_assets() -> int:
+    written = 0
+    compressors = sidecar_compressors()
+    for pattern in STATIC_COMPRESS_PATTERNS:
+        for path in BASE_DIR.glob(pattern):
+            source_stat = path.stat()
+            if source_stat.st_size < STATIC_COMPRESS_MIN_SIZE:
+                continue
+
+            content = None
+            for suffix, compress in compressors:
+                sidecar = path.with_name(path.name + suffix)
+                try:
+                    if sidecar.stat().st_mtime_ns >= source_stat.st_mtime_ns:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if content is None:
+                    content = path.read_bytes()
+                atomic_write_bytes(sidecar, compress(content))
+                os.utime(sidecar, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                written += 1
+    return written
+
+
+class APIGZipMiddleware(GZipMiddleware):
+    # 只壓縮 /api/ 的回應；靜態檔案已由 SPAStaticFiles 送出預先壓縮版本
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["path"].startswith("/api/")
+            and not scope["path"].startswith(API_GZIP_EXCLUDED_PREFIXES)
+        ):
+            await super().__call__(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+# --- 配置變更通知 ---
+
+CONFIG_EVENTS_KEEPALIVE = 15  # 秒；低於常見代理伺服器 (Heroku 55 秒) 的閒置逾時
+CONFIG_EVENTS_POLL_INTERVAL = 1  # 秒；檢查其他 worker 寫入的頻率
+CONFIG_EVENTS_RETRY_MS = 3000
+# SSE 連線不會自行結束，關閉伺服器時最多等這麼久就中斷
+SHUTDOWN_TIMEOUT = 5
+
+
+class ConfigEvents:
+    """
+    通知已連線的監控牆配置已變更
+
+    同一行程內的儲存/復原直接 notify()；其他 worker 的寫入由 watch()
+    比對共用世代得知。被喚醒的連線自行讀取最新配置，多次變更會合併成一次。
+    """
+
+    def __init__(self):
+        self._subscribers: "dict[str, set[asyncio.Event]]" = {}
+        self._generation = generations.value("configs")
+
+    def subscribe(self, username: str) -> asyncio.Event:
+        wakeup = asyncio.Event()
+        self._subscribers.setdefault(username, set()).add(wakeup)
+        return wakeup
+
+    def unsubscribe(self, username: str, wakeup: asyncio.Event):
+        subscribers = self._subscribers.get(username)
+        if subscribers is not None:
+            subscribers.discard(wakeup)
+            if not subscribers:
+                del self._subscribers[username]
+
+    def notify(self, username: str):
+        for wakeup in self._subscribers.get(username, ()):
+            wakeup.set()
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            generation = generations.value("configs")
+            if generation != self._generation:
+                self._generation = generation
+                # 不知道是哪位使用者的配置，全部喚醒，未變更的連線不會送出事件
+                for username in list(self._subscribers):
+                    self.notify(username)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(s) for s in self._subscribers.values()),
+        }
+
+
+config_events = ConfigEvents()
+
+
+# --- 監視器快照代理 ---
+
+SNAPSHOT_CACHE_BYTES = int(os.environ.get("VIEWPOINTS_SNAPSHOT_CACHE_BYTES", 64 * 1024 * 1024))
+SNAPSHOT_MAX_BYTES = 5 * 1024 * 1024
+# 同一張影像最短的重新抓取間隔 (秒)；實際間隔取配置的 refreshInterval 與此值的較大者
+SNAPSHOT_MIN_INTERVAL = float(os.environ.get("VIEWPOINTS_SNAPSHOT_MIN_INTERVAL", 5))
+# 依上游實際更新週期調整抓取間隔的上限 (秒)；長時間沒有變化的影像最多隔這麼久才抓一次
+SNAPSHOT_MAX_INTERVAL = float(os.environ.get("VIEWPOINTS_SNAPSHOT_MAX_INTERVAL", 600))
+SNAPSHOT_REFRESH_SLACK = 1  # 秒；預期上游更新後稍等一下再抓取
+SNAPSHOT_STALE_PERIODS = 3  # 超過幾個週期沒有變化就逐步放慢
+SNAPSHOT_TIMEOUT = 10
+# 相隔超過這麼久的兩次抓取之間的變化不用來估計更新時間 (秒)
+SNAPSHOT_CHANGE_MAX_GAP = SNAPSHOT_MAX_INTERVAL + 2 * SNAPSHOT_TIMEOUT
+SNAPSHOT_MAX_REDIRECTS = 3
+# 連線池：保留 SNAPSHOT_POOL_ORIGINS 個來源的連線，每個來源最多同時 SNAPSHOT_ORIGIN_CONNECTIONS 條
+SNAPSHOT_POOL_ORIGINS = 64
+SNAPSHOT_ORIGIN_CONNECTIONS = 4
+# 縮圖寬度 (?w=) 取不小於要求的最接近值，每張影像最多只有這幾種尺寸
+SNAPSHOT_WIDTHS = (320, 480, 640, 960, 1280)
+SNAPSHOT_JPEG_QUALITY = 80
+SNAPSHOT_WEBP_QUALITY = 75
+SNAPSHOT_WEBP = PILImage is not None and pil_features.check("webp")
+# MJPEG 串流：影像一直沒變時重送同一張的間隔 (秒)，避免代理伺服器判定連線閒置
+SNAPSHOT_STREAM_RESEND = 30
+SNAPSHOT_STREAM_BOUNDARY = "viewpointsframe"
+# 預設不代理內部網路位址，避免被當成存取內網的跳板
+SNAPSHOT_ALLOW_PRIVATE = os.environ.get("VIEWPOINTS_SNAPSHOT_ALLOW_PRIVATE") == "1"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotVariant:
+    __slots__ = ("body", "content_type", "etag")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = make_etag(body)
+
+
+class SnapshotFrame:
+    __slots__ = (
+        "body", "content_type", "etag", "last_modified",
+        "fetched_at", "upstream_etag", "upstream_last_modified", "variants",
+        "seen_at", "changed_at", "period", "failed_at", "failures",
+    )
+
+    def __init__(
+        self,
+        body: bytes,
+        content_type: str,
+        upstream_etag: Optional[str] = None,
+        upstream_last_modified: Optional[str] = None,
+        previous: Optional["SnapshotFrame"] = None,
+    ):
+        self.body = body
+        self.content_type = content_type
+        self.etag = make_etag(body)
+        self.fetched_at = time.monotonic()
+        # 內容沒變就沿用上一張的 Last-Modified，瀏覽器的條件請求才會得到 304
+        if previous is not None and previous.etag == self.etag:
+            self.last_modified = previous.last_modified
+            self.variants = previous.variants
+            self.seen_at = previous.seen_at
+            self.changed_at = previous.changed_at
+            self.period = previous.period
+        else:
+            self.last_modified = formatdate(time.time(), usegmt=True)
+            # (寬度, 格式) -> SnapshotVariant；None 表示直接用原圖
+            self.variants: "dict[tuple, Optional[SnapshotVariant]]" = {}
+            # 上游實際更新的時間介於上一次與這次抓取之間，取中間值估計。
+            # 第一張影像 (包括從封存取回的) 或兩次抓取相隔太久時不知道何時變化，changed_at 為 None
+            self.seen_at = self.fetched_at
+            self.changed_at = None
+            self.period = None
+            if previous is not None and self.fetched_at - previous.fetched_at <= SNAPSHOT_CHANGE_MAX_GAP:
+                self.seen_at = self.changed_at = (previous.fetched_at + self.fetched_at) / 2
+                self.period = self._learn_period(previous)
+        self.upstream_etag = upstream_etag
+        self.upstream_last_modified = upstream_last_modified
+        # 上游抓取失敗而沿用這張影像時記錄最後一次失敗時間與連續失敗次數
+        self.failed_at: Optional[float] = None
+        self.failures = 0
+
+    @classmethod
+    def restore(cls, body: bytes, content_type: str, archived_at: float) -> "SnapshotFrame":
+        # 從磁碟封存取回的影像：抓取時間與 Last-Modified 為封存時間
+        frame = cls(body, content_type)
+        frame.fetched_at = frame.seen_at = time.monotonic() - max(0.0, time.time() - archived_at)
+        frame.last_modified = formatdate(archived_at, usegmt=True)
+        return frame
+
+    def dump(self) -> bytes:
+        # 供其他 worker 讀取 (見 SnapshotScheduler)：JSON 標頭一行加上原圖，時間換算為 time.time()
+        offset = time.time() - time.monotonic()
+        header = {
+            "contentType": self.content_type,
+            "lastModified": self.last_modified,
+            "upstreamEtag": self.upstream_etag,
+            "upstreamLastModified": self.upstream_last_modified,
+            "fetchedAt": self.fetched_at + offset,
+            "seenAt": self.seen_at + offset,
+            "changedAt": None if self.changed_at is None else self.changed_at + offset,
+            "period": self.period,
+            "failedAt": None if self.failed_at is None else self.failed_at + offset,
+            "failures": self.failures,
+        }
+        return encode_json(header) + b"\n" + self.body
+
+    @classmethod
+    def load(cls, data: bytes) -> "SnapshotFrame":
+        header, _, body = data.partition(b"\n")
+        header = decode_json(header)
+        frame = cls(body, header["contentType"], header["upstreamEtag"], header["upstreamLastModified"])
+        offset = time.monotonic() - time.time()
+        frame.last_modified = header["lastModified"]
+        frame.fetched_at = header["fetchedAt"] + offset
+        frame.seen_at = header["seenAt"] + offset
+        frame.changed_at = None if header["changedAt"] is None else header["changedAt"] + offset
+        frame.period = header["period"]
+        frame.failed_at = None if header["failedAt"] is None else header["failedAt"] + offset
+        frame.failures = header["failures"]
+        return frame
+
+    def _learn_period(self, previous: "SnapshotFrame") -> Optional[float]:
+        # 上游的更新週期 (秒)；看到兩次變化之前未知
+        if previous.changed_at is None:
+            return None
+        observed = self.changed_at - previous.changed_at
+        estimate = observed if previous.period is None else (previous.period + observed) / 2
+        return min(max(estimate, SNAPSHOT_MIN_INTERVAL), SNAPSHOT_MAX_INTERVAL)
+
+    def refresh_at(self, default_interval: float) -> float:
+        """
+        下一次值得重新抓取的時間 (time.monotonic())
+
+        在預期的上游下一次更新之後；過了預期時間還沒變化就縮短間隔等待，
+        很久沒有變化時依停滯時間逐步放慢。還沒學到更新週期時以配置的刷新間隔代替。
+        上游失敗時從失敗時間起退避。
+        """
+        period = self.period or default_interval
+        if self.failed_at is not None:
+            # 上游失敗：從失敗時間起依連續失敗次數加倍退避，不立刻重試
+            backoff = max(period, SNAPSHOT_MIN_INTERVAL) * 2 ** min(self.failures - 1, 10)
+            return self.failed_at + min(backoff, SNAPSHOT_MAX_INTERVAL)
+        since = self.fetched_at - self.seen_at
+        if since >= SNAPSHOT_STALE_PERIODS * period:
+            due = self.fetched_at + min(since / 2, SNAPSHOT_MAX_INTERVAL)
+        elif self.changed_at is not None and self.fetched_at < self.changed_at + period:
+            due = self.changed_at + period + period / 8 + SNAPSHOT_REFRESH_SLACK
+        elif self.period is not None:
+            due = self.fetched_at + period / 4
+        else:
+            due = self.fetched_at + period
+        return max(due, self.fetched_at + SNAPSHOT_MIN_INTERVAL)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(v.body) for v in self.variants.values() if v is not None)
+
+
+def encode_snapshot_variant(frame: SnapshotFrame, width: Optional[int], image_format: Optional[str]):
+    # 在 threadpool 中執行；無法縮小或轉檔後反而更大時回傳 None (使用原圖)
+    try:
+        with PILImage.open(io.BytesIO(frame.body)) as image:
+            if width is not None and width < image.width:
+                # thumbnail 對 JPEG 會先以 draft 在解碼時縮小，比完整解碼再縮放快
+                image.thumbnail((width, image.height), PILImage.Resampling.LANCZOS, reducing_gap=2.0)
+            elif image_format is None:
+                return None
+            output = io.BytesIO()
+            if image_format == "WEBP":
+                image.save(output, "WEBP", quality=SNAPSHOT_WEBP_QUALITY, method=4)
+                content_type = "image/webp"
+            else:
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                image.save(output, "JPEG", quality=SNAPSHOT_JPEG_QUALITY, optimize=True)
+                content_type = "image/jpeg"
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 無法產生縮圖: {e}")
+        return None
+    body = output.getvalue()
+    if len(body) >= len(frame.body):
+        return None
+    return SnapshotVariant(body, content_type)
+
+
+def snapshot_variant_key(width: Optional[int], accept: str) -> Optional[tuple]:
+    # 回傳 (寬度, 格式)；不需要轉換時回傳 None
+    if PILImage is None:
+        return None
+    if width is not None:
+        width = next((w for w in SNAPSHOT_WIDTHS if w >= width), None) if width > 0 else None
+    image_format = "WEBP" if SNAPSHOT_WEBP and "image/webp" in accept else None
+    if width is None and image_format is None:
+        return None
+    return width, image_format
+
+
+def check_snapshot_url(url: str) -> Optional[str]:
+    """
+    檢查上游網址，回傳連線時必須使用的 IP 位址 (允許內部網路位址時回傳 None)
+
+    由 PinnedHTTPAdapter 在每次連線前呼叫；若檢查後再讓 requests 自行解析，
+    DNS 可以在兩次解析之間改指向內部網路 (DNS rebinding)。
+    """
+    parsed = requests.utils.urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise SnapshotError(f"不支援的影像網址: {url}")
+    if SNAPSHOT_ALLOW_PRIVATE:
+        return None
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise SnapshotError(f"無法解析主機 {parsed.hostname}: {e}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0])
+        if not address.is_global:
+            raise SnapshotError(f"不代理內部網路位址: {parsed.hostname}")
+    return addresses[0][4][0]
+
+
+class PinnedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    連線到 check_snapshot_url 檢查過的 IP 位址
+
+    Host 標頭、TLS 的 SNI 與憑證驗證仍使用原本的主機名稱。
+    連線池以 (IP, 主機名稱) 為鍵，同一來源的連線照常重複使用。
+    """
+
+    def send(self, request, *args, **kwargs):
+        request.headers["Host"] = requests.utils.urlparse(request.url).netloc.rpartition("@")[2]
+        return super().send(request, *args, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        address = check_snapshot_url(request.url)
+        if address is not None:
+            if host_params["scheme"] == "https":
+                pool_kwargs["server_hostname"] = host_params["host"]
+                pool_kwargs["assert_hostname"] = host_params["host"]
+            host_params["host"] = address
+        return host_params, pool_kwargs
+
+
+def read_snapshot_body(response: requests.Response) -> tuple:
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/x-mixed-replace":
+        # MJPEG 串流：只取第一張 JPEG (SOI ... EOI)
+        buffer = b""
+        for chunk in response.iter_content(64 * 1024):
+            buffer += chunk
+            start = buffer.find(b"\xff\xd8")
+            if start != -1:
+                end = buffer.find(b"\xff\xd9", start + 2)
+                if end != -1:
+                    return buffer[start:end + 2], "image/jpeg"
+            if len(buffer) > SNAPSHOT_MAX_BYTES:
+                break
+        raise SnapshotError("MJPEG 串流中找不到完整的影像")
+
+    if not content_type.startswith("image/"):
+        raise SnapshotError(f"上游回應不是影像: {content_type or '未知類型'}")
+    body = b""
+    for chunk in response.iter_content(64 * 1024):
+        body += chunk
+        if len(body) > SNAPSHOT_MAX_BYTES:
+            raise SnapshotError("影像過大")
+    return body, content_type
+
+
+class SnapshotCache:
+    """
+    上游監視器影像的共用快取
+
+    以影像網址為鍵，所有使用者共用；到下一次值得抓取的時間前直接回傳記憶體中的影像，
+    同時間的多個請求合併成一次上游抓取。總大小超過 max_bytes 時淘汰最久未用的影像。
+    上游失敗時若有舊影像則繼續提供舊影像。
+    """
+
+    def __init__(self, max_bytes: int = SNAPSHOT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.fetches = 0
+        self.not_modified = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._frames: "OrderedDict[str, SnapshotFrame]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: "dict[str, asyncio.Future]" = {}
+        self._encoding: "dict[tuple, asyncio.Future]" = {}
+        self._watchers: "dict[str, set[asyncio.Event]]" = {}
+        self._origins: "dict[str, asyncio.Semaphore]" = {}
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Viewpoints snapshot proxy"
+        adapter = PinnedHTTPAdapter(
+            pool_connections=SNAPSHOT_POOL_ORIGINS, pool_maxsize=SNAPSHOT_ORIGIN_CONNECTIONS
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def peek(self, url: str) -> Optional[SnapshotFrame]:
+        # 不論新舊直接回傳記憶體中的影像 (由排程器負責更新)
+        frame = self._frames.get(url)
+        if frame is not None:
+            self._frames.move_to_end(url)
+            self.hits += 1
+        return frame
+
+    async def get(self, url: str, interval: float) -> SnapshotFrame:
+        # interval 為配置的刷新間隔，學到上游的更新週期後以 refresh_at() 為準
+        frame = self._frames.get(url)
+        if frame is None and SNAPSHOT_ARCHIVE:
+            # 重新啟動後先取回磁碟上最後一張，上游未更新時不必重新下載
+            frame = await run_in_threadpool(snapshot_archive.latest, url)
+            if frame is not None and url not in self._frames:
+                self._store(url, frame)
+        if frame is not None and time.monotonic() < frame.refresh_at(interval):
+            self._frames.move_to_end(url)
+            self.hits += 1
+            return frame
+        return await self.refresh(url)
+
+    async def refresh(self, url: str) -> SnapshotFrame:
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        frame = self._frames.get(url)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            try:
+                async with self._origin_slot(url):
+                    fresh = await run_in_threadpool(self.fetch, url, frame)
+            except Exception as e:
+                self.errors += 1
+                if frame is None:
+                    raise
+                print(f"⚠️ 快照抓取失敗，沿用舊影像: {url}: {e}")
+                frame.failed_at = time.monotonic()
+                frame.failures += 1
+                fresh = frame
+            else:
+                self._store(url, fresh)
+                if SNAPSHOT_ARCHIVE and (frame is None or frame.etag != fresh.etag):
+                    await self._archive(url, fresh)
+            future.set_result(fresh)
+            return fresh
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else SnapshotError("抓取已取消"))
+            # 沒有其他請求在等待時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[url]
+
+    async def _archive(self, url: str, frame: SnapshotFrame):
+        try:
+            await run_in_threadpool(snapshot_archive.append, url, frame)
+        except OSError as e:
+            print(f"⚠️ 無法封存快照: {url}: {e}")
+
+    def fetch(self, url: str, previous: Optional[SnapshotFrame] = None) -> SnapshotFrame:
+        # 在 threadpool 中執行；有舊影像時以條件請求詢問上游是否更新
+        headers = {}
+        if previous is not None:
+            if previous.upstream_etag:
+                headers["If-None-Match"] = previous.upstream_etag
+            if previous.upstream_last_modified:
+                headers["If-Modified-Since"] = previous.upstream_last_modified
+
+        self.fetches += 1
+        for _ in range(SNAPSHOT_MAX_REDIRECTS + 1):
+            # 位址檢查在 PinnedHTTPAdapter 連線時進行 (每次重新導向都會檢查)
+            try:
+                with self._session.get(
+                    url, headers=headers, timeout=SNAPSHOT_TIMEOUT,
+                    stream=True, allow_redirects=False,
+                ) as response:
+                    if response.is_redirect:
+                        url = requests.compat.urljoin(url, response.headers["location"])
+                        continue
+                    if response.status_code == 304 and previous is not None:
+                        self.not_modified += 1
+                        return SnapshotFrame(
+                            previous.body, previous.content_type,
+                            previous.upstream_etag, previous.upstream_last_modified, previous,
+                        )
+                    if response.status_code != 200:
+                        raise SnapshotError(f"上游回應 HTTP {response.status_code}")
+                    body, content_type = read_snapshot_body(response)
+                    return SnapshotFrame(
+                        body,
+                        content_type,
+                        response.headers.get("etag"),
+                        response.headers.get("last-modified"),
+                        previous,
+                    )
+            except requests.RequestException as e:
+                raise SnapshotError(f"無法連線至上游: {e}")
+        raise SnapshotError("重新導向次數過多")
+
+    async def variant(self, url: str, frame: SnapshotFrame, key: Optional[tuple]):
+        """
+        回傳影像的縮圖/WebP 版本 (SnapshotVariant)，不需要或無法轉換時回傳原圖
+
+        每張上游影像的每種版本只產生一次，與原圖放在一起並計入快取大小。
+        """
+        if key is None:
+            return frame
+        if key in frame.variants:
+            return frame.variants[key] or frame
+
+        pending_key = (frame.etag, key)
+        pending = self._encoding.get(pending_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._encoding[pending_key] = future
+        try:
+            variant = await run_in_threadpool(encode_snapshot_variant, frame, *key)
+            frame.variants[key] = variant
+            # 內容沒變的新影像與舊影像共用 variants，以快取中目前那張是否共用來判斷是否計入
+            current = self._frames.get(url)
+            if variant is not None and current is not None and current.variants is frame.variants:
+                self._bytes += len(variant.body)
+                self._evict()
+            future.set_result(variant or frame)
+            return variant or frame
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else SnapshotError("轉換已取消"))
+            future.exception()
+            raise
+        finally:
+            del self._encoding[pending_key]
+
+    def _origin_slot(self, url: str) -> asyncio.Semaphore:
+        parsed = requests.utils.urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        slot = self._origins.get(origin)
+        if slot is None:
+            slot = self._origins[origin] = asyncio.Semaphore(SNAPSHOT_ORIGIN_CONNECTIONS)
+        return slot
+
+    def fetched_within(self, url: str, seconds: float) -> bool:
+        # 最近 seconds 秒內是否成功抓取過 (失敗時沿用的舊影像不會更新 fetched_at)
+        frame = self._frames.get(url)
+        return frame is not None and time.monotonic() - frame.fetched_at < seconds
+
+    def subscribe(self, url: str) -> asyncio.Event:
+        # 影像內容變更時 set()，供 MJPEG 串流等待新影像
+        wakeup = asyncio.Event()
+        self._watchers.setdefault(url, set()).add(wakeup)
+        return wakeup
+
+    def unsubscribe(self, url: str, wakeup: asyncio.Event):
+        watchers = self._watchers.get(url)
+        if watchers is not None:
+            watchers.discard(wakeup)
+            if not watchers:
+                del self._watchers[url]
+
+    def adopt(self, url: str, frame: SnapshotFrame):
+        # 放入其他 worker 抓取的影像；內容相同時沿用已產生的縮圖
+        current = self._frames.get(url)
+        if current is not None and current.etag == frame.etag:
+            frame.variants = current.variants
+        self._store(url, frame)
+
+    def _store(self, url: str, frame: SnapshotFrame):
+        previous = self._frames.pop(url, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._frames[url] = frame
+        self._bytes += frame.size
+        self._evict()
+        if previous is None or previous.etag != frame.etag:
+            for wakeup in self._watchers.get(url, ()):
+                wakeup.set()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._frames) > 1:
+            _, evicted = self._frames.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def stats(self) -> dict:
+        return {
+            "frames": len(self._frames),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "streams": sum(len(w) for w in self._watchers.values()),
+            "learned_periods": sum(1 for f in self._frames.values() if f.period is not None),
+        }
+
+
+snapshot_cache = SnapshotCache()
+
+
+def snapshot_not_modified(request_headers: Headers, etag: str, last_modified: str) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    since = parsedate(request_headers.get("if-modified-since") or "")
+    return since is not None and since >= parsedate(last_modified)
+
+
+def find_image_camera(config: dict, camera_id: str) -> Optional[dict]:
+    for camera in config.get("cameras") or ():
+        if isinstance(camera, dict) and camera.get("id") == camera_id and camera.get("imageUrl"):
+            return camera
+    return None
+
+
+def snapshot_interval(config: dict) -> float:
+    try:
+        interval = float(config.get("refreshInterval") or 60)
+    except (TypeError, ValueError):
+        interval = 60
+    return max(SNAPSHOT_MIN_INTERVAL, interval)
+
+
+def snapshot_targets(config: dict) -> dict:
+    # 配置中所有影像網址 -> 抓取週期
+    interval = snapshot_interval(config)
+    cameras = config.get("cameras") if isinstance(config, dict) else None
+    return {
+        camera["imageUrl"]: interval
+        for camera in cameras or ()
+        if isinstance(camera, dict) and isinstance(camera.get("imageUrl"), str)
+    }
+
+
+# --- 監視器快照封存 ---
+
+# 預設不封存 (DATA_DIR 預設為專案目錄)
+SNAPSHOT_ARCHIVE = os.environ.get("VIEWPOINTS_SNAPSHOT_ARCHIVE") == "1"
+SNAPSHOT_ARCHIVE_DIR = DATA_DIR / ".snapshots"
+# 每部監視器的封存上限 (位元組)，平均分給 SNAPSHOT_ARCHIVE_SEGMENTS 個區段輪流使用
+SNAPSHOT_ARCHIVE_BYTES = int(os.environ.get("VIEWPOINTS_SNAPSHOT_ARCHIVE_BYTES", 8 * 1024 * 1024))
+# 全部監視器的封存上限 (位元組)；超過時淘汰最久沒有寫入的監視器
+SNAPSHOT_ARCHIVE_TOTAL_BYTES = int(os.environ.get("VIEWPOINTS_SNAPSHOT_ARCHIVE_TOTAL_BYTES", 1024 * 1024 * 1024))
+SNAPSHOT_ARCHIVE_SEGMENTS = 4
+SNAPSHOT_HISTORY_LIMIT = 200
+# 索引：開頭為區段序號，之後每張影像一筆 (時間, 位置, 長度, 內容摘要, Content-Type)
+ARCHIVE_HEADER = struct.Struct("<Q")
+ARCHIVE_RECORD = struct.Struct("<dII8s16s")
+
+
+def archive_digest(frame_etag: str) -> bytes:
+    # 與 make_etag 相同的 SHA-256，取前 8 位元組
+    return bytes.fromhex(frame_etag.strip('"')[:16])
+
+
+class SnapshotArchive:
+    """
+    監視器影像的磁碟封存 (DATA_DIR/.snapshots/<網址雜湊>/)
+
+    每部監視器固定 segments 個區段檔 (N.seg) 輪流使用，影像只附加在目前區段之後；
+    區段寫滿時改從最舊的區段開頭覆寫，總大小固定。每個區段有對應的索引檔 (N.idx)，
+    換區段時先重寫索引再覆寫內容。區段檔不截短，讀取端以 mmap 讀取時不會遇到檔案縮小，
+    讀到的內容再以索引中的摘要確認沒有被覆寫。內容與最後一張相同時不重複寫入。
+
+    每部監視器的大小固定，總大小以監視器數量限制：新增監視器前淘汰最久沒有寫入的，
+    排程器重新掃描配置後也會移除已不在任何配置中的網址 (prune)。
+
+    多個 worker 以檔案鎖序列化寫入；讀取直接看磁碟上的索引，不需取鎖。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = SNAPSHOT_ARCHIVE_BYTES,
+        segments: int = SNAPSHOT_ARCHIVE_SEGMENTS,
+        total_bytes: int = SNAPSHOT_ARCHIVE_TOTAL_BYTES,
+    ):
+        self.root = root
+        self.segments = segments
+        self.segment_bytes = max_bytes // segments
+        self.max_cameras = max(1, total_bytes // max(1, self.segment_bytes * segments))
+        self.removed = 0
+        self.appends = 0
+        self.duplicates = 0
+        self.reads = 0
+        self.corrupt = 0
+
+    def _directory(self, url: str) -> Path:
+        return self.root / hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+
+    def _read_index(self, directory: Path) -> list:
+        # [(區段序號, [紀錄...])]，由舊到新；區段編號為序號 % segments
+        indexes = []
+        for slot in range(self.segments):
+            try:
+                with open(directory / f"{slot}.idx", "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            if len(content) < ARCHIVE_HEADER.size:
+                continue
+            (sequence,) = ARCHIVE_HEADER.unpack_from(content)
+            # 寫到一半的最後一筆略過
+            end = len(content) - (len(content) - ARCHIVE_HEADER.size) % ARCHIVE_RECORD.size
+            indexes.append((sequence, list(ARCHIVE_RECORD.iter_unpack(content[ARCHIVE_HEADER.size:end]))))
+        indexes.sort(key=lambda index: index[0])
+        return indexes
+
+    def append(self, url: str, frame: SnapshotFrame):
+        # 在 threadpool 中執行
+        body = frame.body
+        if len(body) > self.segment_bytes:
+            return
+        digest = archive_digest(frame.etag)
+        directory = self._directory(url)
+        if not directory.exists():
+            self._make_room()
+        with interprocess_lock(f"archive-{directory.name}"):
+            indexes = self._read_index(directory)
+            if indexes:
+                sequence, records = indexes[-1]
+                if records and records[-1][3] == digest:
+                    self.duplicates += 1
+                    return
+                offset = records[-1][1] + records[-1][2] if records else 0
+                if offset + len(body) > self.segment_bytes:
+                    sequence, offset = sequence + 1, 0
+                    self._start_segment(directory, sequence)
+            else:
+                directory.mkdir(parents=True, exist_ok=True)
+                sequence, offset = 0, 0
+                self._start_segment(directory, sequence)
+
+            slot = sequence % self.segments
+            segment = directory / f"{slot}.seg"
+            with open(segment, "r+b" if segment.exists() else "wb") as f:
+                f.seek(offset)
+                f.write(body)
+            content_type = frame.content_type.encode("ascii", "replace")
+            with open(directory / f"{slot}.idx", "ab") as f:
+                f.write(ARCHIVE_RECORD.pack(time.time(), offset, len(body), digest, content_type))
+        self.appends += 1
+
+    def _make_room(self):
+        # 新增一部監視器前，依最後寫入時間淘汰最舊的，使總數不超過 max_cameras
+        try:
+            directories = [path for path in self.root.iterdir() if path.is_dir()]
+        except FileNotFoundError:
+            return
+        excess = len(directories) + 1 - self.max_cameras
+        if excess <= 0:
+            return
+        directories.sort(key=self._written_at)
+        for directory in directories[:excess]:
+            self._remove(directory)
+
+    @staticmethod
+    def _written_at(directory: Path) -> float:
+        # 每次寫入都會附加索引檔，以索引檔最新的修改時間為準
+        written_at = 0.0
+        for index in directory.glob("*.idx"):
+            try:
+                written_at = max(written_at, index.stat().st_mtime)
+            except FileNotFoundError:
+                continue
+        return written_at
+
+    def _remove(self, directory: Path):
+        with interprocess_lock(f"archive-{directory.name}"):
+            shutil.rmtree(directory, ignore_errors=True)
+        self.removed += 1
+
+    def prune(self, urls) -> int:
+        # 在 threadpool 中執行；移除已不在任何配置中的網址的封存，回傳移除的數量
+        keep = {self._directory(url).name for url in urls}
+        try:
+            directories = [path for path in self.root.iterdir() if path.is_dir() and path.name not in keep]
+        except FileNotFoundError:
+            return 0
+        for directory in directories:
+            self._remove(directory)
+        return len(directories)
+
+    def _start_segment(self, directory: Path, sequence: int):
+        # 清空索引即捨棄該區段原本的影像；區段檔本身留待覆寫
+        with open(directory / f"{sequence % self.segments}.idx", "wb") as f:
+            f.write(ARCHIVE_HEADER.pack(sequence))
+
+    def _read_frame(self, directory: Path, sequence: int, record: tuple) -> Optional[bytes]:
+        _, offset, length, digest, _ = record
+        try:
+            with open(directory / f"{sequence % self.segments}.seg", "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    body = mapped[offset:offset + length]
+        except (FileNotFoundError, ValueError):
+            return None
+        self.reads += 1
+        if len(body) != length or hashlib.sha256(body).digest()[:8] != digest:
+            # 讀取期間已被新的影像覆寫
+            self.corrupt += 1
+            return None
+        return body
+
+    def latest(self, url: str) -> Optional[SnapshotFrame]:
+        # 最後封存的一張 (重新啟動後在上游回應前先提供)
+        directory = self._directory(url)
+        for sequence, records in reversed(self._read_index(directory)):
+            for record in reversed(records):
+                body = self._read_frame(directory, sequence, record)
+                if body is not None:
+                    return SnapshotFrame.restore(body, record[4].rstrip(b"\0").decode("ascii"), record[0])
+        return None
+
+    def history(self, url: str, since: float, limit: int) -> list:
+        # since 之後封存的影像 (由舊到新)：[{"id", "timestamp"}]
+        frames = []
+        for sequence, records in self._read_index(self._directory(url)):
+            for timestamp, offset, *_ in records:
+                if timestamp > since:
+                    frames.append({"id": f"{sequence}-{offset}", "timestamp": timestamp})
+        return frames[:limit]
+
+    def frame(self, url: str, frame_id: str) -> Optional[tuple]:
+        # history() 的 id -> (內容, Content-Type, 時間)；已被覆寫時回傳 None
+        try:
+            sequence, offset = (int(part) for part in frame_id.split("-", 1))
+        except ValueError:
+            return None
+        directory = self._directory(url)
+        for indexed_sequence, records in self._read_index(directory):
+            if indexed_sequence != sequence:
+                continue
+            for record in records:
+                if record[1] == offset:
+                    body = self._read_frame(directory, sequence, record)
+                    if body is None:
+                        return None
+                    return body, record[4].rstrip(b"\0").decode("ascii"), record[0]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SNAPSHOT_ARCHIVE,
+            "max_bytes_per_camera": self.segment_bytes * self.segments,
+            "max_cameras": self.max_cameras,
+            "removed": self.removed,
+            "appends": self.appends,
+            "duplicates": self.duplicates,
+            "reads": self.reads,
+            "corrupt": self.corrupt,
+        }
+
+
+snapshot_archive = SnapshotArchive(SNAPSHOT_ARCHIVE_DIR)
+
+
+# --- 監視器快照排程 ---
+
+SNAPSHOT_SCHEDULER = os.environ.get("VIEWPOINTS_SNAPSHOT_SCHEDULER", "1") != "0"
+# 多久沒有監控牆讀取的影像就暫停抓取 (秒)
+SNAPSHOT_IDLE_TIMEOUT = float(os.environ.get("VIEWPOINTS_SNAPSHOT_IDLE_TIMEOUT", 300))
+SNAPSHOT_RESCAN_INTERVAL = 600  # 秒；定期重新掃描所有配置，涵蓋手動修改的檔案
+SNAPSHOT_RESCAN_MIN_INTERVAL = 30  # 秒；其他 worker 寫入時重新掃描的最短間隔
+SNAPSHOT_SCHEDULER_TICK = 1  # 秒
+# 多 worker 模式下由排程的 worker 把抓到的影像寫入此目錄，其他 worker 直接讀取
+SNAPSHOT_SHARED = int(os.environ.get("VIEWPOINTS_WORKERS", 1)) > 1
+SNAPSHOT_SHARED_DIR = DATA_DIR / ".snapshot-frames"
+# 共用影像超過預定的重新抓取時間這麼久 (秒) 仍未更新時，其他 worker 自行抓取
+SNAPSHOT_SHARED_GRACE = SNAPSHOT_SCHEDULER_TICK + SNAPSHOT_TIMEOUT
+
+
+class SnapshotScheduler:
+    """
+    定期抓取所有配置中的影像監視器
+
+    彙整所有使用者配置 (以及預設的 viewpoints.json) 的影像網址，重複的只抓一次，
+    週期取各配置 refreshInterval 的最小值；各網址依雜湊值錯開抓取時間，避免同時湧向上游。
+    抓取過後改依學到的上游更新週期 (SnapshotFrame.refresh_at) 排定下一次。
+    監控牆透過 latest() 讀取最新影像；SNAPSHOT_IDLE_TIMEOUT 秒內沒人讀取的網址暫停抓取。
+
+    同一行程的儲存/復原以 config_changed() 只重新讀取該使用者；
+    其他 worker 的寫入由共用世代得知，重新掃描全部配置。
+
+    多 worker 時只有取得 snapshot-scheduler 檔案鎖的 worker 排程抓取，抓到的影像寫入
+    SNAPSHOT_SHARED_DIR；其他 worker 以 shared() 讀取，leader 沒有按時更新
+    (例如該網址只有其他 worker 的監控牆在讀取而被判定閒置) 時才自行抓取。
+    """
+
+    def __init__(self, cache: SnapshotCache):
+        self.cache = cache
+        self.fetches = 0
+        self.errors = 0
+        self.skipped = 0
+        self.scans = 0
+        self.leader = False
+        self._by_user: "dict[Optional[str], dict[str, float]]" = {}
+        self._users_by_url: "dict[str, dict[Optional[str], float]]" = {}
+        self._periods: "dict[str, float]" = {}
+        self._due: "dict[str, float]" = {}
+        self._rescheduled: list = []
+        self._reads: "dict[str, float]" = {}
+        self._dirty: set = set()
+        self._tasks: set = set()
+        self._wakeup = asyncio.Event()
+        self._generation = 0
+        self._local_changes = 0
+        self._scanned_at = float("-inf")
+        self._lock_fd: Optional[int] = None
+        self._shared_signatures: "dict[str, tuple]" = {}
+
+    def latest(self, url: str) -> Optional[SnapshotFrame]:
+        self._reads[url] = time.monotonic()
+        if url not in self._periods:
+            return None
+        return self.cache.peek(url)
+
+    def config_changed(self, username: str):
+        self._dirty.add(username)
+        self._local_changes += 1
+        self._wakeup.set()
+
+    async def run(self):
+        queue: list = []
+        self._wakeup = asyncio.Event()
+        try:
+            while not self._acquire_leadership():
+                # 其他 worker 正在排程；該 worker 結束後由這裡接手
+                await asyncio.sleep(SNAPSHOT_RESCAN_MIN_INTERVAL)
+            self.leader = True
+
+            while True:
+                self._wakeup.clear()
+                now = time.monotonic()
+                if await self._sync(now):
+                    self._due = {
+                        url: self._due.get(url) or self._next_due(url, period, now)
+                        for url, period in self._periods.items()
+                    }
+                    queue = [(due, url) for url, due in self._due.items()]
+                    heapq.heapify(queue)
+
+                while self._rescheduled:
+                    url, due = self._rescheduled.pop()
+                    if url in self._due:
+                        self._due[url] = due
+                        heapq.heappush(queue, (due, url))
+
+                while queue and queue[0][0] <= now:
+                    due, url = heapq.heappop(queue)
+                    if self._due.get(url) != due:
+                        # 已重新排定
+                        continue
+                    period = self._periods[url]
+                    # 先依配置的週期排定；抓取完成後改為依上游更新週期計算的時間
+                    self._due[url] = self._next_due(url, period, max(due, now))
+                    heapq.heappush(queue, (self._due[url], url))
+                    if now - self._reads.get(url, -SNAPSHOT_IDLE_TIMEOUT) >= SNAPSHOT_IDLE_TIMEOUT:
+                        self.skipped += 1
+                        continue
+                    task = asyncio.create_task(self._fetch(url))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+                timeout = SNAPSHOT_SCHEDULER_TICK
+                if queue:
+                    timeout = min(timeout, max(0, queue[0][0] - time.monotonic()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            self.leader = False
+
+    def _acquire_leadership(self) -> bool:
+        if fcntl is None:
+            return True
+        LOCK_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(LOCK_DIR / "snapshot-scheduler.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 行程結束前一直持有
+        self._lock_fd = fd
+        return True
+
+    async def shared(self, url: str, interval: float) -> Optional[SnapshotFrame]:
+        """
+        非 leader 的 worker 讀取 leader 抓到的影像
+
+        檔案沒有變化時沿用記憶體中的那張；沒有共用影像或 leader 已超過預定時間沒有更新時
+        回傳 None，由呼叫端自行抓取。
+        """
+        if not SNAPSHOT_SHARED or self.leader:
+            return None
+        known = self._shared_signatures.get(url)
+        frame = self.cache.peek(url) if known is not None else None
+        try:
+            signature, data = await run_in_threadpool(
+                self._read_shared, self._shared_path(url), known if frame is not None else None
+            )
+            if data is not None:
+                frame = SnapshotFrame.load(data)
+                self.cache.adopt(url, frame)
+                self._shared_signatures[url] = signature
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if time.monotonic() >= frame.refresh_at(interval) + SNAPSHOT_SHARED_GRACE:
+            return None
+        return frame
+
+    @staticmethod
+    def _shared_path(url: str) -> Path:
+        return SNAPSHOT_SHARED_DIR / hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+
+    @staticmethod
+    def _read_shared(path: Path, known: Optional[tuple]) -> tuple:
+        # (簽章, 內容)；簽章與 known 相同時不讀取內容
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            return signature, None if signature == known else f.read()
+
+    def _publish(self, url: str, frame: SnapshotFrame):
+        # 在 threadpool 中執行；rename 取代，讀取端不會看到寫到一半的檔案 (不需 fsync，重新啟動後不再使用)
+        SNAPSHOT_SHARED_DIR.mkdir(parents=True, exist_ok=True)
+        path = self._shared_path(url)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(frame.dump())
+        os.replace(tmp_path, path)
+
+    def _prune_shared(self, urls):
+        # 在 threadpool 中執行；刪除已不在任何配置中的網址的共用影像
+        keep = {self._shared_path(url).name for url in urls}
+        for path in SNAPSHOT_SHARED_DIR.glob("*"):
+            # 略過正在寫入的暫存檔
+            if path.name not in keep and not path.name.startswith("."):
+                path.unlink(missing_ok=True)
+
+    async def _fetch(self, url: str):
+        try:
+            frame = await self.cache.refresh(url)
+            self.fetches += 1
+            if SNAPSHOT_SHARED:
+                try:
+                    await run_in_threadpool(self._publish, url, frame)
+                except OSError as e:
+                    print(f"⚠️ 無法寫入共用快照: {url}: {e}")
+            period = self._periods.get(url)
+            if period is not None:
+                self._rescheduled.append((url, frame.refresh_at(period)))
+                self._wakeup.set()
+        except Exception:
+            # 沒有舊影像可用；等下一輪或監控牆讀取時再試
+            self.errors += 1
+
+    @staticmethod
+    def _next_due(url: str, period: float, after: float) -> float:
+        # 以網址雜湊決定在週期內的固定相位，各網址平均分散且重建佇列後相位不變
+        phase = zlib.crc32(url.encode("utf-8")) / 2**32 * period
+        return after + ((phase - after) % period or period)
+
+    async def _sync(self, now: float) -> bool:
+        others = generations.value("configs") - self._generation > self._local_changes
+        if now - self._scanned_at >= SNAPSHOT_RESCAN_INTERVAL or (
+            others and now - self._scanned_at >= SNAPSHOT_RESCAN_MIN_INTERVAL
+        ):
+            self._generation = generations.value("configs")
+            self._local_changes = 0
+            self._dirty.clear()
+            self._by_user, self._users_by_url, self._periods = await run_in_threadpool(self._scan)
+            self._scanned_at = now
+            self.scans += 1
+            self._prune_reads(now)
+            if SNAPSHOT_SHARED and SNAPSHOT_SHARED_DIR.exists():
+                await run_in_threadpool(self._prune_shared, list(self._periods))
+            if SNAPSHOT_ARCHIVE:
+                await run_in_threadpool(snapshot_archive.prune, list(self._periods))
+            return True
+
+        if not self._dirty:
+            return False
+        usernames, self._dirty = self._dirty, set()
+        for username, targets in (await run_in_threadpool(self._load_users, usernames)).items():
+            self._set_targets(username, targets)
+        return True
+
+    @staticmethod
+    def _scan() -> tuple:
+        by_user = {}
+        default = config_cache.load(CONFIG_FILE)
+        if default is not None:
+            by_user[None] = snapshot_targets(default.data)
+        for username, content in storage.iter_config_bytes():
+            try:
+                by_user[username] = snapshot_targets(decode_json(content))
+            except ValueError:
+                continue
+
+        users_by_url: dict = {}
+        for username, targets in by_user.items():
+            for url, period in targets.items():
+                users_by_url.setdefault(url, {})[username] = period
+        periods = {url: min(users.values()) for url, users in users_by_url.items()}
+        return by_user, users_by_url, periods
+
+    @staticmethod
+    def _load_users(usernames) -> dict:
+        result = {}
+        for username in usernames:
+            content = storage.read_config_bytes(username)
+            try:
+                result[username] = snapshot_targets(decode_json(content)) if content else {}
+            except ValueError:
+                result[username] = {}
+        return result
+
+    def _set_targets(self, username: str, targets: dict):
+        previous = self._by_user.pop(username, {})
+        if targets:
+            self._by_user[username] = targets
+        for url in previous.keys() | targets.keys():
+            users = self._users_by_url.setdefault(url, {})
+            users.pop(username, None)
+            if url in targets:
+                users[username] = targets[url]
+            if users:
+                self._periods[url] = min(users.values())
+            else:
+                del self._users_by_url[url]
+                self._periods.pop(url, None)
+
+    def _prune_reads(self, now: float):
+        for url, read_at in list(self._reads.items()):
+            if now - read_at >= SNAPSHOT_IDLE_TIMEOUT:
+                del self._reads[url]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "enabled": SNAPSHOT_SCHEDULER,
+            "leader": self.leader,
+            "configs": len(self._by_user),
+            "cameras": len(self._periods),
+            "active": sum(
+                1 for url in self._periods
+                if now - self._reads.get(url, -SNAPSHOT_IDLE_TIMEOUT) < SNAPSHOT_IDLE_TIMEOUT
+            ),
+            "fetches": self.fetches,
+            "errors": self.errors,
+            "skipped_idle": self.skipped,
+            "scans": self.scans,
+        }
+
+
+snapshot_scheduler = SnapshotScheduler(snapshot_cache)
+
+
+async def latest_snapshot(url: str, interval: float) -> SnapshotFrame:
+    # 排程器已在抓取的網址直接用最新的一張 (其他 worker 讀取共用影像)，否則視需要向上游抓取
+    frame = snapshot_scheduler.latest(url)
+    if frame is None:
+        frame = await snapshot_scheduler.shared(url, interval)
+    if frame is None:
+        frame = await snapshot_cache.get(url, interval)
+    return frame
+
+
+def snapshot_refresh_delay(frame: SnapshotFrame, interval: float) -> int:
+    # 建議監控牆幾秒後再取這張影像 (排程器抓到新影像之後)
+    delay = frame.refresh_at(interval) - time.monotonic() + SNAPSHOT_REFRESH_SLACK
+    return max(1, math.ceil(delay))
+
+
+def snapshot_refresh_headers(frame: SnapshotFrame, interval: float) -> dict:
+    # X-Frame-Version 為原圖的 ETag，與 /api/wall/status 的 version 相同 (縮圖的 ETag 不同)
+    return {
+        "X-Next-Refresh": str(snapshot_refresh_delay(frame, interval)),
+        "X-Frame-Version": frame.etag,
+    }
+
+
+# --- 監控牆拼接影像 ---
+
+MOSAIC_WIDTHS = (960, 1280, 1920, 2560)
+MOSAIC_DEFAULT_WIDTH = 1920
+MOSAIC_JPEG_QUALITY = 75
+MOSAIC_CACHE_SIZE = 32
+MOSAIC_BACKGROUND = (26, 26, 27)  # 與 .camera-image-container 的背景色相同
+
+
+class Mosaic:
+    __slots__ = ("body", "etag", "last_modified", "layout", "layout_body", "layout_etag")
+
+    def __init__(self, body: bytes, layout: dict):
+        self.body = body
+        self.etag = make_etag(body)
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.layout = {**layout, "etag": self.etag}
+        self.layout_body = encode_json(self.layout)
+        self.layout_etag = make_etag(self.layout_body)
+
+
+def mosaic_layout(config: dict, width: int) -> dict:
+    """
+    依配置的 layout.columns/rows 計算每個影像監視器在拼接影像中的位置
+
+    位置與監控牆的格子一致 (依相機順序)，非影像監視器的格子留空；
+    每格為 16:9，相機超過 columns x rows 時往下加列。
+    """
+    cameras = [c for c in config.get("cameras") or () if isinstance(c, dict)]
+    layout = config.get("layout") if isinstance(config.get("layout"), dict) else {}
+    try:
+        columns = int(layout.get("columns") or 0)
+        rows = int(layout.get("rows") or 0)
+    except (TypeError, ValueError):
+        columns = rows = 0
+    if columns < 1:
+        columns = max(1, math.ceil(math.sqrt(len(cameras))))
+    rows = max(rows, 1, math.ceil(len(cameras) / columns))
+
+    tile_width = width // columns
+    tile_height = tile_width * 9 // 16
+    tiles = [
+        {
+            "id": camera.get("id"),
+            "name": camera.get("name"),
+            "x": index % columns * tile_width,
+            "y": index // columns * tile_height,
+            "width": tile_width,
+            "height": tile_height,
+        }
+        for index, camera in enumerate(cameras)
+        if isinstance(camera.get("imageUrl"), str)
+    ]
+    return {
+        "width": tile_width * columns,
+        "height": tile_height * rows,
+        "columns": columns,
+        "rows": rows,
+        "tiles": tiles,
+    }
+
+
+def compose_mosaic(layout: dict, frames: list) -> bytes:
+    # 在 threadpool 中執行；frames 與 layout["tiles"] 對應，None 表示該格沒有影像
+    canvas = PILImage.new("RGB", (layout["width"], layout["height"]), MOSAIC_BACKGROUND)
+    for tile, frame in zip(layout["tiles"], frames):
+        if frame is None:
+            continue
+        size = (tile["width"], tile["height"])
+        try:
+            with PILImage.open(io.BytesIO(frame.body)) as image:
+                image.draft("RGB", size)
+                image = PILImageOps.contain(image.convert("RGB"), size, PILImage.Resampling.BILINEAR)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 無法拼接影像 {tile['id']}: {e}")
+            continue
+        canvas.paste(
+            image,
+            (tile["x"] + (size[0] - image.width) // 2, tile["y"] + (size[1] - image.height) // 2),
+        )
+    output = io.BytesIO()
+    canvas.save(output, "JPEG", quality=MOSAIC_JPEG_QUALITY)
+    return output.getvalue()
+
+
+class MosaicCache:
+    """
+    拼接影像快取
+
+    以 (配置 ETag, 刷新週期序號, 寬度) 為鍵：同一週期內相同配置的監控牆共用同一張，
+    進入下一個週期才重新拼接；同時到達的請求合併成一次拼接。
+    """
+
+    def __init__(self, max_entries: int = MOSAIC_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.builds = 0
+        self._entries: "OrderedDict[tuple, Mosaic]" = OrderedDict()
+        self._inflight: "dict[tuple, asyncio.Future]" = {}
+
+    async def get(self, config: CachedConfig, width: int) -> Mosaic:
+        interval = snapshot_interval(config.data)
+        key = (config.etag, int(time.time() // interval), width)
+        mosaic = self._entries.get(key)
+        if mosaic is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return mosaic
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            mosaic = await self._build(config.data, width, key[1])
+            self._entries[key] = mosaic
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            future.set_result(mosaic)
+            return mosaic
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else SnapshotError("拼接已取消"))
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _build(self, config: dict, width: int, tick: int) -> Mosaic:
+        layout = mosaic_layout(config, width)
+        # 與 mosaic_layout 相同的篩選與順序，和 layout["tiles"] 一一對應
+        urls = [
+            camera["imageUrl"]
+            for camera in config.get("cameras") or ()
+            if isinstance(camera, dict) and isinstance(camera.get("imageUrl"), str)
+        ]
+        interval = snapshot_interval(config)
+        results = await asyncio.gather(
+            *(latest_snapshot(url, interval) for url in urls),
+            return_exceptions=True,
+        )
+        frames = []
+        for tile, result in zip(layout["tiles"], results):
+            if isinstance(result, Exception):
+                tile["available"] = False
+                frames.append(None)
+            else:
+                tile["available"] = True
+                tile["lastModified"] = result.last_modified
+                frames.append(result)
+        body = await run_in_threadpool(compose_mosaic, layout, frames)
+        self.builds += 1
+        return Mosaic(body, {**layout, "tick": tick, "refreshInterval": snapshot_interval(config)})
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "builds": self.builds,
+        }
+
+
+mosaic_cache = MosaicCache()
+
+
+# --- HLS 串流代理 ---
+
+HLS_CACHE_BYTES = int(os.environ.get("VIEWPOINTS_HLS_CACHE_BYTES", 128 * 1024 * 1024))
+HLS_PLAYLIST_CACHE_SIZE = 256
+HLS_MAX_PLAYLIST_BYTES = 1024 * 1024
+HLS_MAX_SEGMENT_BYTES = 32 * 1024 * 1024
+HLS_TIMEOUT = 15
+HLS_ORIGIN_CONNECTIONS = 4
+# 直播的媒體播放清單快取目標片段長度的一半；主播放清單與已結束的清單幾乎不變
+HLS_STATIC_PLAYLIST_TTL = 60
+HLS_MIN_PLAYLIST_TTL = 0.5
+HLS_PLAYLIST_TYPE = "application/vnd.apple.mpegurl"
+# 片段網址的內容不會改變，瀏覽器可直接快取
+HLS_SEGMENT_CACHE_CONTROL = "private, max-age=3600"
+# 片段只接受這些 Content-Type (前綴)，避免把任意內容 (例如 HTML) 以本站網域提供
+HLS_SEGMENT_TYPES = (
+    "video/", "audio/", "application/mp4", "application/octet-stream", "binary/octet-stream", "text/vtt",
+)
+# 簽章網址的有效期限 (秒)；期限取整到 HLS_URL_STEP 秒，同一分鐘內改寫的播放清單相同 (ETag 不變)
+HLS_URL_TTL = int(os.environ.get("VIEWPOINTS_HLS_URL_TTL", 6 * 3600))
+HLS_URL_STEP = 60
+HLS_URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+HLS_TARGET_DURATION = re.compile(r"^#EXT-X-TARGETDURATION:\s*([\d.]+)", re.MULTILINE)
+# 主播放清單中這些標籤的 URI 指向其他播放清單，其餘 (KEY、MAP、PART...) 為媒體資源
+HLS_PLAYLIST_TAGS = ("#EXT-X-MEDIA:", "#EXT-X-I-FRAME-STREAM-INF:", "#EXT-X-RENDITION-REPORT:")
+
+
+class HLSError(Exception):
+    pass
+
+
+class HLSPlaylist:
+    __slots__ = ("content", "base_url", "expires_at", "_rendered")
+
+    def __init__(self, content: str, base_url: str, ttl: float):
+        # 上游的原始內容，所有使用者共用；網址依監視器與使用者改寫 (render)
+        self.content = content
+        self.base_url = base_url
+        self.expires_at = time.monotonic() + ttl
+        self._rendered: "dict[tuple, tuple]" = {}
+
+    def render(self, camera_id: str, username: str) -> tuple:
+        # (改寫後的內容, ETag)；同一個簽章期限內重複使用
+        expires = hls_url_expiry()
+        key = (camera_id, username, expires)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            body = rewrite_hls_playlist(camera_id, username, expires, self.content, self.base_url).encode("utf-8")
+            rendered = self._rendered[key] = (body, make_etag(body))
+        return rendered
+
+
+class HLSSegment:
+    __slots__ = ("body", "content_type")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+
+
+def hls_url_expiry() -> int:
+    # 現在改寫的簽章網址的到期時間 (time.time())
+    return (int(time.time()) + HLS_URL_TTL) // HLS_URL_STEP * HLS_URL_STEP
+
+
+def hls_signature(kind: str, camera_id: str, username: str, expires: int, url: str) -> str:
+    message = encode_json([kind, camera_id, username, expires, url])
+    digest = hmac.new(SECRET_KEY.encode("utf-8"), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode("ascii").rstrip("=")
+
+
+def hls_proxy_url(camera_id: str, username: str, expires: int, kind: str, url: str) -> str:
+    """
+    上游網址 -> 代理網址 (/api/hls/{id}/{playlist|segment}/{簽章}?u=...&exp=...&user=...)
+
+    網址附上以 SECRET_KEY 計算的簽章，綁定監視器、使用者與到期時間；
+    代理只接受自己改寫過且未過期的網址，不必再帶 token。
+    """
+    if not url.startswith(("http://", "https://")):
+        # data:、skd: 等不經由代理
+        return url
+    query = requests.compat.urlencode({
+        "u": base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii").rstrip("="),
+        "exp": expires,
+        "user": username,
+    })
+    signature = hls_signature(kind, camera_id, username, expires, url)
+    return f"/api/hls/{requests.compat.quote(camera_id, safe='')}/{kind}/{signature}?{query}"
+
+
+def hls_source_url(
+    kind: str, camera_id: str, username: str, expires: int, signature: str, encoded: str
+) -> Optional[str]:
+    # hls_proxy_url 的反向；簽章不符或已過期時回傳 None
+    if expires < time.time():
+        return None
+    try:
+        url = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        return None
+    expected = hls_signature(kind, camera_id, username, expires, url)
+    if not hmac.compare_digest(signature.encode("utf-8"), expected.encode("ascii")):
+        return None
+    return url
+
+
+def rewrite_hls_playlist(camera_id: str, username: str, expires: int, content: str, base_url: str) -> str:
+    # 播放清單中的網址 (相對於 base_url) 全部改為經由代理
+    lines = content.splitlines()
+    master = any(line.startswith("#EXT-X-STREAM-INF") for line in lines)
+
+    def proxied(kind: str, uri: str) -> str:
+        return hls_proxy_url(camera_id, username, expires, kind, requests.compat.urljoin(base_url, uri))
+
+    output = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#"):
+            if 'URI="' in line:
+                kind = "playlist" if master and line.startswith(HLS_PLAYLIST_TAGS) else "segment"
+                line = HLS_URI_ATTRIBUTE.sub(lambda m: f'URI="{proxied(kind, m.group(1))}"', line)
+        elif line:
+            line = proxied("playlist" if master else "segment", line)
+        output.append(line)
+    return "\n".join(output) + "\n"
+
+
+def hls_playlist_ttl(content: str) -> float:
+    match = HLS_TARGET_DURATION.search(content)
+    if match is None or "#EXT-X-ENDLIST" in content:
+        return HLS_STATIC_PLAYLIST_TTL
+    return max(float(match.group(1)) / 2, HLS_MIN_PLAYLIST_TTL)
+
+
+def find_hls_camera(config: dict, camera_id: str) -> Optional[dict]:
+    for camera in config.get("cameras") or ():
+        if isinstance(camera, dict) and camera.get("id") == camera_id and camera.get("hlsUrl"):
+            return camera
+    return None
+
+
+class HLSCache:
+    """
+    HLS 播放清單與片段的共用快取
+
+    播放清單快取一小段時間 (直播為目標片段長度的一半)，以網址為鍵共用，
+    回應時才依監視器與使用者改寫成經由代理的簽章網址；
+    片段以網址為鍵放在記憶體中，總大小超過 max_bytes 時淘汰最久未用的。
+    同時間對同一網址的請求合併成一次上游抓取，同一部監視器不論多少監控牆觀看，
+    每個片段只向上游下載一次。
+    """
+
+    def __init__(self, max_bytes: int = HLS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._segments: "OrderedDict[str, HLSSegment]" = OrderedDict()
+        self._playlists: "OrderedDict[str, HLSPlaylist]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: "dict[tuple, asyncio.Future]" = {}
+        self._origins: "dict[str, asyncio.Semaphore]" = {}
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Viewpoints HLS proxy"
+        adapter = PinnedHTTPAdapter(
+            pool_connections=SNAPSHOT_POOL_ORIGINS, pool_maxsize=HLS_ORIGIN_CONNECTIONS
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    async def playlist(self, url: str) -> HLSPlaylist:
+        playlist = self._playlists.get(url)
+        if playlist is not None and time.monotonic() < playlist.expires_at:
+            self._playlists.move_to_end(url)
+            self.hits += 1
+            return playlist
+        return await self._coalesce(("playlist", url), self._load_playlist, url)
+
+    async def segment(self, url: str) -> HLSSegment:
+        segment = self._segments.get(url)
+        if segment is not None:
+            self._segments.move_to_end(url)
+            self.hits += 1
+            return segment
+        return await self._coalesce(("segment", url), self._load_segment, url)
+
+    async def _coalesce(self, key: tuple, load, *args):
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await load(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self.errors += 1
+            future.set_exception(e if isinstance(e, Exception) else HLSError("抓取已取消"))
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_playlist(self, url: str) -> HLSPlaylist:
+        async with self._origin_slot(url):
+            body, _, final_url = await run_in_threadpool(self.fetch, url, HLS_MAX_PLAYLIST_BYTES)
+        content = body.decode("utf-8-sig", errors="replace")
+        if not content.lstrip().startswith("#EXTM3U"):
+            raise HLSError("上游回應不是 HLS 播放清單")
+        playlist = HLSPlaylist(content, final_url, hls_playlist_ttl(content))
+        self._playlists[url] = playlist
+        self._playlists.move_to_end(url)
+        while len(self._playlists) > HLS_PLAYLIST_CACHE_SIZE:
+            self._playlists.popitem(last=False)
+        return playlist
+
+    async def _load_segment(self, url: str) -> HLSSegment:
+        async with self._origin_slot(url):
+            body, content_type, _ = await run_in_threadpool(
+                self.fetch, url, HLS_MAX_SEGMENT_BYTES, HLS_SEGMENT_TYPES
+            )
+        segment = HLSSegment(body, content_type or "video/mp2t")
+        self._segments[url] = segment
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes and len(self._segments) > 1:
+            _, evicted = self._segments.popitem(last=False)
+            self._bytes -= len(evicted.body)
+        return segment
+
+    def fetch(self, url: str, max_bytes: int, content_types: Optional[tuple] = None) -> tuple:
+        # 在 threadpool 中執行；回傳 (內容, Content-Type, 重新導向後的網址)
+        # content_types 為允許的 Content-Type 前綴，不符時不下載內容
+        self.fetches += 1
+        for _ in range(SNAPSHOT_MAX_REDIRECTS + 1):
+            try:
+                with self._session.get(
+                    url, timeout=HLS_TIMEOUT, stream=True, allow_redirects=False
+                ) as response:
+                    if response.is_redirect:
+                        url = requests.compat.urljoin(url, response.headers["location"])
+                        continue
+                    if response.status_code != 200:
+                        raise HLSError(f"上游回應 HTTP {response.status_code}")
+                    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                    if content_types is not None and content_type and not content_type.startswith(content_types):
+                        raise HLSError(f"上游回應不是媒體片段: {content_type}")
+                    body = b""
+                    for chunk in response.iter_content(64 * 1024):
+                        body += chunk
+                        if len(body) > max_bytes:
+                            raise HLSError("上游回應過大")
+                    return body, content_type, url
+            except SnapshotError as e:
+                # PinnedHTTPAdapter 的位址檢查
+                raise HLSError(str(e))
+            except requests.RequestException as e:
+                raise HLSError(f"無法連線至上游: {e}")
+        raise HLSError("重新導向次數過多")
+
+    def _origin_slot(self, url: str) -> asyncio.Semaphore:
+        parsed = requests.utils.urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        slot = self._origins.get(origin)
+        if slot is None:
+            slot = self._origins[origin] = asyncio.Semaphore(HLS_ORIGIN_CONNECTIONS)
+        return slot
+
+    def stats(self) -> dict:
+        return {
+            "segments": len(self._segments),
+            "playlists": len(self._playlists),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+hls_cache = HLSCache()
+
+
+def hls_playlist_response(
+    playlist: HLSPlaylist, camera_id: str, username: str, if_none_match: Optional[str]
+) -> Response:
+    body, etag = playlist.render(camera_id, username)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=HLS_PLAYLIST_TYPE, headers=headers)
 
 
-def load_env_file():
-    env_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
-    if os.path.exists(env_file):
-        with open(env_file, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    os.environ.setdefault(key.strip(), value.strip())
+async def hls_camera_configured(username: str, camera_id: str) -> bool:
+    # 簽章網址只在該使用者的配置仍有這部監視器時有效
+    config = (await run_in_threadpool(current_config, username)).data
+    return find_hls_camera(config, camera_id) is not None
 
 
-load_env_file()
+# --- 監視器健康檢查 ---
 
-PORT = int(os.environ.get("VIEWPOINTS_PORT", 8844))
-BASE_DIR = Path(__file__).parent.resolve()
-CONFIG_FILE = BASE_DIR / "viewpoints.json"
-USERS_FILE = BASE_DIR / "users.json"
-BACKUP_DIR = BASE_DIR / ".backups"
-MAX_BACKUPS = 10
+CAMERA_PROBER = os.environ.get("VIEWPOINTS_CAMERA_PROBER", "1") != "0"
+# 每個來源多久檢查一次 (秒)
+CAMERA_PROBE_INTERVAL = float(os.environ.get("VIEWPOINTS_CAMERA_PROBE_INTERVAL", 900))
+# 同時進行的檢查數；同一主機一次只送一個請求，且間隔至少 CAMERA_PROBE_HOST_DELAY 秒
+CAMERA_PROBE_CONCURRENCY = int(os.environ.get("VIEWPOINTS_CAMERA_PROBE_CONCURRENCY", 8))
+CAMERA_PROBE_HOST_DELAY = float(os.environ.get("VIEWPOINTS_CAMERA_PROBE_HOST_DELAY", 1))
+CAMERA_PROBE_TIMEOUT = 10
+CAMERA_PROBE_READ_BYTES = 4096  # HLS 播放清單只讀開頭
+CAMERA_PROBE_RESCAN_INTERVAL = 60  # 秒；配置變更後最晚多久檢查新加入的監視器
+CAMERA_DOWN_AFTER = 2  # 連續失敗幾次才判定離線，避免偶發錯誤造成閃爍
+CAMERA_HEALTH_FLUSH_INTERVAL = 10  # 秒；檢查進行中寫出健康索引的間隔
+YOUTUBE_OEMBED_URL = "https://www.youtube.com/oembed"
 
-# JWT Settings
-SECRET_KEY = os.environ.get("SECRET_KEY", "viewpoints-secret-key-3000")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+def camera_probe_target(camera) -> Optional[tuple]:
+    # (種類, 網址或影片 ID)；與監控牆相同，依 type 決定使用哪個來源
+    if not isinstance(camera, dict):
+        return None
+    kind = camera.get("type") if camera.get("type") in ("youtube", "hls") else "image"
+    source = camera.get({"image": "imageUrl", "hls": "hlsUrl", "youtube": "youtubeId"}[kind])
+    if not isinstance(source, str) or not source:
+        return None
+    return kind, source
 
 
-class Camera(BaseModel):
-    id: str
-    name: str
-    type: str
-    imageUrl: Optional[str] = None
-    youtubeId: Optional[str] = None
-    hlsUrl: Optional[str] = None
-    location: Optional[str] = None
-    category: Optional[str] = None
+def camera_health_key(target: tuple) -> str:
+    return f"{target[0]}:{target[1]}"
 
 
-class Config(BaseModel):
-    title: str = "監控牆"
-    autoRefresh: bool = True
-    refreshInterval: int = 60
-    layout: Optional[dict] = None
-    cameras: List[Camera]
+def camera_probe_targets() -> dict:
+    # 監控點資料庫、預設配置與所有使用者配置中的來源：健康索引鍵 -> (種類, 來源)
+    configs = []
+    for path in (CATALOG_FILE, CONFIG_FILE):
+        entry = config_cache.load(path)
+        if entry is not None:
+            configs.append(entry.data)
+    for _, content in storage.iter_config_bytes():
+        try:
+            configs.append(decode_json(content))
+        except ValueError:
+            continue
 
+    targets = {}
+    for config in configs:
+        cameras = config.get("cameras") if isinstance(config, dict) else None
+        for camera in cameras if isinstance(cameras, list) else ():
+            target = camera_probe_target(camera)
+            if target is not None:
+                targets[camera_health_key(target)] = target
+    return targets
 
-def validate_config(data: dict) -> bool:
-    if not isinstance(data, dict):
-        return False
-    if "cameras" not in data:
-        return False
-    if not isinstance(data["cameras"], list):
-        return False
-    # 允許空相機列表
-    return True
 
+def load_camera_health() -> dict:
+    entry = config_cache.load(HEALTH_FILE)
+    if entry is None or not isinstance(entry.data, dict):
+        return {}
+    return entry.data
 
-def get_user_config_file(username: str) -> Path:
-    return BASE_DIR / f"viewpoints_{username}.json"
 
+def camera_health_report(cameras) -> bytes:
+    # 監視器 id -> 健康狀態；尚未檢查過的為 unknown
+    index = load_camera_health()
+    health = index.get("cameras") or {}
+    report = {}
+    for camera in cameras if isinstance(cameras, list) else ():
+        target = camera_probe_target(camera)
+        if target is None or not camera.get("id"):
+            continue
+        report[camera["id"]] = health.get(camera_health_key(target)) or {"status": "unknown"}
+    return encode_json({"updated": index.get("updated"), "cameras": report})
 
-def load_users() -> dict:
-    if not USERS_FILE.exists():
-        return {}
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return {}
 
+class CameraProber:
+    """
+    定期檢查所有監視器來源是否可用，結果寫入健康索引 (HEALTH_FILE)
 
-def save_users(users: dict):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    檢查對象為監控點資料庫、預設配置與所有使用者配置，相同來源只檢查一次：
+    影像確認上游回應影像，HLS 確認播放清單，YouTube 以 oEmbed 確認影片存在且公開。
+    快照快取在檢查週期內成功抓取過的影像直接視為可用，不另外請求。
+    同時最多 CAMERA_PROBE_CONCURRENCY 個檢查，同一主機依序進行並保持間隔。
 
+    多 worker 時只有取得 camera-prober 檔案鎖的 worker 進行檢查，
+    所有 worker 都從索引檔讀取結果 (load_camera_health)。
+    """
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    def __init__(self, cache: SnapshotCache):
+        self.cache = cache
+        self.leader = False
+        self.probes = 0
+        self.reused = 0
+        self.failures = 0
+        self.rounds = 0
+        self.scans = 0
+        self._targets: dict = {}
+        self._health: "dict[str, dict]" = {}
+        self._checked: "dict[str, float]" = {}
+        self._hosts: "dict[str, asyncio.Lock]" = {}
+        self._host_last: "dict[str, float]" = {}
+        self._slots = asyncio.Semaphore(CAMERA_PROBE_CONCURRENCY)
+        self._lock_fd: Optional[int] = None
+        self._dirty = False
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Viewpoints camera prober"
+        self._session.mount("http://", PinnedHTTPAdapter())
+        self._session.mount("https://", PinnedHTTPAdapter())
 
+    async def run(self):
+        self._slots = asyncio.Semaphore(CAMERA_PROBE_CONCURRENCY)
+        try:
+            while not self._acquire_leadership():
+                # 其他 worker 正在檢查；該 worker 結束後由這裡接手
+                await asyncio.sleep(CAMERA_PROBE_RESCAN_INTERVAL)
+            self.leader = True
+            self._load_index(await run_in_threadpool(load_camera_health))
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+            generation = None
+            scanned_at = float("-inf")
+            while True:
+                now = time.monotonic()
+                if now - scanned_at >= CAMERA_PROBE_INTERVAL or generation != generations.value("configs"):
+                    generation = generations.value("configs")
+                    self._set_targets(await run_in_threadpool(camera_probe_targets))
+                    scanned_at = now
+                    self.scans += 1
 
+                wall_now = time.time()
+                due = sorted(
+                    (key for key in self._targets if wall_now - self._checked.get(key, 0) >= CAMERA_PROBE_INTERVAL),
+                    key=lambda key: self._checked.get(key, 0),
+                )
+                if due:
+                    await self._probe_all(due)
+                    self.rounds += 1
+                    self._hosts.clear()
+                if self._dirty:
+                    await self._flush()
+                await asyncio.sleep(CAMERA_PROBE_RESCAN_INTERVAL)
+        finally:
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            self.leader = False
 
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    def _acquire_leadership(self) -> bool:
+        if fcntl is None:
+            return True
+        LOCK_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(LOCK_DIR / "camera-prober.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 行程結束前一直持有
+        self._lock_fd = fd
+        return True
 
+    def _load_index(self, index: dict):
+        # 沿用上次的結果，重新啟動後不必立即重新檢查全部來源
+        for key, entry in (index.get("cameras") or {}).items():
+            try:
+                checked = datetime.fromisoformat(entry["checkedAt"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                continue
+            self._health[key] = entry
+            self._checked[key] = checked
 
-async def get_current_user(
-    token_header: Optional[str] = Depends(oauth2_scheme),
-    token: Optional[str] = None
-):
-    # 如果 header 沒有 token，嘗試從 query params 獲取
-    actual_token = token_header
-    if not actual_token and token:
-        actual_token = token
+    def _set_targets(self, targets: dict):
+        self._targets = targets
+        for key in self._health.keys() - targets.keys():
+            del self._health[key]
+            self._checked.pop(key, None)
+            self._dirty = True
 
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    if not actual_token:
-        raise credentials_exception
-    try:
-        payload = jwt.decode(actual_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        return username
-    except JWTError:
-        raise credentials_exception
+    async def _probe_all(self, keys: list):
+        probes = asyncio.gather(*(self._probe(key, self._targets[key]) for key in keys))
+        try:
+            while True:
+                done, _ = await asyncio.wait({probes}, timeout=CAMERA_HEALTH_FLUSH_INTERVAL)
+                if done:
+                    return
+                await self._flush()
+        except BaseException:
+            probes.cancel()
+            # 取走取消後的結果，關閉時才不會出現 "exception was never retrieved"
+            probes.add_done_callback(lambda future: future.cancelled() or future.exception())
+            raise
 
+    async def _probe(self, key: str, target: tuple):
+        kind, source = target
+        if kind == "image" and self.cache.fetched_within(source, CAMERA_PROBE_INTERVAL):
+            self.reused += 1
+            self._record(key, None, None)
+            return
+        url = source
+        if kind == "youtube":
+            url = YOUTUBE_OEMBED_URL + "?" + requests.compat.urlencode(
+                {"url": f"https://www.youtube.com/watch?v={source}", "format": "json"}
+            )
 
-class UserAuth(BaseModel):
-    username: str
-    password: str
+        host = requests.utils.urlparse(url).hostname or ""
+        lock = self._hosts.setdefault(host, asyncio.Lock())
+        async with lock:
+            wait = self._host_last.get(host, float("-inf")) + CAMERA_PROBE_HOST_DELAY - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                async with self._slots:
+                    started = time.monotonic()
+                    error = await run_in_threadpool(self._check, kind, url)
+                    latency = time.monotonic() - started
+            except Exception as e:
+                error, latency = str(e), None
+            finally:
+                self._host_last[host] = time.monotonic()
+        self.probes += 1
+        if error is not None:
+            self.failures += 1
+        self._record(key, error, latency)
 
+    def _check(self, kind: str, url: str) -> Optional[str]:
+        # 在 threadpool 中執行；可用時回傳 None，否則回傳原因
+        try:
+            for _ in range(SNAPSHOT_MAX_REDIRECTS + 1):
+                with self._session.get(
+                    url, timeout=CAMERA_PROBE_TIMEOUT, stream=True, allow_redirects=False
+                ) as response:
+                    if response.is_redirect:
+                        url = requests.compat.urljoin(url, response.headers["location"])
+                        continue
+                    if response.status_code != 200:
+                        return f"HTTP {response.status_code}"
+                    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                    if kind == "image":
+                        if not content_type.startswith("image/") and content_type != "multipart/x-mixed-replace":
+                            return f"上游回應不是影像: {content_type or '未知類型'}"
+                    elif kind == "hls":
+                        head = next(response.iter_content(CAMERA_PROBE_READ_BYTES), b"")
+                        if not head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"#EXTM3U"):
+                            return "上游回應不是 HLS 播放清單"
+                    return None
+            return "重新導向次數過多"
+        except SnapshotError as e:
+            return str(e)
+        except requests.RequestException as e:
+            return f"無法連線: {e}"
 
-def create_backup(username: Optional[str] = None):
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    
-    target_file = get_user_config_file(username) if username else CONFIG_FILE
-    
-    if not target_file.exists():
-        return
+    def _record(self, key: str, error: Optional[str], latency: Optional[float]):
+        previous = self._health.get(key) or {}
+        now = datetime.now().isoformat(timespec="seconds")
+        if error is None:
+            entry = {
+                "status": "up",
+                "checkedAt": now,
+                "lastSuccess": now,
+                "latencyMs": round(latency * 1000) if latency is not None else previous.get("latencyMs"),
+                "failures": 0,
+            }
+        else:
+            failures = previous.get("failures", 0) + 1
+            # 曾經可用的來源連續失敗 CAMERA_DOWN_AFTER 次才判定離線
+            down = failures >= CAMERA_DOWN_AFTER or previous.get("status") != "up"
+            entry = {
+                "status": "down" if down else "up",
+                "checkedAt": now,
+                "lastSuccess": previous.get("lastSuccess"),
+                "latencyMs": previous.get("latencyMs"),
+                "failures": failures,
+                "error": error,
+            }
+        self._health[key] = entry
+        self._checked[key] = time.time()
+        self._dirty = True
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    prefix = f"viewpoints_{username}_" if username else "viewpoints_"
-    backup_filename = f"{prefix}{timestamp}_{uuid.uuid4().hex[:8]}.json"
-    backup_path = BACKUP_DIR / backup_filename
+    async def _flush(self):
+        # 在事件迴圈中序列化 (檢查仍在更新 _health)，寫檔交給 threadpool
+        self._dirty = False
+        body = encode_json({"updated": datetime.now().isoformat(timespec="seconds"), "cameras": self._health})
+        await run_in_threadpool(atomic_write_bytes, HEALTH_FILE, body)
 
-    shutil.copy2(target_file, backup_path)
+    def stats(self) -> dict:
+        return {
+            "enabled": CAMERA_PROBER,
+            "leader": self.leader,
+            "cameras": len(self._targets),
+            "up": sum(1 for entry in self._health.values() if entry["status"] == "up"),
+            "down": sum(1 for entry in self._health.values() if entry["status"] == "down"),
+            "probes": self.probes,
+            "reused": self.reused,
+            "failures": self.failures,
+            "rounds": self.rounds,
+            "scans": self.scans,
+        }
 
-    backups = sorted(
-        [
-            f
-            for f in os.listdir(BACKUP_DIR)
-            if f.startswith("viewpoints_") and f.endswith(".json")
-        ]
-    )
 
-    while len(backups) > MAX_BACKUPS:
-        oldest = backups.pop(0)
-        try:
-            (BACKUP_DIR / oldest).unlink()
-        except:
-            pass
+camera_prober = CameraProber(snapshot_cache)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if await run_in_threadpool(precompress_static_assets):
+        await run_in_threadpool(static_files.refresh)
+    static_watcher = asyncio.create_task(static_files.watch(STATIC_WATCH_INTERVAL))
+    events_watcher = asyncio.create_task(config_events.watch(CONFIG_EVENTS_POLL_INTERVAL))
+    snapshot_task = asyncio.create_task(snapshot_scheduler.run()) if SNAPSHOT_SCHEDULER else None
+    prober_task = asyncio.create_task(camera_prober.run()) if CAMERA_PROBER else None
+    yield
+    static_watcher.cancel()
+    events_watcher.cancel()
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    if prober_task is not None:
+        prober_task.cancel()
+    # 多 worker 模式下子行程以 os._exit 結束，不會執行 concurrent.futures 的清理，
+    # 需在此等行程池結束，否則雜湊行程會成為孤兒
+    await run_in_threadpool(password_hasher.shutdown, True)
 
 
 app = FastAPI(
-    title="Viewpoints API", description="監視器牆配置管理 API", version="1.0.0"
+    title="Viewpoints API",
+    description="監視器牆配置管理 API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request, exc):
+    return JSONResponse(
+        content={"detail": "伺服器忙碌中，請稍後再試"},
+        status_code=503,
+        headers={"Retry-After": str(HASH_RETRY_AFTER)},
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(APIGZipMiddleware, minimum_size=API_GZIP_MIN_SIZE)
 
 
 # --- Auth API ---
 
 @app.post("/api/auth/register")
-def register(user: UserAuth):
-    users = load_users()
-    if user.username in users:
+async def register(user: UserAuth):
+    if await run_in_threadpool(storage.get_user, user.username) is not None:
         raise HTTPException(status_code=400, detail="使用者名稱已存在")
     
-    users[user.username] = {
-        "password": get_password_hash(user.password),
+    record = {
+        "password": await password_hasher.hash(user.password),
         "created_at": datetime.now().isoformat()
     }
-    save_users(users)
+    if not await run_in_threadpool(storage.create_user, user.username, record):
+        raise HTTPException(status_code=400, detail="使用者名稱已存在")
     return {"success": True, "message": "註冊成功"}
 
 
 @app.post("/api/auth/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    users = load_users()
-    user = users.get(form_data.username)
-    if not user or not verify_password(form_data.password, user["password"]):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await run_in_threadpool(storage.get_user, form_data.username)
+    if not user or not await password_hasher.verify(form_data.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="帳號或密碼錯誤",
@@ -248,6 +3670,11 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": access_token, "token_type": "bearer", "username": form_data.username}
 
 
+@app.get("/api/auth/cache")
+def get_token_cache_stats(username: str = Depends(get_current_user)):
+    return token_cache.stats()
+
+
 @app.get("/api/auth/me")
 def get_me(username: str = Depends(get_current_user)):
     return {"username": username}
@@ -256,38 +3683,35 @@ def get_me(username: str = Depends(get_current_user)):
 # --- Config API ---
 
 
+def current_config(username: str) -> CachedConfig:
+    # 使用者尚未儲存過配置時回傳 viewpoints.json，再沒有則回傳預設配置
+    return storage.load_config(username) or config_cache.load(CONFIG_FILE) or DEFAULT_CONFIG_ENTRY
+
+
 @app.get("/api/config")
-def get_config(username: str = Depends(get_current_user)):
+def get_config(
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
     try:
-        user_config = get_user_config_file(username)
-        if not user_config.exists():
-            # 回傳預設配置
-            if CONFIG_FILE.exists():
-                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            return {"title": "我的監視器牆", "cameras": [], "autoRefresh": True, "refreshInterval": 60}
-
-        with open(user_config, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        return data
+        entry = current_config(username)
+        return conditional_response(entry.body, entry.etag, if_none_match)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.post("/api/config")
-def save_config(config: dict, username: str = Depends(get_current_user)):
+async def save_config(config: dict, username: str = Depends(get_current_user)):
     try:
         if not validate_config(config):
             return JSONResponse(
                 content={"error": "配置文件格式驗證失敗"}, status_code=400
             )
 
-        create_backup(username)
-
-        user_config = get_user_config_file(username)
-        with open(user_config, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        async with config_write_lock(username):
+            await run_in_threadpool(storage.save_config, username, config)
+        config_events.notify(username)
+        snapshot_scheduler.config_changed(username)
 
         return {
             "success": True,
@@ -298,6 +3722,410 @@ def save_config(config: dict, username: str = Depends(get_current_user)):
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+@app.get("/api/config/cache")
+def get_config_cache_stats(username: str = Depends(get_current_user)):
+    return config_cache.stats()
+
+
+@app.get("/api/config/events")
+async def config_event_stream(
+    username: str = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    配置變更通知 (Server-Sent Events)
+
+    連線時與每次配置變更都送出 `event: config`，id 為配置的 ETag、data 為完整配置。
+    瀏覽器重新連線時會帶上 Last-Event-ID，配置未變更就不重送。
+    """
+
+    async def stream():
+        wakeup = config_events.subscribe(username)
+        try:
+            sent_etag = last_event_id
+            yield f"retry: {CONFIG_EVENTS_RETRY_MS}\n\n"
+            while True:
+                wakeup.clear()
+                entry = await run_in_threadpool(current_config, username)
+                if entry.etag != sent_etag:
+                    sent_etag = entry.etag
+                    yield f"event: config\nid: {entry.etag}\ndata: {entry.body.decode('utf-8')}\n\n"
+                try:
+                    await asyncio.wait_for(wakeup.wait(), CONFIG_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            config_events.unsubscribe(username, wakeup)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/config/events/stats")
+def get_config_event_stats(username: str = Depends(get_current_user)):
+    return config_events.stats()
+
+
+# --- Snapshot API ---
+
+
+@app.get("/api/snapshot/cache")
+def get_snapshot_cache_stats(username: str = Depends(get_current_user)):
+    return snapshot_cache.stats()
+
+
+@app.get("/api/snapshot/scheduler")
+def get_snapshot_scheduler_stats(username: str = Depends(get_current_user)):
+    return snapshot_scheduler.stats()
+
+
+@app.get("/api/snapshot/archive")
+def get_snapshot_archive_stats(username: str = Depends(get_current_user)):
+    return snapshot_archive.stats()
+
+
+@app.get("/api/snapshot/{camera_id}")
+async def get_snapshot(
+    camera_id: str,
+    request: Request,
+    w: Optional[int] = None,
+    username: str = Depends(get_current_user),
+):
+    """
+    取得監視器目前的影像
+
+    同一張影像所有使用者共用快取，每個刷新間隔最多向上游抓取一次。
+    排程器已在抓取的影像直接回傳最新的一張。
+    ?w= 取得縮圖；瀏覽器支援時 (Accept: image/webp) 改以 WebP 回傳。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    camera = find_image_camera(config, camera_id)
+    if camera is None:
+        return JSONResponse(content={"error": "找不到此影像監視器"}, status_code=404)
+
+    interval = snapshot_interval(config)
+    try:
+        frame = await latest_snapshot(camera["imageUrl"], interval)
+    except SnapshotError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=502)
+
+    key = snapshot_variant_key(w, request.headers.get("accept", ""))
+    variant = await snapshot_cache.variant(camera["imageUrl"], frame, key)
+    headers = {
+        "ETag": variant.etag,
+        "Last-Modified": frame.last_modified,
+        "Cache-Control": "private, no-cache",
+        **snapshot_refresh_headers(frame, interval),
+    }
+    if SNAPSHOT_WEBP:
+        headers["Vary"] = "Accept"
+    if snapshot_not_modified(request.headers, variant.etag, frame.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=variant.body, media_type=variant.content_type, headers=headers)
+
+
+@app.get("/api/snapshot/{camera_id}/stream")
+async def stream_snapshot(
+    camera_id: str,
+    w: Optional[int] = None,
+    username: str = Depends(get_current_user),
+):
+    """
+    監視器影像的 MJPEG 串流 (multipart/x-mixed-replace，可直接作為 <img> 的 src)
+
+    與 /api/snapshot/{camera_id} 共用上游抓取與快取，只有影像內容變更時才送出新的一張。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    camera = find_image_camera(config, camera_id)
+    if camera is None:
+        return JSONResponse(content={"error": "找不到此影像監視器"}, status_code=404)
+
+    url = camera["imageUrl"]
+    interval = snapshot_interval(config)
+    # 串流只能是 JPEG，不轉 WebP
+    key = snapshot_variant_key(w, "")
+
+    async def stream():
+        wakeup = snapshot_cache.subscribe(url)
+        try:
+            sent_etag = None
+            sent_at = 0.0
+            while True:
+                wakeup.clear()
+                try:
+                    frame = await latest_snapshot(url, interval)
+                except SnapshotError:
+                    frame = None
+                if frame is not None and (
+                    frame.etag != sent_etag or time.monotonic() - sent_at >= SNAPSHOT_STREAM_RESEND
+                ):
+                    variant = await snapshot_cache.variant(url, frame, key)
+                    sent_etag = frame.etag
+                    sent_at = time.monotonic()
+                    yield (
+                        f"--{SNAPSHOT_STREAM_BOUNDARY}\r\n"
+                        f"Content-Type: {variant.content_type}\r\n"
+                        f"Content-Length: {len(variant.body)}\r\n\r\n"
+                    ).encode("ascii") + variant.body + b"\r\n"
+                # 排程器或其他請求抓到新影像時立即喚醒；否則等到該重新抓取時再自行抓取
+                timeout = interval
+                if frame is not None:
+                    timeout = max(1, frame.refresh_at(interval) - time.monotonic())
+                try:
+                    await asyncio.wait_for(wakeup.wait(), min(timeout, SNAPSHOT_STREAM_RESEND))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            snapshot_cache.unsubscribe(url, wakeup)
+
+    return StreamingResponse(
+        stream(),
+        media_type=f"multipart/x-mixed-replace; boundary={SNAPSHOT_STREAM_BOUNDARY}",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/snapshot/{camera_id}/history")
+async def get_snapshot_history(
+    camera_id: str,
+    since: float = 0,
+    limit: int = SNAPSHOT_HISTORY_LIMIT,
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    列出磁碟封存中 since (Unix 時間，秒) 之後的影像，由舊到新，供縮時播放
+
+    每張影像以 /api/snapshot/{id}/history/{frame id} 取得；超過 limit 張時以最後一張的時間接續查詢。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    camera = find_image_camera(config, camera_id)
+    if camera is None:
+        return JSONResponse(content={"error": "找不到此影像監視器"}, status_code=404)
+    limit = min(max(limit, 1), SNAPSHOT_HISTORY_LIMIT)
+    frames = await run_in_threadpool(snapshot_archive.history, camera["imageUrl"], since, limit)
+    body = encode_json({"frames": frames})
+    return conditional_response(body, make_etag(body), if_none_match)
+
+
+@app.get("/api/snapshot/{camera_id}/history/{frame_id}")
+async def get_snapshot_history_frame(
+    camera_id: str,
+    frame_id: str,
+    username: str = Depends(get_current_user),
+):
+    config = (await run_in_threadpool(current_config, username)).data
+    camera = find_image_camera(config, camera_id)
+    if camera is None:
+        return JSONResponse(content={"error": "找不到此影像監視器"}, status_code=404)
+    archived = await run_in_threadpool(snapshot_archive.frame, camera["imageUrl"], frame_id)
+    if archived is None:
+        return JSONResponse(content={"error": "影像已不在封存中"}, status_code=404)
+    body, content_type, archived_at = archived
+    # 同一個 id 的內容不會改變 (被覆寫後即找不到)
+    return Response(
+        content=body,
+        media_type=content_type,
+        headers={
+            "Cache-Control": "private, max-age=86400",
+            "Last-Modified": formatdate(archived_at, usegmt=True),
+        },
+    )
+
+
+# --- HLS API ---
+
+
+@app.get("/api/hls/cache")
+def get_hls_cache_stats(username: str = Depends(get_current_user)):
+    return hls_cache.stats()
+
+
+@app.get("/api/hls/{camera_id}/index.m3u8")
+async def get_hls_index(
+    camera_id: str,
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    經由伺服器代理的 HLS 播放清單 (video.js 無法帶 Authorization header，可用 ?token=)
+
+    清單中的網址改寫為經由代理並附上簽章，之後的播放清單與片段請求不需驗證。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    camera = find_hls_camera(config, camera_id)
+    if camera is None:
+        return JSONResponse(content={"error": "找不到此 HLS 監視器"}, status_code=404)
+    try:
+        playlist = await hls_cache.playlist(camera["hlsUrl"])
+    except HLSError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=502)
+    return hls_playlist_response(playlist, camera_id, username, if_none_match)
+
+
+@app.get("/api/hls/{camera_id}/playlist/{signature}")
+async def get_hls_playlist(
+    camera_id: str,
+    signature: str,
+    u: str,
+    exp: int,
+    user: str,
+    if_none_match: Optional[str] = Header(None),
+):
+    url = hls_source_url("playlist", camera_id, user, exp, signature, u)
+    if url is None or not await hls_camera_configured(user, camera_id):
+        return JSONResponse(content={"error": "無效的播放清單網址"}, status_code=404)
+    try:
+        playlist = await hls_cache.playlist(url)
+    except HLSError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=502)
+    return hls_playlist_response(playlist, camera_id, user, if_none_match)
+
+
+@app.get("/api/hls/{camera_id}/segment/{signature}")
+async def get_hls_segment(camera_id: str, signature: str, u: str, exp: int, user: str):
+    url = hls_source_url("segment", camera_id, user, exp, signature, u)
+    if url is None or not await hls_camera_configured(user, camera_id):
+        return JSONResponse(content={"error": "無效的片段網址"}, status_code=404)
+    try:
+        segment = await hls_cache.segment(url)
+    except HLSError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=502)
+    return Response(
+        content=segment.body,
+        media_type=segment.content_type,
+        headers={"Cache-Control": HLS_SEGMENT_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"},
+    )
+
+
+# --- Health API ---
+
+
+@app.get("/api/health/prober")
+def get_camera_prober_stats(username: str = Depends(get_current_user)):
+    return camera_prober.stats()
+
+
+@app.get("/api/health/catalog")
+async def get_catalog_health(
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """監控點資料庫中各監視器的健康狀態 (供選擇器標示離線的監視器)"""
+    catalog = await run_in_threadpool(config_cache.load, CATALOG_FILE)
+    cameras = catalog.data.get("cameras") if catalog is not None and isinstance(catalog.data, dict) else None
+    body = await run_in_threadpool(camera_health_report, cameras)
+    return conditional_response(body, make_etag(body), if_none_match)
+
+
+# --- Wall API ---
+
+
+@app.get("/api/wall/status")
+async def get_wall_status(
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    一次取得所有影像監視器目前影像的版本
+
+    監控牆比對 version，只重新載入有變化的監視器。X-Next-Refresh 為建議下一次查詢的秒數。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    interval = snapshot_interval(config)
+    cameras = [
+        camera for camera in config.get("cameras") or ()
+        if isinstance(camera, dict) and isinstance(camera.get("imageUrl"), str)
+    ]
+    results = await asyncio.gather(
+        *(latest_snapshot(camera["imageUrl"], interval) for camera in cameras),
+        return_exceptions=True,
+    )
+
+    status = {}
+    delays = []
+    for camera, result in zip(cameras, results):
+        if isinstance(result, Exception):
+            status[camera.get("id")] = {"error": str(result)}
+            continue
+        status[camera.get("id")] = {"version": result.etag, "lastModified": result.last_modified}
+        delays.append(snapshot_refresh_delay(result, interval))
+    next_refresh = min(delays, default=math.ceil(interval))
+
+    # 版本沒變時回 304；建議時間放在標頭，不影響 ETag
+    body = encode_json({"cameras": status})
+    return conditional_response(
+        body, make_etag(body), if_none_match, headers={"X-Next-Refresh": str(next_refresh)}
+    )
+
+
+@app.get("/api/wall/health")
+async def get_wall_health(
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    目前配置中各監視器的健康狀態
+
+    status 為 up / down / unknown，另有 lastSuccess、latencyMs 與 checkedAt。
+    """
+    config = (await run_in_threadpool(current_config, username)).data
+    body = await run_in_threadpool(camera_health_report, config.get("cameras"))
+    return conditional_response(body, make_etag(body), if_none_match)
+
+
+async def current_mosaic(username: str, w: Optional[int]) -> Mosaic:
+    width = next((size for size in MOSAIC_WIDTHS if size >= w), MOSAIC_WIDTHS[-1]) if w else MOSAIC_DEFAULT_WIDTH
+    config = await run_in_threadpool(current_config, username)
+    return await mosaic_cache.get(config, width)
+
+
+@app.get("/api/wall/mosaic.jpg")
+async def get_wall_mosaic(
+    request: Request,
+    w: Optional[int] = None,
+    username: str = Depends(get_current_user),
+):
+    """
+    將所有影像監視器依監控牆版面拼成一張 JPEG
+
+    低階顯示裝置每個刷新週期只需一次請求；各監視器的位置見 /api/wall/mosaic.json。
+    """
+    if PILImage is None:
+        return JSONResponse(content={"error": "伺服器未安裝 pillow，無法拼接影像"}, status_code=501)
+    mosaic = await current_mosaic(username, w)
+    if not mosaic.layout["tiles"]:
+        return JSONResponse(content={"error": "配置中沒有影像監視器"}, status_code=404)
+    headers = {
+        "ETag": mosaic.etag,
+        "Last-Modified": mosaic.last_modified,
+        "Cache-Control": "private, no-cache",
+    }
+    if snapshot_not_modified(request.headers, mosaic.etag, mosaic.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=mosaic.body, media_type="image/jpeg", headers=headers)
+
+
+@app.get("/api/wall/mosaic.json")
+async def get_wall_mosaic_layout(
+    w: Optional[int] = None,
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    if PILImage is None:
+        return JSONResponse(content={"error": "伺服器未安裝 pillow，無法拼接影像"}, status_code=501)
+    mosaic = await current_mosaic(username, w)
+    return conditional_response(mosaic.layout_body, mosaic.layout_etag, if_none_match)
+
+
+@app.get("/api/wall/mosaic/cache")
+def get_wall_mosaic_cache_stats(username: str = Depends(get_current_user)):
+    return mosaic_cache.stats()
+
+
 @app.head("/api/config/download")
 def download_config_head():
     if not CONFIG_FILE.exists():
@@ -306,18 +4134,21 @@ def download_config_head():
 
 
 @app.get("/api/config/download")
-def download_config(username: str = Depends(get_current_user)):
+def download_config(
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
     try:
-        user_config = get_user_config_file(username)
-        if not user_config.exists():
+        entry = storage.load_config(username)
+        if entry is None:
             return JSONResponse(content={"error": "配置文件不存在"}, status_code=404)
 
-        with open(user_config, "r", encoding="utf-8") as f:
-            content = f.read()
-
-        return Response(
-            content=content,
-            media_type="application/json",
+        # 只有下載的檔案以縮排排版，方便閱讀與編輯
+        content = encode_json(entry.data, pretty=True)
+        return conditional_response(
+            content,
+            make_etag(content),
+            if_none_match,
             headers={
                 "Content-Disposition": f'attachment; filename="viewpoints_{username}.json"',
             },
@@ -329,57 +4160,58 @@ def download_config(username: str = Depends(get_current_user)):
 @app.get("/api/config/backups")
 def list_backups(username: str = Depends(get_current_user)):
     try:
-        if not BACKUP_DIR.exists():
-            return {"backups": []}
+        return {"backups": storage.list_backups(username)}
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        backups = []
-        prefix = f"viewpoints_{username}_"
-        for f in os.listdir(BACKUP_DIR):
-            if f.startswith(prefix) and f.endswith(".json"):
-                filepath = BACKUP_DIR / f
-                stat = filepath.stat()
-                backups.append(
-                    {
-                        "filename": f,
-                        "size": stat.st_size,
-                        "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    }
-                )
 
-        backups.sort(key=lambda x: x["modified"], reverse=True)
-        return {"backups": backups}
+@app.get("/api/config/backups/{filename}/download")
+def download_backup(
+    filename: str,
+    username: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    try:
+        filename = check_backup_filename(filename, username)
+
+        content = storage.read_backup(username, filename)
+        if content is None:
+            return JSONResponse(content={"error": "備份檔案不存在"}, status_code=404)
+
+        content = encode_json(decode_json(content), pretty=True)
+        return conditional_response(
+            content,
+            make_etag(content),
+            if_none_match,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.post("/api/config/backups/{filename}/restore")
-def restore_backup(filename: str, username: str = Depends(get_current_user)):
+async def restore_backup(filename: str, username: str = Depends(get_current_user)):
     try:
-        if not filename.endswith(".json"):
-            filename += ".json"
-
-        # 安全性檢查：確保檔名屬於該使用者
-        if not filename.startswith(f"viewpoints_{username}_"):
-            raise HTTPException(status_code=403, detail="無權存取此備份檔")
+        filename = check_backup_filename(filename, username)
 
-        backup_path = BACKUP_DIR / filename
+        async with config_write_lock(username):
+            content = await run_in_threadpool(storage.read_backup, username, filename)
 
-        if not backup_path.exists():
-            return JSONResponse(content={"error": "備份檔案不存在"}, status_code=404)
-
-        with open(backup_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+            if content is None:
+                return JSONResponse(content={"error": "備份檔案不存在"}, status_code=404)
 
-        if not validate_config(data):
-            return JSONResponse(
-                content={"error": "備份檔案格式驗證失敗"}, status_code=400
-            )
+            data = decode_json(content)
 
-        create_backup(username)
+            if not validate_config(data):
+                return JSONResponse(
+                    content={"error": "備份檔案格式驗證失敗"}, status_code=400
+                )
 
-        user_config = get_user_config_file(username)
-        with open(user_config, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            await run_in_threadpool(storage.save_config, username, data)
+        config_events.notify(username)
+        snapshot_scheduler.config_changed(username)
 
         return {
             "success": True,
@@ -392,17 +4224,102 @@ def restore_backup(filename: str, username: str = Depends(get_current_user)):
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
-app.mount("/", SPAStaticFiles(directory=str(BASE_DIR), html=True), name="static")
+static_files = SPAStaticFiles(directory=str(BASE_DIR), html=True)
+app.mount("/", static_files, name="static")
+
+
+def run_worker(sock: socket.socket):
+    # 以 spawn 啟動的子行程已重新匯入本檔案 (__mp_main__)，直接使用其中的 app
+    import uvicorn
+
+    config = uvicorn.Config(app, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+WORKER_RESTART_DELAY = 1.0
+
+
+def serve_workers(workers: int):
+    """
+    以多個 worker 行程提供服務
+
+    主行程建立監聽 socket 後交給各 worker。TCP_NODELAY 需自行設定：
+    uvicorn 內建的多 worker 模式沒有設定，keep-alive 連線每個回應會多等約 40ms。
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(("0.0.0.0", PORT))
+    sock.listen(2048)
+
+    # worker 依此得知有多個行程 (例如 SNAPSHOT_SHARED)
+    os.environ["VIEWPOINTS_WORKERS"] = str(workers)
+    context = multiprocessing.get_context("spawn")
+
+    def start_worker(index: int):
+        process = context.Process(target=run_worker, args=(sock,), name=f"viewpoints-worker-{index}")
+        process.start()
+        return process
+
+    processes = [start_worker(i) for i in range(workers)]
+
+    # SIGTERM (例如 Heroku 重啟) 與 Ctrl+C 相同處理：結束所有 worker
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # 與 uvicorn 的 supervisor 相同：worker 意外結束就補一個新的，
+        # 稍候再啟動以免啟動即崩潰時不停重生
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+            for index, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                process.join()
+                print(f"⚠️ worker {process.name} 已結束 (exit code {process.exitcode})，重新啟動")
+                time.sleep(WORKER_RESTART_DELAY)
+                processes[index] = start_worker(index)
+    except (KeyboardInterrupt, SystemExit):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
 
+    parser = argparse.ArgumentParser(description="Viewpoints 統一伺服器 (FastAPI 版本)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("VIEWPOINTS_WORKERS", 1)),
+        help="uvicorn worker 行程數",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    migrate = subparsers.add_parser("migrate", help="將 JSON 檔案資料匯入 SQLite")
+    migrate.add_argument("--db", default=str(SQLITE_DB), help="SQLite 資料庫路徑")
+    subparsers.add_parser("compress", help="為靜態資源產生 .gz/.br 預先壓縮檔")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_to_sqlite(SQLiteStorage(Path(args.db)))
+        sys.exit(0)
+
+    if args.command == "compress":
+        print(f"✅ 已產生 {precompress_static_assets()} 個壓縮檔")
+        sys.exit(0)
+
+    if args.workers > 1 and fcntl is None:
+        print("❌ 此平台不支援跨行程檔案鎖，無法使用多個 worker")
+        sys.exit(1)
+
     print("=" * 60)
     print("Viewpoints 統一伺服器 (FastAPI 版本)")
     print("=" * 60)
     print("")
     print(f"存取位址: http://localhost:{PORT}")
+    print(f"儲存後端: {storage.name}")
+    print(f"Worker 數: {args.workers}")
     print("")
     print("頁面：")
     print(f"  - 監控牆:     http://localhost:{PORT}/")
@@ -410,13 +4327,28 @@ if __name__ == "__main__":
     print(f"  - 上傳配置:   http://localhost:{PORT}/upload.html")
     print("")
     print("API：")
+    print(f"  - GET    /api/auth/cache             - Token 快取統計")
     print(f"  - GET    /api/config                 - 讀取配置")
     print(f"  - POST   /api/config                 - 儲存配置")
     print(f"  - GET    /api/config/download        - 下載配置")
     print(f"  - GET    /api/config/backups         - 列出備份")
+    print(f"  - GET    /api/config/backups/{{name}}/download - 下載備份")
     print(f"  - POST   /api/config/backups/{{name}}/restore - 恢復備份")
+    print(f"  - GET    /api/config/cache           - 配置快取統計")
+    print(f"  - GET    /api/config/events          - 配置變更通知 (SSE)")
+    print(f"  - GET    /api/snapshot/{{id}}          - 監視器影像代理")
+    print(f"  - GET    /api/snapshot/{{id}}/stream   - 監視器影像串流 (MJPEG)")
+    print(f"  - GET    /api/snapshot/{{id}}/history  - 監視器影像封存 (縮時播放)")
+    print(f"  - GET    /api/hls/{{id}}/index.m3u8    - HLS 串流代理")
+    print(f"  - GET    /api/wall/status            - 監控牆影像版本")
+    print(f"  - GET    /api/wall/mosaic.jpg        - 監控牆拼接影像")
+    print(f"  - GET    /api/wall/health            - 監控牆各監視器健康狀態")
+    print(f"  - GET    /api/health/catalog         - 監控點資料庫健康狀態")
     print("")
     print("按 Ctrl+C 停止伺服器")
     print("=" * 60)
 
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if args.workers > 1:
+        serve_workers(args.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=PORT, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)